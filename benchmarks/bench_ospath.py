@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for ospath. Creates a synthetic folder tree in the temp folder
+and times the different code paths on it.
+
+Run with `python benchmarks/bench_ospath.py`, or with statistics and a
+comparison to earlier commits with `python -m stimer bench benchmarks`
+
+@author: Simon Kern (@skjerns)
+"""
+import os
+import sys
+import shutil
+import subprocess
+import atexit
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import ospath
+import stimer
+
+IMPORT_BUDGET = 0.020  # maximum time for `import ospath` in seconds
+N_FOLDERS = 200      # folders in the synthetic tree
+N_FILES = 50         # files in each folder
+EXTS = ['png', 'jpg', 'txt', 'edf', 'csv']
+
+_tree = None
+_cache = ospath.ListingCache(min_age=0)
+_snapshot = None
+_dup_tree = None
+
+
+def get_tree():
+    """create the synthetic tree once, it is deleted at exit"""
+    global _tree
+    if _tree is None:
+        _tree = tempfile.mkdtemp(prefix='bench_ospath_')
+        atexit.register(shutil.rmtree, _tree, ignore_errors=True)
+        for i in range(N_FOLDERS):
+            folder = os.path.join(_tree, f'sub{i%10}', f'folder{i}')
+            os.makedirs(folder, exist_ok=True)
+            for j in range(N_FILES):
+                ext = EXTS[j % len(EXTS)]
+                open(os.path.join(folder, f'file{j}.{ext}'), 'w').close()
+    return _tree
+
+
+def bench_import_ospath():
+    """import ospath in a new process and check that it stays within budget"""
+    package_dir = os.path.join(os.path.dirname(__file__), '..')
+    # with a stale or missing bytecode cache, compiling the source takes
+    # twice the budget, so the cache is written first and not timed
+    env = {key: value for key, value in os.environ.items()
+           if key != 'PYTHONDONTWRITEBYTECODE'}
+    subprocess.run([sys.executable, '-c', 'import ospath'], cwd=package_dir, env=env)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ospath'],
+                            cwd=package_dir, capture_output=True, text=True, env=env).stderr
+    # last line: "import time:  self [us] | cumulative | ospath"
+    line = [line for line in output.splitlines() if line.endswith('| ospath')][-1]
+    cumulative = int(line.split('|')[1]) / 1e6
+    assert cumulative < IMPORT_BUDGET, f'import ospath took {cumulative*1000:.1f} ms'
+
+
+PATHS = ['/data/recordings/sub01/eeg/sub01_task-rest_eeg.edf',
+         'C:\\data\\recordings\\sub01\\eeg', '~/data/../data/file.txt',
+         'relative/path/to/file.png', 'file.txt'] * 2000
+
+
+def bench_join_legacy():
+    for path in PATHS:
+        ospath._join_legacy(path)
+        ospath._join_legacy(path, 'subfolder', 'file.txt')
+
+
+def bench_join():
+    for path in PATHS:
+        ospath.join(path)
+        ospath.join(path, 'subfolder', 'file.txt')
+
+
+def bench_splitext():
+    for path in PATHS:
+        ospath.splitext(path)
+
+
+def bench_normalize_many():
+    ospath.normalize_many(PATHS)
+    ospath.join_many(PATHS, 'file.txt')
+
+
+def bench_splitext_many():
+    ospath.splitext_many(PATHS)
+
+
+def bench_list_files_glob():
+    ospath._list_files_glob(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True)
+
+
+def bench_list_files_scandir():
+    ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True)
+
+
+def bench_list_files_profile():
+    # the overhead of profile=True compared to bench_list_files_scandir
+    ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True, profile=True)
+
+
+def bench_list_files_unsorted():
+    ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True, sort=None)
+
+
+def bench_list_files_patterns():
+    ospath.list_files(get_tree(), patterns=['*file1*', '*.edf'], recursive=True)
+
+
+def bench_list_files_workers():
+    ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True, workers=8)
+
+
+def bench_list_files_cached():
+    # the first call fills the cache, all later calls only stat the folders
+    ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True, cache=_cache)
+
+
+def bench_scan_files():
+    ospath.scan_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True)
+
+
+def bench_list_files_getsize():
+    # what scan_files replaces: stat every file again after the listing
+    for file in ospath.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True):
+        os.path.getsize(file), os.path.getmtime(file)
+
+
+def get_snapshot():
+    """snapshot of the unchanged tree, as watch() keeps it between polls"""
+    global _snapshot
+    if _snapshot is None:
+        matcher = ospath.compile_patterns(exts=['png', 'jpg', 'txt'], recursive=True)
+        _snapshot = ospath._Snapshot(get_tree(), matcher, racy=0)
+        _snapshot.scan()
+    return _snapshot
+
+
+def bench_watch_poll():
+    # one poll of watch(backend='poll'): stats all folders and all files
+    get_snapshot().poll(modified=True)
+
+
+def bench_watch_poll_folders():
+    # one poll of watch(backend='poll', modified=False): only the folders
+    get_snapshot().poll(modified=False)
+
+
+def get_dup_tree():
+    """200 files of 256 kB with the same size, every 4th is a copy of the
+    file before it, i.e. 50 pairs of duplicates"""
+    global _dup_tree
+    if _dup_tree is None:
+        _dup_tree = tempfile.mkdtemp(prefix='bench_ospath_dup_')
+        atexit.register(shutil.rmtree, _dup_tree, ignore_errors=True)
+        for i in range(200):
+            content = content if i % 4 == 1 else os.urandom(256 * 1024)
+            with open(os.path.join(_dup_tree, f'file{i}.bin'), 'wb') as f:
+                f.write(content)
+    return _dup_tree
+
+
+def bench_find_duplicates():
+    _, stats = ospath.find_duplicates(get_dup_tree(), return_stats=True)
+    # only the 100 files of the pairs are read completely
+    assert stats['full_files'] == 100, stats
+    assert stats['full_bytes'] == 100 * 256 * 1024, stats
+
+
+def bench_copy_shutil():
+    dst = tempfile.mkdtemp(prefix='bench_ospath_copy_')
+    for file in ospath.list_files(get_dup_tree()):
+        shutil.copy2(file, dst)
+    shutil.rmtree(dst)
+
+
+def bench_copy_files():
+    dst = tempfile.mkdtemp(prefix='bench_ospath_copy_')
+    ospath.copy_files(get_dup_tree(), dst, workers=8)
+    shutil.rmtree(dst)
+
+
+def bench_du():
+    ospath.du(get_tree(), depth=2)
+
+
+def bench_du_by_ext():
+    ospath.du(get_tree(), depth=2, by_ext=True, workers=8)
+
+
+def get_index():
+    """index of the synthetic tree, built once next to it"""
+    index_file = get_tree() + '.idx'
+    if not os.path.exists(index_file):
+        atexit.register(os.remove, index_file)
+        ospath.build_index(get_tree(), index_file)
+    return ospath.FileIndex(index_file)
+
+
+def bench_index_query():
+    get_index().query(exts=['png', 'jpg', 'txt'], recursive=True)
+
+
+def bench_index_query_patterns():
+    get_index().query(patterns=['*file1*', '*.edf'], recursive=True)
+
+
+def bench_list_files_aio():
+    import asyncio
+    asyncio.run(ospath.aio.list_files(get_tree(), exts=['png', 'jpg', 'txt'], recursive=True))
+
+
+def bench_list_folders():
+    ospath.list_folders(get_tree(), recursive=True)
+
+
+def bench_list_folders_workers():
+    ospath.list_folders(get_tree(), recursive=True, workers=8)
+
+
+if __name__ == '__main__':
+    get_tree()
+    bench_list_files_cached()
+    bench_watch_poll()
+    get_index()
+    for name, func in list(globals().items()):
+        if name.startswith('bench_'):
+            stimer.start(name)
+            func()
+            stimer.stop(name)
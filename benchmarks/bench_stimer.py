@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for stimer, mostly the overhead that the timers add to the
+code they measure.
+
+Run with `python benchmarks/bench_stimer.py`, or with statistics and a
+comparison to earlier commits with `python -m stimer bench benchmarks`
+
+@author: Simon Kern (@skjerns)
+"""
+import os
+import sys
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import stimer
+from stimer.events import _EventLog, _write_events
+
+N_SECTIONS = 100000  # timed sections per benchmark
+
+
+def bench_start_stop():
+    for i in range(N_SECTIONS):
+        stimer.start('bench')
+        stimer.stop('bench', verbose=False)
+
+
+def bench_profiler_log_events():
+    prof = stimer.Profiler(log_events=True)
+    for i in range(N_SECTIONS):
+        with prof('section'):
+            pass
+
+
+_export_log = None  # N_SECTIONS events of 10 names
+
+
+def bench_export():
+    # a log of its own, the global one has the events of the benchmarks
+    # that ran before
+    global _export_log
+    if _export_log is None:
+        _export_log = _EventLog(capacity=N_SECTIONS + 1)
+        for i in range(N_SECTIONS):
+            _export_log.record(f'section{i % 10}', i * 1e-6, 1e-6)
+    path = os.path.join(tempfile.gettempdir(), 'bench_stimer.trace.json')
+    _write_events(_export_log.events(), path, format='chrome')
+    os.remove(path)
+
+
+def bench_lapse():
+    for i in range(N_SECTIONS):
+        stimer.lapse(verbose=False)
+
+
+def bench_profiler_with():
+    prof = stimer.Profiler()
+    for i in range(N_SECTIONS):
+        with prof('outer'):
+            with prof('inner'):
+                pass
+    prof.stats()
+
+
+def bench_profiler_unscoped():
+    # the same as bench_profiler_with, without contextvars
+    prof = stimer.Profiler(scoped=False)
+    for i in range(N_SECTIONS):
+        with prof('outer'):
+            with prof('inner'):
+                pass
+    prof.stats()
+
+
+def bench_profiler_kept():
+    # one section that is kept, without the lookup of its name
+    prof = stimer.Profiler()
+    section = prof('section')
+    for i in range(N_SECTIONS):
+        with section:
+            pass
+    prof.stats()
+
+
+def bench_empty_with():
+    # the same loop as bench_profiler_kept with a context manager that
+    # does nothing, the part of a section that can't be avoided
+    section = contextlib.nullcontext()
+    for i in range(N_SECTIONS):
+        with section:
+            pass
+
+
+def bench_profiler_start_stop():
+    prof = stimer.Profiler()
+    for i in range(N_SECTIONS):
+        prof.start('section')
+        prof.stop('section')
+    prof.stats()
+
+
+def bench_profiler_decorator():
+    prof = stimer.Profiler()
+    @prof
+    def func():
+        pass
+    for i in range(N_SECTIONS):
+        func()
+    prof.stats()
+
+
+def bench_profiler_threads():
+    # the same sections as bench_profiler_with, from 4 threads at once
+    prof = stimer.Profiler()
+    def work(n):
+        for i in range(n):
+            with prof('outer'):
+                with prof('inner'):
+                    pass
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(work, [N_SECTIONS // 4] * 4))
+    assert prof.stats()[0]['count'] == N_SECTIONS
+
+
+def _work():
+    total = 0
+    for i in range(N_SECTIONS * 20):
+        total += i * i
+    return total
+
+
+def bench_line_profile():
+    # a loop of N_SECTIONS lines, without profiling it takes a few ms
+    profiler = stimer.LineProfiler()
+    @profiler
+    def loop():
+        total = 0
+        for i in range(N_SECTIONS):
+            total += i
+        return total
+    loop()
+
+
+def bench_work():
+    _work()
+
+
+def bench_work_sampled():
+    # the overhead of the sampling profiler compared to bench_work
+    with stimer.sample():
+        _work()
+
+
+_sampled = None  # (Sampler, thread that waits 20 frames deep)
+
+
+def _wait_deep(depth, ready, done):
+    if depth > 1:
+        return _wait_deep(depth - 1, ready, done)
+    ready.set()
+    done.wait()
+
+
+def bench_sample():
+    # one sample of the sampling profiler, of a thread with 20 frames
+    global _sampled
+    if _sampled is None:
+        ready = threading.Event()
+        thread = threading.Thread(target=_wait_deep, args=(20, ready, threading.Event()),
+                                  daemon=True)
+        thread.start()
+        ready.wait()
+        _sampled = (stimer.Sampler(), thread)
+    _sampled[0]._sample()
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('bench_'):
+            stimer.start(name)
+            func()
+            stimer.stop(name)
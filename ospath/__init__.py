@@ -15,25 +15,59 @@ This file contains wrappers for calls to os.path.
 @author: Simon Kern (@skjerns)
 """
 
-try:
-    from pathlib import Path
-except Exception:
-    print('[ospath] can\'t import Path from pathlib, need Python 3.5+')
 from os import makedirs
 from os.path import *
 import os
-import re
-import fnmatch
-from natsort import natsort_key
+import bisect
+import itertools
+import time
+
+# tkinter, natsort, pathlib, re etc are only imported once they are needed,
+# importing them takes longer than all of ospath and tkinter might not
+# be available at all on headless machines
+_lazy_imports = {'askdirectory': 'tkinter.filedialog',
+                 'asksaveasfilename': 'tkinter.filedialog',
+                 'askopenfilename': 'tkinter.filedialog',
+                 'askopenfilenames': 'tkinter.filedialog',
+                 'simpledialog': 'tkinter.simpledialog',
+                 'Tk': 'tkinter',
+                 'natsort_key': 'natsort',
+                 'Path': 'pathlib',
+                 'aio': 'ospath.aio'}
+
 
+def __getattr__(name):
+    """import the names above on first access, e.g. ospath.natsort_key"""
+    if name not in _lazy_imports:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    import importlib
+    module = importlib.import_module(_lazy_imports[name])
+    if module.__name__.endswith('.' + name):
+        return module
+    return getattr(module, name)
 
-from tkinter.filedialog import askdirectory, asksaveasfilename
-from tkinter.filedialog import askopenfilename, askopenfilenames 
-from tkinter import simpledialog
-from tkinter import  Tk
 
+_posix = os.sep == '/'
+
+
+def _is_normalised(p):
+    """
+    check if a str would be returned unchanged by join(p) on posix, i.e.
+    if it has no backslash, no '~', no '//', no trailing slash and no '.'
+    or '..' parts. Paths starting with a dot always take the full route.
+    """
+    return (p != '' and p[0] not in '~.' and p[-1] != '/' and '//' not in p
+            and '/.' not in p and '\\' not in p)
 
 
+def _normalise(p):
+    """
+    same as join(p), but returns paths that are already normalised
+    right away. All wrappers below use this on the output of os.path.
+    """
+    if _posix and type(p) is str and _is_normalised(p):
+        return p
+    return _join(p)
 
 
 def join(path, *paths):
@@ -45,11 +79,43 @@ def join(path, *paths):
               (see https://stackoverflow.com/questions/1945920/why-doesnt-os-path-join-work-in-this-case) 
     3. All double backslashes and double slashes will be replaces with single slashes using os.path.normpath()
     4. '~' will be converted to the specific USERDIR, only the first path argument will be expanded
+
+    On posix, paths without backslashes, '~', '//', trailing slashes, '.'
+    or '..' are joined directly without normalising them first.
     
     @param path:             A path in all its variations
     @param *paths:           More paths
     @return: joined_path as described above
     """
+    if not _posix or type(path) is not str or not _is_normalised(path):
+        return _join(path, *paths)
+    if not paths:
+        return path
+    parts = [path]
+    for part in paths:
+        if type(part) is not str or not _is_normalised(part):
+            return _join(path, *paths)
+        parts.append(part[1:] if part[0] == '/' else part)
+    # none of the parts is empty or ends with a slash, same as os.path.join
+    return '/'.join(parts)
+
+
+def _join(path, *paths):
+    """full version of join that normalises every path"""
+    path = os.path.expanduser(path)
+    path = os.path.normpath(path)
+    paths = [os.path.normpath(path).replace('\\', '/') for path in paths]
+    paths = [path[1:] if path.startswith('/') else path for path in paths]
+    joined_path = os.path.join(path, *paths)
+    joined_path = joined_path.replace('\\', '/')
+    return joined_path.replace('//', '/').replace('//', '/')
+
+
+def _join_legacy(path, *paths):
+    """
+    Previous implementation of join. Kept as reference for the unittests
+    and benchmarks.
+    """
     path = os.path.expanduser(path)
     path = os.path.normpath(path)
     paths = [os.path.normpath(path) for path in paths]
@@ -62,52 +128,191 @@ def join(path, *paths):
 
 
 def splitext(p):
-    p = join(p)
+    p = _normalise(p)
     return os.path.splitext(p)
 
 
 def split(p):
-    p = join(p)
+    p = _normalise(p)
     return os.path.split(p)
 
 
 def splitdrive(p):
-    p = join(p)
+    p = _normalise(p)
     return os.path.splitdrive(p)
 
 
 def expanduser(p):
     p = os.path.expanduser(p)
-    return join(p)
+    return _normalise(p)
 
 
 def abspath(path):
     path = os.path.abspath(path)
-    return join(path)
+    return _normalise(path)
 
 
 def dirname(path):
     path = os.path.dirname(path)
-    return join(path)
+    return _normalise(path)
 
 
 def relpath(path, start=None):
     path = os.path.relpath(path, start)
-    return join(path)
+    return _normalise(path)
 
 
 def commonpath(paths):
     paths = os.path.commonpath(paths)
-    return join(paths)
+    return _normalise(paths)
+
+
+def _as_list(items):
+    """turn a sequence or numpy array into a list, also tell if it was an array"""
+    if hasattr(items, 'tolist'):
+        return items.tolist(), True
+    return list(items), False
+
+
+def _as_output(items, is_array):
+    """convert back to a numpy array if the input was one"""
+    if is_array:
+        import numpy as np
+        return np.array(items, dtype=str)
+    return items
+
+
+# substrings that show that a path needs to be normalised, NULL marks
+# the start and end of each path in the joined buffer
+_unnormalised_marks = ('//', '/.', '\\', '\x00~', '\x00.', '/\x00', '\x00\x00')
+
+
+def _unnormalised_indices(paths):
+    """
+    return the indices of all paths for which _is_normalised is False.
+    All paths are joined into one NULL-separated buffer, which is then
+    searched once for each of the _unnormalised_marks with str.find.
+    """
+    if not all(type(p) is str for p in paths):
+        return [i for i, p in enumerate(paths) if type(p) is not str or not _is_normalised(p)]
+    buffer = '\x00' + '\x00'.join(paths) + '\x00'
+    if len(paths) == 0 or buffer.count('\x00') != len(paths) + 1:
+        return [i for i, p in enumerate(paths) if not _is_normalised(p)]
+    positions = []
+    for mark in _unnormalised_marks:
+        pos = buffer.find(mark)
+        while pos != -1:
+            positions.append(pos)
+            pos = buffer.find(mark, pos + 1)
+    if not positions:
+        return []
+    # position of the separator in front of each path
+    seps = [0]
+    seps.extend(itertools.accumulate(len(p) + 1 for p in paths))
+    indices = {bisect.bisect_right(seps, pos) - 1 for pos in positions}
+    return sorted(indices)
+
+
+def normalize_many(paths):
+    """
+    Normalise many paths at once, same as [join(p) for p in paths].
+    Paths that need no normalisation are found by searching all paths
+    joined into one string with str.find, only the remaining ones go
+    through join.
+
+    :param paths: list of paths or numpy array of str
+    :returns: list of normalised paths, or a numpy array for array input
+    """
+    paths, is_array = _as_list(paths)
+    indices = _unnormalised_indices(paths) if _posix else range(len(paths))
+    for i in indices:
+        paths[i] = _join(paths[i])
+    return _as_output(paths, is_array)
+
+
+def join_many(bases, names):
+    """
+    Join many paths at once, same as [join(b, n) for b, n in zip(bases, names)].
+    Either argument can also be a single str that is joined to all others.
+
+    :param bases: list of paths, numpy array of str or a single path
+    :param names: list of paths, numpy array of str or a single path
+    :returns: list of joined paths, or a numpy array for array input
+    """
+    # pathlib.Path and other os.PathLike are accepted, as by join
+    single_base = isinstance(bases, (str, os.PathLike))
+    single_name = isinstance(names, (str, os.PathLike))
+    if single_base: bases = os.fspath(bases)
+    if single_name: names = os.fspath(names)
+    if single_base and single_name:
+        return [join(bases, names)]
+    if single_base:
+        names, is_array = _as_list(names)
+        bases = [bases] * len(names)
+    elif single_name:
+        bases, is_array = _as_list(bases)
+        names = [names] * len(bases)
+    else:
+        bases, is_array_bases = _as_list(bases)
+        names, is_array_names = _as_list(names)
+        is_array = is_array_bases or is_array_names
+    assert len(bases) == len(names), f'bases and names need the same length, {len(bases)}!={len(names)}'
+    if not _posix:
+        return _as_output([join(b, n) for b, n in zip(bases, names)], is_array)
+
+    # for these, the fast path of join would fail, they need the full route
+    indices = set()
+    for paths, single in [(bases, single_base), (names, single_name)]:
+        if not single:
+            indices.update(_unnormalised_indices(paths))
+        elif paths and not _is_normalised(paths[0]):
+            indices.update(range(len(paths)))
+    # items that are no str are among them, e.g. pathlib.Path
+    for i in indices:
+        bases[i], names[i] = os.fspath(bases[i]), os.fspath(names[i])
+    joined = [b + '/' + (n[1:] if n[:1] == '/' else n) for b, n in zip(bases, names)]
+    for i in indices:
+        joined[i] = _join(bases[i], names[i])
+    return _as_output(joined, is_array)
+
+
+def splitext_many(paths):
+    """
+    Split the extension of many paths at once, same as splitext(p) for
+    each path, but returns the roots and extensions as two lists.
+
+    :param paths: list of paths or numpy array of str
+    :returns: roots, exts as lists, or as numpy arrays for array input
+    """
+    paths, is_array = _as_list(paths)
+    roots = []
+    exts = []
+    for p in normalize_many(paths):
+        # same as os.path.splitext, normalised paths only contain '/'
+        sep = p.rfind('/')
+        dot = p.rfind('.')
+        if dot > sep and p[sep + 1:dot].lstrip('.'):
+            roots.append(p[:dot])
+            exts.append(p[dot:])
+        else:
+            roots.append(p)
+            exts.append('')
+    return _as_output(roots, is_array), _as_output(exts, is_array)
 
 
 def list_folders(path, recursive=False, add_parent=False, pattern='*',
-                 subfolders=None):
+                 subfolders=None, workers=None, cache=None, sort='natural'):
     """
     This function will list all folders or subfolders of a certain directory
     
     :param path: parent folder, will be in included in return list
     :param subfolders: include subfolders of folders
+    :param sort: 'natural' (natsort), 'lexical' or None for the order in
+                 which the folders were found. All folders are sorted
+                 once at the end
+    :param workers: list this many folders concurrently with threads,
+                    speeds up listings on network drives (NFS/SMB)
+    :param cache: True to use the module-wide ListingCache or a ListingCache
     :returns: A list of folders and optionally subfolders
     """
     if subfolders is not None:
@@ -123,23 +328,710 @@ def list_folders(path, recursive=False, add_parent=False, pattern='*',
     
     if add_parent: folders = [path]
     
-    for foldername in next(os.walk(path))[1]:
-        folder = join(path, foldername, '/')
-        if fnmatch.fnmatch(foldername.lower(), pattern.lower()):
-            folders.append(folder)
-        if recursive:
-            folders.extend(list_folders(folder, recursive=True,
-                                        add_parent=False, pattern=pattern))
-        
-    return sorted(folders, key=natsort_key)
+    # os.walk also lists symlinked folders, these were always descended
+    import re
+    import fnmatch
+    sort_key = _get_sort_key(sort)
+    match = re.compile(fnmatch.translate(pattern.lower())).match
+    max_depth = None if recursive else 0
+    for relpath, is_dir, is_file, _ in _walk(path, max_depth, follow_symlinks=True,
+                                          workers=workers, scandir=_get_scandir(cache)):
+        if not is_dir: continue
+        parent, _, foldername = relpath.rpartition('/')
+        if not match(foldername.lower()): continue
+        # subfolders are joined to the normalised parent, as it was done
+        # when list_folders called itself recursively
+        parent = join(join(path, parent) + '/') if parent else path
+        folders.append(join(parent, foldername, '/'))
+
+    # for path='.' the top level folders start with './', but not their
+    # subfolders. Sorting each folder while walking would not give
+    # the same order as sorting all of them, so they are sorted here
+    if sort_key is not None:
+        folders.sort(key=sort_key)
+    return folders
+
+def _translate_segment(segment):
+    """
+    translate one segment of a glob pattern into a regular expression.
+    Wildcards never match across a '/', same as with pathlib.Path.glob
+    """
+    import re
+    i, n = 0, len(segment)
+    res = []
+    while i < n:
+        c = segment[i]
+        i += 1
+        if c == '*':
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and segment[j] == '!': j += 1
+            if j < n and segment[j] == ']': j += 1
+            while j < n and segment[j] != ']': j += 1
+            if j >= n:
+                res.append('\\[')
+                continue
+            stuff = segment[i:j].replace('\\', '\\\\')
+            i = j + 1
+            if stuff[0] == '!':
+                stuff = '^/' + stuff[1:]
+            elif stuff[0] in ('^', '['):
+                stuff = '\\' + stuff
+            res.append('[%s]' % stuff)
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+
+def _translate(pattern):
+    """
+    translate a pathlib glob pattern into a regular expression that is
+    matched against the path of a file relative to the listed folder.
+
+    :returns: (regex, depth) where depth is the number of folder levels the
+              pattern can reach or None if it contains a recursive '**'
+    """
+    segments = [s for s in pattern.replace('\\', '/').split('/') if s not in ('', '.')]
+    regex = ''
+    depth = len(segments) - 1
+    for i, segment in enumerate(segments):
+        if segment == '**':
+            regex += '(?:[^/]+/)*'  # zero or more folders
+            depth = None
+        else:
+            regex += _translate_segment(segment)
+            if i < len(segments) - 1: regex += '/'
+    return regex, depth
+
+
+def _suffix(pattern):
+    """
+    return the literal suffix of patterns like '*.png' or '**/*.png' and if
+    the pattern applies to all folder levels, else None
+    """
+    any_depth = pattern.startswith('**/')
+    if any_depth: pattern = pattern[3:]
+    literal = pattern[1:]
+    if pattern[:1] != '*' or literal == '' or any(c in literal for c in '*?[/\\'):
+        return None
+    return literal, any_depth
+
+
+def _match_segments(segments, parts, symlinked, partial=False):
+    """
+    match the folder and file names in parts against the segments of a
+    pattern, compiled regexes or None for '**'. '**' matches any number of
+    folders, except those whose index is in symlinked.
+
+    :param partial: parts are only folders, check if a file below them
+                    can still match
+    """
+    n_segments = len(segments)
+    n_folders = len(parts) if partial else len(parts) - 1
+
+    def skip_recursive(states):
+        # '**' can also match no folder at all
+        for i in list(states):
+            while i < n_segments and segments[i] is None:
+                i += 1
+                states.add(i)
+        return states
+
+    states = skip_recursive({0})
+    for j, part in enumerate(parts):
+        following = set()
+        for i in states:
+            if i == n_segments:
+                continue
+            segment = segments[i]
+            if segment is None:
+                if j < n_folders and j not in symlinked:
+                    following.add(i)
+            elif segment.fullmatch(part):
+                following.add(i + 1)
+        if not following:
+            return False
+        states = skip_recursive(following)
+    if partial:
+        return any(i < n_segments and segments[i] is not None for i in states)
+    return n_segments in states
+
+
+class PatternMatcher():
+    """
+    All patterns and extensions of a list_files call, compiled once.
+
+    Plain extension patterns such as '*.png' become lookups of the last
+    characters of a path in a set, all other patterns are compiled into a
+    single regular expression (with re.IGNORECASE if not case_sensitive).
+    Create with ospath.compile_patterns to reuse the same matcher for
+    several calls to list_files.
+
+    :param patterns: list of pathlib glob patterns, see _get_patterns
+    :param case_sensitive: match patterns case sensitive
+    """
+    def __init__(self, patterns, case_sensitive=False):
+        import re
+        self.patterns = list(patterns)
+        self.case_sensitive = case_sensitive
+        regexes = []
+        depths = []
+        suffixes = {}  # (length, any_depth) -> set of suffixes
+        for pattern in self.patterns:
+            suffix = _suffix(pattern)
+            if suffix is not None:
+                literal, any_depth = suffix
+                if not case_sensitive: literal = literal.lower()
+                suffixes.setdefault((len(literal), any_depth), set()).add(literal)
+                depths.append(None if any_depth else 0)
+                continue
+            regex, depth = _translate(pattern)
+            regexes.append(regex)
+            depths.append(depth)
+
+        self.max_depth = None if None in depths else max(depths, default=0)
+        self._segments = None
+        self.suffixes = [(length, any_depth, frozenset(s)) for (length, any_depth), s
+                         in sorted(suffixes.items())]
+        self.regex = None
+        if regexes:
+            flags = 0 if case_sensitive else re.IGNORECASE
+            self.regex = re.compile('|'.join('(?:%s)' % r for r in regexes), flags)
+
+        # use the simplest function that can do the job, it is called per file
+        if not self.suffixes:
+            self.match = self.regex.fullmatch
+        elif self.regex is None and len(self.suffixes) == 1 and self.suffixes[0][1]:
+            length, _, suffixes = self.suffixes[0]
+            if case_sensitive:
+                self.match = lambda relpath: relpath[-length:] in suffixes
+            else:
+                self.match = lambda relpath: relpath[-length:].lower() in suffixes
+        else:
+            self.match = self._match
+
+    def _match(self, relpath):
+        """match suffixes first, then the regular expression"""
+        for length, any_depth, suffixes in self.suffixes:
+            # a suffix never contains a '/', so it can be taken from the
+            # relpath directly, as long as the file is at the right depth
+            end = relpath[-length:]
+            if not self.case_sensitive: end = end.lower()
+            if end in suffixes and (any_depth or '/' not in relpath):
+                return True
+        return self.regex is not None and self.regex.fullmatch(relpath) is not None
+
+    def match_symlinked(self, relpath, links, partial=False):
+        """
+        match a path below symlinked folders as pathlib.Path.glob does: a
+        symlinked folder can be matched by a name or '*', but '**' never
+        descends into it. Only needed for recursive patterns.
+
+        :param relpath: relative path of a file, or of a symlinked folder
+                        (without '/' at the end) with partial=True
+        :param links: set of the symlinked folders that were followed,
+                      relative and with '/' at the end
+        :param partial: check if files below the folder relpath can match
+        """
+        symlinked = set()
+        end = relpath.find('/')
+        while end >= 0:
+            if relpath[:end + 1] in links:
+                symlinked.add(relpath.count('/', 0, end))
+            end = relpath.find('/', end + 1)
+        parts = relpath.split('/')
+        if partial:
+            symlinked.add(len(parts) - 1)
+        elif not symlinked:
+            return bool(self.match(relpath))
+        if self._segments is None:
+            import re
+            flags = 0 if self.case_sensitive else re.IGNORECASE
+            self._segments = [[None if s == '**' else re.compile(_translate_segment(s), flags)
+                               for s in pattern.replace('\\', '/').split('/') if s not in ('', '.')]
+                              for pattern in self.patterns]
+        return any(_match_segments(segments, parts, symlinked, partial)
+                   for segments in self._segments)
+
+    def __call__(self, relpath):
+        """check if a path relative to the listed folder matches"""
+        return bool(self.match(relpath))
+
+    def __repr__(self):
+        return f'PatternMatcher({self.patterns}, case_sensitive={self.case_sensitive})'
+
+
+def compile_patterns(exts=None, patterns=None, recursive=False, case_sensitive=False):
+    """
+    Compile the exts and patterns of list_files into a PatternMatcher.
+    The matcher can be passed as patterns= to list_files, iter_files etc
+    instead of exts, patterns, recursive and case_sensitive, which saves
+    compiling them on every call.
+
+    :param exts:  extension of the files (e.g. .jpg, .jpg or .png, png)
+    :param patterns: patterns supported by pathlib.Path, e.g. '*.txt'
+    :param recursive: match files in all subfolders
+    :param case_sensitive: match patterns case sensitive
+    :returns: PatternMatcher, call it with a relative path to match it
+    """
+    return PatternMatcher(_get_patterns(exts, patterns, recursive), case_sensitive)
+
+
+def _scandir(path):
+    """
+    list a folder with a single os.scandir call.
+
+    :returns: list of (name, is_dir, is_file, is_symlink, entry) tuples,
+              with the os.DirEntry to get its stat(). Empty if the folder
+              can't be read
+    """
+    try:
+        with os.scandir(path) as it:
+            return [(e.name, e.is_dir(), e.is_file(), e.is_symlink(), e) for e in it]
+    except OSError:
+        return []
+
+
+class ListingCache():
+    """
+    Cache for folder listings, keyed by the path and mtime of the folder.
+
+    A folder is only listed again if its mtime changed, i.e. if files were
+    added, removed or renamed in it. Repeated listings of an unchanged tree
+    then only need one stat call per folder. The least recently used
+    listings are evicted once more than maxsize folders are cached.
+
+    Usage:
+        cache = ospath.ListingCache(file='~/listings.pkl')
+        files = ospath.list_files(path, recursive=True, cache=cache)
+        cache.save()
+
+    :param maxsize: maximum number of folders to keep in memory
+    :param file: pickle file to load the cache from and to save() it to
+    :param min_age: folders modified less than min_age seconds ago are not
+                    cached, as further changes within the same mtime tick
+                    would go unnoticed
+    """
+    def __init__(self, maxsize=1000000, file=None, min_age=2):
+        import threading
+        from collections import OrderedDict
+        self.maxsize = maxsize
+        self.file = None if file is None else expanduser(file)
+        self.min_age = min_age
+        self.hits = 0
+        self.misses = 0
+        self._listings = OrderedDict()  # abspath -> (mtime_ns, entries)
+        self._lock = threading.Lock()
+        if self.file is not None and os.path.isfile(self.file):
+            self.load()
+
+    def __len__(self):
+        return len(self._listings)
+
+    def scandir(self, path):
+        """list a folder like _scandir, but take the listing from the cache
+        if the folder did not change since it was listed"""
+        path = os.path.abspath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._listings.move_to_end(path)
+                self.hits += 1
+                return list(cached[1])
+            self.misses += 1
+
+        entries = _scandir(path)
+        if time.time() - mtime / 1e9 < self.min_age:
+            return entries
+
+        # the os.DirEntry (and its stat) would go stale, so it is not kept
+        listing = tuple(entry[:4] + (None,) for entry in entries)
+        with self._lock:
+            self._listings[path] = (mtime, listing)
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.maxsize:
+                self._listings.popitem(last=False)
+        return entries
+
+    def clear(self):
+        """remove all listings from the cache"""
+        with self._lock:
+            self._listings.clear()
+
+    def load(self, file=None):
+        """load listings from a pickle file created with save()"""
+        file = self.file if file is None else expanduser(file)
+        import pickle
+        with open(file, 'rb') as f:
+            listings = pickle.load(f)
+        with self._lock:
+            self._listings.update(listings)
+
+    def save(self, file=None):
+        """save the cached listings to a pickle file"""
+        file = self.file if file is None else expanduser(file)
+        assert file is not None, 'no file given to save the cache to'
+        with self._lock:
+            listings = self._listings.copy()
+        import pickle
+        with open(file, 'wb') as f:
+            pickle.dump(listings, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+_default_cache = None
+
+
+def _get_scandir(cache):
+    """return the function to list folders with for the cache= argument"""
+    global _default_cache
+    if cache is None or cache is False:
+        return _scandir
+    if cache is True:
+        if _default_cache is None:
+            _default_cache = ListingCache()
+        cache = _default_cache
+    return cache.scandir
+
+
+def _get_sort_key(sort):
+    """return the key function for the sort= argument of the listings"""
+    if sort is None:
+        return None
+    elif sort == 'natural':
+        from natsort import natsort_key
+        return natsort_key
+    elif sort == 'lexical':
+        return str
+    raise ValueError(f"sort must be 'natural', 'lexical' or None, not {sort!r}")
+
+
+class _Profile():
+    """counters and timers of one profiled listing, see stats()"""
+    __slots__ = ('path', 'dirs', 'entries', 'stats', 'matches', 'cache_hits',
+                 'cache_misses', 'time_walk', 'time_match', 'time_normalise',
+                 'time_sort', 'time_stat', 'time_total', 'callback', 'start')
+
+    def __init__(self, path, callback=None):
+        self.path = path
+        self.dirs = self.entries = self.stats = self.matches = 0
+        self.cache_hits = self.cache_misses = 0
+        self.time_walk = self.time_match = self.time_normalise = 0.0
+        self.time_sort = self.time_stat = self.time_total = 0.0
+        self.callback = callback
+        self.start = time.perf_counter()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in ('callback', 'start')}
+
+
+_last_stats = None
+_profile_callback = None
+_profile_all = False
+
+
+def _start_profile(profile, path):
+    """a _Profile if this call should be profiled, else None"""
+    if not profile and not _profile_all:
+        return None
+    return _Profile(path, profile if callable(profile) else None)
+
+
+def _finish_profile(profile):
+    """store the statistics for stats() and pass them to the callbacks"""
+    global _last_stats
+    profile.time_total = time.perf_counter() - profile.start
+    _last_stats = profile.as_dict()
+    for callback in (profile.callback, _profile_callback):
+        if callback is not None:
+            callback(dict(_last_stats))
+
+
+def stats():
+    """
+    Statistics of the last listing that ran with profile=True, e.g.
+    list_files(path, recursive=True, profile=True). Returns None if there
+    was none yet. The dict contains
+
+        path: the path that was listed
+        dirs: folders that were listed
+        entries: files and folders that were seen in these folders
+        stats: stat calls, of files (scan_files) and folders (ListingCache)
+        matches: files that matched the exts/patterns
+        cache_hits/cache_misses: folders served by the ListingCache or not
+        time_walk: seconds spent listing folders (waiting for it with workers)
+        time_match: seconds spent matching the patterns
+        time_normalise: seconds spent creating the resulting paths
+        time_sort: seconds spent sorting folders
+        time_stat: seconds spent in stat calls of scan_files
+        time_total: seconds from the call until the end of the listing
+
+    :returns: dict or None
+    """
+    return None if _last_stats is None else dict(_last_stats)
+
+
+def set_profile_callback(callback, profile_all=False):
+    """
+    Call callback(stats) at the end of every profiled listing, e.g. to
+    send the statistics to a monitoring system. See stats() for the keys.
+
+    :param callback: function that takes the statistics dict, None to remove
+    :param profile_all: profile all listings, even without profile=True
+    """
+    global _profile_callback, _profile_all
+    _profile_callback = callback
+    _profile_all = profile_all and callback is not None
+
+
+def _walk(root, max_depth=None, follow_symlinks=True, sort_key=None,
+          workers=None, scandir=_scandir, profile=None):
+    """
+    walk the tree below root once (depth first), yields (relpath, is_dir,
+    is_file, entry) for every entry. relpath uses '/' and is relative to
+    root, entry is the os.DirEntry or None if the listing was cached.
+
+    :param max_depth: how many folder levels to descend, None=unlimited
+    :param follow_symlinks: descend into symlinked folders, or a function
+                            that is called with the relpath of each
+                            symlinked folder and returns if it is descended
+    :param sort_key: if given, the entries of each folder are sorted by
+                     sort_key(name) with a '/' appended to folder names. For
+                     natsort_key and str this gives the same order as sorting
+                     all resulting paths, but the keys are only computed for
+                     the names, shared parent folders are never tokenized.
+    :param workers: if >1, subfolders are listed ahead of time by a pool of
+                    threads. The order of the walk stays the same, so the
+                    result is deterministic. At most 16*workers listings
+                    are queued at the same time.
+    :param scandir: function to list a single folder, see _scandir
+    :param profile: _Profile that counts the folders and entries and times
+                    the listing (waiting for it with workers) and sorting
+    """
+    pool = None
+    pending = {}  # relpath -> future of scandir
+    if workers is not None and workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(workers, thread_name_prefix='ospath')
+        max_pending = 16 * workers
+
+    def listdir(relpath, depth):
+        if profile is not None:
+            start = time.perf_counter()
+        future = pending.pop(relpath, None)
+        if future is None:
+            entries = scandir(os.path.join(root, relpath))
+        else:
+            entries = future.result()
+        if profile is not None:
+            profile.time_walk += time.perf_counter() - start
+            profile.dirs += 1
+            profile.entries += len(entries)
+        if pool is not None and (max_depth is None or depth < max_depth):
+            # queue the listing of the subfolders while this one is processed
+            for name, is_dir, is_file, is_symlink, _ in entries:
+                if len(pending) >= max_pending:
+                    break
+                if is_dir and (not is_symlink or follow_symlinks is True or
+                               follow_symlinks and follow_symlinks(relpath + name)):
+                    subfolder = relpath + name + '/'
+                    pending[subfolder] = pool.submit(scandir, os.path.join(root, subfolder))
+        if sort_key is not None:
+            if profile is not None:
+                start = time.perf_counter()
+            entries.sort(key=lambda e: cached_key(e[0] + '/' if e[1] else e[0]))
+            if profile is not None:
+                profile.time_sort += time.perf_counter() - start
+        return iter(entries)
+
+    # the same names often appear in many folders (e.g. sub-01/eeg/),
+    # so their keys are computed only once per walk
+    keys = {}
+    def cached_key(name):
+        key = keys.get(name)
+        if key is None:
+            if len(keys) > 100000: keys.clear()
+            key = keys[name] = sort_key(name)
+        return key
+
+    try:
+        stack = [('', 0, listdir('', 0))]
+        while stack:
+            prefix, depth, entries = stack[-1]
+            descend = max_depth is None or depth < max_depth
+            for name, is_dir, is_file, is_symlink, entry in entries:
+                relpath = prefix + name
+                yield relpath, is_dir, is_file, entry
+                if descend and is_dir and (not is_symlink or follow_symlinks is True or
+                                           follow_symlinks and follow_symlinks(relpath)):
+                    relpath += '/'
+                    stack.append((relpath, depth + 1, listdir(relpath, depth + 1)))
+                    break
+            else:
+                stack.pop()
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_patterns(exts, patterns, recursive):
+    """turn the exts and patterns arguments of list_files into glob patterns"""
+    if isinstance(exts, str): exts = [exts]
+    if isinstance(patterns, str): patterns = [patterns]
+    patterns = [] if patterns is None else list(patterns)
+    if exts is None: exts = []
+    
+    if patterns==[] and exts == []:
+        patterns = ['*']
+    
+    for ext in exts:
+        ext = ext.replace('*', '')
+        pattern = '*' + ext
+        patterns.append(pattern.lower())
+    
+    # if recursiveness is asked, prepend the double asterix to each pattern
+    if recursive: patterns = ['**/' + pattern for pattern in patterns]
+    return patterns
+
+
+def _follow_symlinks(matcher):
+    """
+    the follow_symlinks argument of _walk for the patterns of matcher, and
+    the set that collects the symlinked folders that were followed. As in
+    glob, recursive patterns only enter a symlinked folder where a name or
+    '*' of the pattern matches it, '**' doesn't descend into it.
+    """
+    links = set()
+    if matcher.max_depth is not None:
+        return True, links
+
+    def follow_symlinks(relpath):
+        if matcher.match_symlinked(relpath, links, partial=True):
+            links.add(relpath + '/')
+            return True
+        return False
+    return follow_symlinks, links
+
+
+def _iter_matches(path, exts, patterns, recursive, case_sensitive, sort,
+                  workers, cache, profile=None):
+    """
+    walk path and yield (relpath, entry) for all files that match, see
+    iter_files for the arguments. entry is the os.DirEntry of the file or
+    None if it came from a ListingCache
+    """
+    assert isinstance(path, str), "path needs to be a str"
+    assert os.path.exists(path), 'Path {} does not exist'.format(path)
+
+    if isinstance(patterns, PatternMatcher):
+        assert exts is None, 'exts are part of the PatternMatcher already'
+        matcher = patterns
+    else:
+        matcher = compile_patterns(exts, patterns, recursive, case_sensitive)
+    match, max_depth = matcher.match, matcher.max_depth
+
+    follow_symlinks, links = _follow_symlinks(matcher)
+    match_symlinked = matcher.match_symlinked
+
+    scandir = _get_scandir(cache)
+    walk = _walk(path, max_depth, follow_symlinks, sort_key=_get_sort_key(sort),
+                 workers=workers, scandir=scandir, profile=profile)
+    if profile is None:
+        for relpath, is_dir, is_file, entry in walk:
+            if is_file and match(relpath) and (not links or match_symlinked(relpath, links)):
+                yield relpath, entry
+        return
+
+    # same as above, but every match is timed
+    listing_cache = getattr(scandir, '__self__', None)
+    if listing_cache is not None:
+        hits, misses = listing_cache.hits, listing_cache.misses
+    try:
+        perf_counter = time.perf_counter
+        for relpath, is_dir, is_file, entry in walk:
+            start = perf_counter()
+            matched = is_file and match(relpath) and \
+                      (not links or match_symlinked(relpath, links))
+            profile.time_match += perf_counter() - start
+            if matched:
+                profile.matches += 1
+                yield relpath, entry
+    finally:
+        if listing_cache is not None:
+            # the cache stats every folder to check its mtime
+            profile.cache_hits += listing_cache.hits - hits
+            profile.cache_misses += listing_cache.misses - misses
+            profile.stats += profile.dirs
+
+
+def iter_files(path, exts=None, patterns=None, relative=False, recursive=False,
+               subfolders=None, only_folders=False, max_results=None,
+               case_sensitive=False, sorted=True, workers=None, cache=None,
+               sort='natural', profile=False):
+    """
+    Generator version of list_files, takes the same arguments. Files are
+    yielded as soon as the walk finds them, the walk stops as soon as
+    max_results files have been yielded.
+
+    :param sorted: yield the files in the same order as list_files.
+                   Each folder is sorted on its own while walking, so files
+                   are still yielded lazily. With sorted=False the order
+                   is the order of the filesystem, which is slightly faster.
+    :param sort: 'natural' (natsort), 'lexical' or None, same as sorted=False
+    :param workers: list this many folders concurrently with threads
+    :param cache: True to use the module-wide ListingCache, or a ListingCache
+    :param patterns: can also be a PatternMatcher from compile_patterns
+    :param profile: True or a callback to collect statistics, see stats()
+    :return:      generator of file names
+    """
+    if subfolders is not None:
+        import warnings
+        warnings.warn("`subfolders` is deprecated, use `recursive=` instead", DeprecationWarning)
+        recursive = subfolders
+
+    parent = os.path.abspath(path)
+    prof = _start_profile(profile, path)
+    matches = _iter_matches(path, exts, patterns, recursive, case_sensitive,
+                            sort if sorted else None, workers, cache, prof)
+    n_files = 0
+    try:
+        for relpath, entry in matches:
+            # turn path into relative or absolute paths
+            if prof is None:
+                yield join(relpath) if relative else join(parent, relpath)
+            else:
+                start = time.perf_counter()
+                file = join(relpath) if relative else join(parent, relpath)
+                prof.time_normalise += time.perf_counter() - start
+                yield file
+            n_files += 1
+            if max_results is not None and n_files >= max_results:
+                return
+    finally:
+        if prof is not None:
+            matches.close()
+            _finish_profile(prof)
+
 
 def list_files(path, exts=None, patterns=None, relative=False, recursive=False,
                subfolders=None, only_folders=False, max_results=None, 
-               case_sensitive=False):
+               case_sensitive=False, workers=None, cache=None, sort='natural',
+               profile=False):
     """
     will make a list of all files with extention exts (list)
     found in the path and possibly all subfolders and return
     a list of all files matching this pattern
+
+    The tree is walked only once with os.scandir, all patterns and
+    extensions are compiled into a single matcher. See iter_files for
+    a generator version.
     
     :param path:  location to find the files
     :type  path:  str
@@ -147,15 +1039,1109 @@ def list_files(path, exts=None, patterns=None, relative=False, recursive=False,
                   Will be turned into a pattern internally
     :type  exts:  list or str
     :param pattern: A pattern that is supported by pathlib.Path, 
-                  e.g. '*.txt', '**\rfc_*.clf'
+                  e.g. '*.txt', '**\\rfc_*.clf', or a PatternMatcher
+                  from compile_patterns, which also contains the
+                  exts, recursive and case_sensitive arguments
     :type:        str
-    :param fullpath:  give the filenames with path
-    :type  fullpath:  bool
-    :param subfolders
-    :param return_strings: return strings, else returns Path objects
+    :param relative:  give the filenames relative to path
+    :type  relative:  bool
+    :param recursive: also search all subfolders
+    :param max_results: stop the search after this many files were found
+    :param case_sensitive: match patterns case sensitive
+    :param workers: list this many folders concurrently with threads,
+                    speeds up listings on network drives (NFS/SMB)
+    :param cache: True to use the module-wide ListingCache or a ListingCache.
+                  Only folders that changed since the last call are listed.
+    :param sort: 'natural' (natsort), 'lexical' or None for the order of
+                 the filesystem. Each folder is sorted while walking, which
+                 gives the same order as sorting all files at the end.
+    :param profile: True to count folders, entries and matches and to time
+                    the walk, matching, normalising and sorting, see stats().
+                    A callable is called with the statistics at the end.
     :return:      list of file names
     :type:        list of str
     """
+    files = iter_files(path, exts=exts, patterns=patterns, relative=relative,
+                       recursive=recursive, subfolders=subfolders,
+                       max_results=max_results, case_sensitive=case_sensitive,
+                       workers=workers, cache=cache, sort=sort, profile=profile)
+    return list(dict.fromkeys(files))  # filter duplicates, keep the order
+
+
+class FileInfo():
+    """
+    Lightweight record of a file found by scan_files. Can be unpacked as
+    path, size, mtime, is_dir = info
+    """
+    __slots__ = ('path', 'size', 'mtime', 'is_dir')
+
+    def __init__(self, path, size, mtime, is_dir=False):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.is_dir = is_dir
+
+    def __iter__(self):
+        return iter((self.path, self.size, self.mtime, self.is_dir))
+
+    def __eq__(self, other):
+        return isinstance(other, FileInfo) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return (f'FileInfo(path={self.path!r}, size={self.size}, '
+                f'mtime={self.mtime}, is_dir={self.is_dir})')
+
+
+def _to_timestamp(t):
+    """convert a datetime or a timestamp to seconds since the epoch"""
+    return t.timestamp() if hasattr(t, 'timestamp') else t
+
+
+def scan_files(path, exts=None, patterns=None, relative=False, recursive=False,
+               max_results=None, case_sensitive=False, workers=None, cache=None,
+               sort='natural', min_size=None, max_size=None, newer_than=None,
+               older_than=None, profile=False):
+    """
+    Same as list_files, but returns a FileInfo(path, size, mtime, is_dir)
+    for every file. The size and mtime are taken from the os.DirEntry of
+    the walk, which costs no extra call on Windows and a single stat on
+    Linux, instead of calling getsize and getmtime afterwards.
+
+    The filters are applied while walking, max_results counts only files
+    that pass all of them.
+
+    :param min_size: only files with at least this many bytes
+    :param max_size: only files with at most this many bytes
+    :param newer_than: only files modified after this time (timestamp or datetime)
+    :param older_than: only files modified before this time (timestamp or datetime)
+    :returns: list of FileInfo, see list_files for all other arguments
+    """
+    newer_than = _to_timestamp(newer_than)
+    older_than = _to_timestamp(older_than)
+    parent = os.path.abspath(path)
+    prof = _start_profile(profile, path)
+    matches = _iter_matches(path, exts, patterns, recursive, case_sensitive,
+                            sort, workers, cache, prof)
+    infos = []
+    for relpath, entry in matches:
+        if prof is not None:
+            start = time.perf_counter()
+            prof.stats += 1
+        try:
+            stat = entry.stat() if entry is not None else os.stat(os.path.join(path, relpath))
+        except OSError:  # file was removed since the listing
+            continue
+        finally:
+            if prof is not None:
+                prof.time_stat += time.perf_counter() - start
+        size = stat.st_size
+        mtime = stat.st_mtime
+        if min_size is not None and size < min_size: continue
+        if max_size is not None and size > max_size: continue
+        if newer_than is not None and mtime <= newer_than: continue
+        if older_than is not None and mtime >= older_than: continue
+        if prof is not None:
+            start = time.perf_counter()
+        path_file = join(relpath) if relative else join(parent, relpath)
+        if prof is not None:
+            prof.time_normalise += time.perf_counter() - start
+        infos.append(FileInfo(path_file, size, mtime, False))
+        if max_results is not None and len(infos) >= max_results:
+            break
+    if prof is not None:
+        matches.close()
+        _finish_profile(prof)
+    return infos
+
+
+class _Snapshot():
+    """
+    state of the matching files below root for watch(). Folders are only
+    listed again if their mtime changed, files of unchanged folders are
+    compared by a single stat.
+    """
+
+    def __init__(self, root, matcher, follow_symlinks=False, racy=2):
+        self.root = root
+        self.match = matcher.match
+        self.max_depth = matcher.max_depth
+        self.follow_symlinks = follow_symlinks
+        self.racy = racy
+        self.dirs = {}     # reldir -> mtime_ns when listed, None if changed since
+        self.subdirs = {}  # reldir -> set of relative subfolders
+        self.files = {}    # reldir -> {relpath: (size, mtime_ns)}
+        self.on_dir = None # called with (reldir, added) if folders come or go
+
+    def _list(self, reldir, depth):
+        """list one folder, return the events of the changes to the last listing"""
+        path = os.path.join(self.root, reldir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return self._remove(reldir)
+        if self.on_dir is not None and reldir not in self.dirs:
+            self.on_dir(reldir, True)
+        # the folder could change again within the resolution of its mtime,
+        # so recently changed folders are listed again on the next poll
+        recent = time.time_ns() - mtime < self.racy * 1e9
+        self.dirs[reldir] = None if recent else mtime
+
+        descend = self.max_depth is None or depth < self.max_depth
+        files, subdirs = {}, set()
+        for name, is_dir, is_file, is_symlink, entry in _scandir(path):
+            relpath = reldir + name
+            if is_dir:
+                if descend and (self.follow_symlinks or not is_symlink):
+                    subdirs.add(relpath + '/')
+            elif is_file and self.match(relpath):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files[relpath] = (stat.st_size, stat.st_mtime_ns)
+
+        old_files = self.files.get(reldir, {})
+        events = [('removed', relpath) for relpath in old_files if relpath not in files]
+        for relpath, stat in files.items():
+            old_stat = old_files.get(relpath)
+            if old_stat is None:
+                events.append(('added', relpath))
+            elif old_stat != stat:
+                events.append(('modified', relpath))
+        self.files[reldir] = files
+
+        old_subdirs = self.subdirs.get(reldir, set())
+        self.subdirs[reldir] = subdirs
+        for subdir in old_subdirs - subdirs:
+            events += self._remove(subdir)
+        for subdir in subdirs - old_subdirs:
+            events += self._list(subdir, depth + 1)
+        return events
+
+    def _remove(self, reldir):
+        """forget a folder that is gone, return removed events for its files"""
+        if reldir not in self.dirs:
+            return []
+        del self.dirs[reldir]
+        if self.on_dir is not None:
+            self.on_dir(reldir, False)
+        events = [('removed', relpath) for relpath in self.files.pop(reldir, {})]
+        for subdir in self.subdirs.pop(reldir, ()):
+            events += self._remove(subdir)
+        return events
+
+    def scan(self):
+        """first listing of the tree, returns 'added' for all files"""
+        return self._list('', 0)
+
+    def rescan(self, reldirs):
+        """list the given folders again (e.g. reported by inotify)"""
+        events = []
+        for reldir in reldirs:
+            if reldir in self.dirs:
+                events += self._list(reldir, reldir.count('/'))
+        return events
+
+    def restat(self, relpaths):
+        """stat files again that might have been modified"""
+        events = []
+        for relpath in relpaths:
+            reldir = relpath[:relpath.rfind('/') + 1]
+            files = self.files.get(reldir, {})
+            if relpath not in files:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, relpath))
+            except OSError:  # removed, the listing of the folder will show it
+                continue
+            stat = (stat.st_size, stat.st_mtime_ns)
+            if files[relpath] != stat:
+                files[relpath] = stat
+                events.append(('modified', relpath))
+        return events
+
+    def poll(self, modified=True):
+        """
+        stat all folders and list only those whose mtime changed. Changed
+        file contents do not change the mtime of the folder, so the known
+        files are stat'ed as well if modified=True.
+        """
+        events = []
+        for reldir, mtime in list(self.dirs.items()):
+            if reldir not in self.dirs:  # removed with its parent already
+                continue
+            try:
+                changed = os.stat(os.path.join(self.root, reldir)).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                events += self._list(reldir, reldir.count('/'))
+        if modified:
+            events += self.restat([relpath for files in list(self.files.values())
+                                   for relpath in files])
+        return events
+
+
+class _Inotify():
+    """minimal inotify binding with ctypes, raises OSError if not available"""
+
+    # flags from <sys/inotify.h>
+    IN_MODIFY = 0x2
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+            IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+    def __init__(self):
+        import ctypes, ctypes.util, struct
+        if not hasattr(os, 'pipe2'):  # not linux
+            raise OSError('inotify is not available on this platform')
+        self._struct = struct
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available in libc')
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wds = {}  # watch descriptor -> reldir
+
+    def add_watch(self, path, reldir):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd >= 0:  # the folder might be gone already, the scan handles it
+            self.wds[wd] = reldir
+        return wd
+
+    def remove_watch(self, reldir):
+        for wd, watched in list(self.wds.items()):
+            if watched == reldir:
+                del self.wds[wd]
+                self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        wait up to timeout seconds for events, returns (folders, files,
+        overflow) with the relative folders that need to be listed again,
+        the relative files that might be modified and whether the kernel
+        queue overflowed and events were lost.
+        """
+        import select
+        folders, files, overflow = set(), set(), False
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return folders, files, overflow
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, length = self._struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            reldir = self.wds.get(wd)
+            if reldir is None:
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                # list the parent folder, which will notice that it is gone
+                folders.add(reldir[:reldir.rstrip('/').rfind('/') + 1] if reldir else '')
+            elif mask & (self.IN_CREATE | self.IN_DELETE | self.IN_MOVED_FROM | self.IN_MOVED_TO):
+                folders.add(reldir)
+            elif not mask & self.IN_ISDIR:
+                files.add(reldir + name)
+        return folders, files, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch(path, exts=None, patterns=None, recursive=False, relative=False,
+          case_sensitive=False, interval=1, timeout=None, initial=False,
+          backend='auto', modified=True):
+    """
+    Watch a folder and yield (event, filename) for all files that match
+    exts/patterns (same as list_files), with event being 'added',
+    'removed' or 'modified'. Changes are reported in batches, all events
+    of one batch are yielded directly after each other.
+
+    With inotify (Linux) the kernel reports which folders and files
+    changed. Otherwise the folders are polled every `interval` seconds,
+    only folders with a new mtime are listed again and, with
+    modified=True, the known files are stat'ed to find modified ones. If a
+    folder can't be watched with inotify (e.g. fs.inotify.max_user_watches
+    is reached), watch falls back to polling.
+
+    Example:
+        for event, file in ospath.watch(path, exts='edf', recursive=True):
+            if event == 'added':
+                process(file)
+
+    :param path: folder to watch
+    :param interval: seconds between polls, or maximum wait for inotify
+    :param timeout: stop after this many seconds, None=watch forever
+    :param initial: yield 'added' for all files that exist when starting
+    :param backend: 'auto', 'inotify' or 'poll'
+    :param modified: also report 'modified' files. When polling, this
+                     stats every known file on each poll, so a poll costs
+                     as much as the tree is large. With modified=False a
+                     poll only stats the folders and its cost grows with
+                     the number of changed folders.
+    :returns: generator of (event, filename)
+    """
+    assert isinstance(path, str), "path needs to be a str"
+    assert os.path.isdir(path), 'Path {} does not exist'.format(path)
+    assert backend in ('auto', 'inotify', 'poll'), f'unknown backend {backend}'
+
+    if isinstance(patterns, PatternMatcher):
+        assert exts is None, 'exts are part of the PatternMatcher already'
+        matcher = patterns
+    else:
+        matcher = compile_patterns(exts, patterns, recursive, case_sensitive)
+
+    inotify = None
+    if backend != 'poll':
+        try:
+            inotify = _Inotify()
+        except OSError:
+            if backend == 'inotify':
+                raise
+
+    parent = os.path.abspath(path)
+    snapshot = _Snapshot(path, matcher)
+    failed = []  # folders that could not be watched, e.g. too many watches
+    if inotify is not None:
+        def on_dir(reldir, added):
+            if not added:
+                inotify.remove_watch(reldir)
+            elif inotify.add_watch(os.path.join(path, reldir), reldir) < 0 \
+                    and os.path.isdir(os.path.join(path, reldir)):
+                failed.append(reldir)
+        snapshot.on_dir = on_dir
+
+    try:
+        events = snapshot.scan()
+        if not initial:
+            events = []
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            for event, relpath in events:
+                if not modified and event == 'modified':
+                    continue
+                yield event, join(relpath) if relative else join(parent, relpath)
+            remaining = None if end is None else end - time.time()
+            if remaining is not None and remaining <= 0:
+                return
+            wait = interval if remaining is None else min(interval, remaining)
+            if inotify is not None and failed:
+                # changes in unwatched folders would be missed, poll instead
+                inotify.close()
+                inotify = snapshot.on_dir = None
+            if inotify is None:
+                time.sleep(wait)
+                events = snapshot.poll(modified=modified)
+                continue
+            folders, files, overflow = inotify.read(wait)
+            if overflow:  # events were lost, list all folders again
+                events = snapshot.rescan(sorted(snapshot.dirs))
+            else:
+                # new folders are listed with their parent
+                events = snapshot.rescan(sorted(folders))
+                if modified:
+                    events += snapshot.restat(files)
+    finally:
+        if inotify is not None:
+            inotify.close()
+
+
+def _hash_file(file, block_size, partial, algorithm):
+    """
+    hash a file with hashlib, returns (digest, bytes_read). If partial,
+    only the first and the last block are read. Returns None as digest
+    if the file can't be read.
+    """
+    import hashlib
+    digest = hashlib.new(algorithm)
+    bytes_read = 0
+    try:
+        with open(file, 'rb', buffering=0) as f:
+            if partial:
+                chunk = f.read(block_size)
+                digest.update(chunk)
+                bytes_read += len(chunk)
+                if len(chunk) == block_size:
+                    f.seek(-block_size, os.SEEK_END)
+                    chunk = f.read(block_size)
+                    digest.update(chunk)
+                    bytes_read += len(chunk)
+            else:
+                buffer = bytearray(1024 * 1024)
+                view = memoryview(buffer)
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    digest.update(view[:n])
+                    bytes_read += n
+    except OSError:
+        return None, bytes_read
+    return digest.digest(), bytes_read
+
+
+def find_duplicates(path, exts=None, patterns=None, recursive=False, relative=False,
+                    workers=4, block_size=65536, algorithm='blake2b',
+                    return_stats=False, **kwargs):
+    """
+    Find files with identical content below path. Only as much as needed
+    is read, in three stages:
+
+    1. files are grouped by their size from the listing, no file is read
+    2. files with the same size are hashed by their first and last block
+    3. files that still collide are hashed completely
+
+    The hashing is done by a pool of threads, so reading from slow disks
+    overlaps. Files smaller than two blocks are read completely in stage 2
+    and are not read again.
+
+    :param path: folder to search, exts/patterns/recursive/relative as in list_files
+    :param workers: number of threads that read the files
+    :param block_size: bytes that are read from the start and the end in stage 2
+    :param algorithm: name of the hashlib algorithm
+    :param return_stats: also return a dict with the number of files and
+                         bytes read in each stage
+    :param kwargs: further arguments to scan_files, e.g. min_size=1
+    :returns: list of groups of duplicate files, each a list of filenames
+              in the order of list_files. (groups, stats) if return_stats
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    infos = scan_files(path, exts=exts, patterns=patterns, recursive=recursive,
+                       relative=True, **kwargs)
+    stats = {'files': len(infos), 'bytes': sum(info.size for info in infos),
+             'partial_files': 0, 'partial_bytes': 0, 'full_files': 0, 'full_bytes': 0}
+    order = {info.path: i for i, info in enumerate(infos)}
+
+    def regroup(groups, key_func):
+        """split each group by key_func(file), keep only groups of 2 or more"""
+        new_groups = {}
+        for key, files in groups.items():
+            for file, file_key in zip(files, key_func(files)):
+                if file_key is not None:  # unreadable files are unique
+                    new_groups.setdefault(key + (file_key,), []).append(file)
+        return {key: files for key, files in new_groups.items() if len(files) > 1}
+
+    sizes = {}
+    for info in infos:
+        sizes.setdefault(info.size, []).append(info.path)
+    groups = {(size,): files for size, files in sizes.items() if len(files) > 1}
+
+    with ThreadPoolExecutor(workers, thread_name_prefix='ospath') as pool:
+        for stage, partial in [('partial', True), ('full', False)]:
+            if not partial:
+                # files of up to two blocks were read completely already
+                done = {key: files for key, files in groups.items() if key[0] <= 2 * block_size}
+                groups = {key: files for key, files in groups.items() if key not in done}
+
+            def hashes(files):
+                results = pool.map(_hash_file, [os.path.join(path, file) for file in files],
+                                   [block_size] * len(files),
+                                   [partial] * len(files), [algorithm] * len(files))
+                for digest, bytes_read in results:
+                    stats[stage + '_files'] += 1
+                    stats[stage + '_bytes'] += bytes_read
+                    yield digest
+            groups = regroup(groups, hashes)
+        groups.update(done)
+
+    duplicates = [sorted(files, key=order.get) for files in groups.values()]
+    duplicates.sort(key=lambda files: order[files[0]])
+    if not relative:
+        parent = os.path.abspath(path)
+        duplicates = [[join(parent, file) for file in files] for files in duplicates]
+    return (duplicates, stats) if return_stats else duplicates
+
+
+def _copy_file(src, dst):
+    """
+    copy content, mode and mtime of src to dst. The content is copied
+    inside the kernel with copy_file_range where available (Linux, can
+    share blocks on btrfs/XFS), else by shutil, which uses sendfile on
+    Linux and fcopyfile on macOS.
+    """
+    import shutil
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    copied = False
+    if copy_file_range is not None:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            try:
+                while True:  # can copy less than requested
+                    n = copy_file_range(fsrc.fileno(), fdst.fileno(), 2**30)
+                    if n == 0:
+                        break
+                    offset += n
+                copied = offset == size
+            except OSError:
+                if offset > 0:
+                    raise
+                # e.g. EXDEV on older kernels or not supported by the fs
+            if not copied and offset > 0:
+                raise OSError(f'copy_file_range stopped at {offset} of {size} bytes: {src}')
+    if not copied:
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+def _move_file(src, dst):
+    """rename src to dst, copy and remove src if they are on different devices"""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        if not os.path.isfile(src):
+            raise
+        _copy_file(src, dst)
+        os.remove(src)
+
+
+def _remove_if_identical(src, dst):
+    """
+    remove src if dst has the same content. The same size and mtime are
+    no proof of that, if the files differ both are kept.
+    """
+    import filecmp
+    if filecmp.cmp(src, dst, shallow=False):
+        os.remove(src)
+
+
+def _is_same(info, dst):
+    """whether dst has the size and mtime (in whole seconds, as rsync) of info"""
+    try:
+        stat = os.stat(dst)
+    except OSError:
+        return False
+    return stat.st_size == info.size and int(stat.st_mtime) == int(info.mtime)
+
+
+def _bulk(action, src, dst, exts, patterns, recursive, workers, skip_same,
+          verbose, kwargs):
+    """
+    run copy, move or remove on all files of src that match, on a pool of
+    threads. See copy_files for the arguments. Returns a dict with the
+    number of files, bytes and the throughput.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if dst is not None:
+        assert os.path.abspath(src) != os.path.abspath(dst), 'src and dst are the same folder'
+    start = time.perf_counter()
+    infos = scan_files(src, exts=exts, patterns=patterns, recursive=recursive,
+                       relative=True, **kwargs)
+    jobs = []
+    skipped = n_bytes = 0
+    folders = set()
+    for info in infos:
+        src_file = os.path.join(src, info.path)
+        if action == 'remove':
+            jobs.append((os.remove, src_file))
+        elif skip_same and _is_same(info, os.path.join(dst, info.path)):
+            skipped += 1
+            if action == 'move':  # probably at the destination already
+                jobs.append((_remove_if_identical, src_file, os.path.join(dst, info.path)))
+            continue
+        else:
+            dst_file = os.path.join(dst, info.path)
+            folders.add(os.path.dirname(dst_file))
+            func = _copy_file if action == 'copy' else _move_file
+            jobs.append((func, src_file, dst_file))
+        n_bytes += info.size
+
+    # create the folders before, threads would race for shared parents
+    for folder in sorted(folders):
+        makedirs(folder, exist_ok=True)
+
+    def run(job):
+        job[0](*job[1:])
+
+    if workers is None or workers <= 1:
+        for job in jobs:
+            run(job)
+    else:
+        pool = ThreadPoolExecutor(workers, thread_name_prefix='ospath')
+        try:
+            for _ in pool.map(run, jobs):
+                pass
+        finally:
+            # stop at the first error, like a loop would
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    seconds = time.perf_counter() - start
+    n_files = len(infos) - skipped
+    stats = {'files': n_files, 'skipped': skipped, 'bytes': n_bytes, 'seconds': seconds,
+             'mb_per_s': n_bytes / 1e6 / seconds, 'files_per_s': n_files / seconds}
+    if verbose:
+        print(f'{action}: {n_files} files ({n_bytes/1e6:.1f} MB) in {seconds:.2f}s, '
+              f'{stats["mb_per_s"]:.1f} MB/s, {stats["files_per_s"]:.0f} files/s, '
+              f'{skipped} skipped')
+    return stats
+
+
+def copy_files(src, dst, exts=None, patterns=None, recursive=False, workers=4,
+               skip_same=True, verbose=False, **kwargs):
+    """
+    Copy all files of src that match exts/patterns (same as list_files)
+    to dst, keeping their relative folder structure. Files are copied by
+    a pool of threads, which mostly helps with network drives. The mtime
+    is copied as well, so running it again only copies changed files.
+    A partially copied file keeps a new mtime and is copied again.
+
+    :param src: folder to copy from
+    :param dst: folder to copy to, created if needed
+    :param workers: number of threads that copy files
+    :param skip_same: skip files if dst has the same size and mtime
+    :param verbose: print the throughput
+    :param kwargs: further arguments to scan_files, e.g. newer_than=
+    :returns: dict with files, skipped, bytes, seconds, mb_per_s, files_per_s
+    """
+    return _bulk('copy', src, dst, exts, patterns, recursive, workers, skip_same,
+                 verbose, kwargs)
+
+
+def move_files(src, dst, exts=None, patterns=None, recursive=False, workers=4,
+               skip_same=True, verbose=False, **kwargs):
+    """
+    Move all files of src that match to dst, see copy_files. Files are
+    renamed if src and dst are on the same drive, else copied and removed.
+    Files that seem to be in dst already (same size and mtime) are compared
+    byte by byte and only removed from src if they are identical. If not,
+    both are kept and the file counts as skipped. Empty folders stay in src.
+
+    :returns: dict with files, skipped, bytes, seconds, mb_per_s, files_per_s
+    """
+    return _bulk('move', src, dst, exts, patterns, recursive, workers, skip_same,
+                 verbose, kwargs)
+
+
+def remove_files(path, exts=None, patterns=None, recursive=False, workers=4,
+                 verbose=False, **kwargs):
+    """
+    Remove all files of path that match exts/patterns, see list_files.
+    Folders are not removed.
+
+    :returns: dict with files, skipped, bytes, seconds, mb_per_s, files_per_s
+    """
+    return _bulk('remove', path, None, exts, patterns, recursive, workers, False,
+                 verbose, kwargs)
+
+
+def du(path, depth=1, exts=None, patterns=None, by_ext=False, relative=False,
+       case_sensitive=False, workers=None, as_dataframe=False):
+    """
+    Disk usage of path and its subfolders up to `depth` levels, like
+    `du -d depth --apparent-size`, but counting only files that match
+    exts/patterns (same as list_files with recursive=True). The tree is
+    walked once, with workers threads listing folders ahead. Symlinked
+    folders are not followed, so nothing is counted twice.
+
+    Every folder contains the totals of all folders below it. The result
+    is columnar, with one row per folder (natural sort order):
+        folder: the folder, path itself is the first row
+        files: number of files
+        bytes: sum of the file sizes
+        ext: only if by_ext, one row per folder and extension. The ext
+             is the one of exts that matched, else the last suffix
+             of the name without dot (e.g. 'png'), '' if it has none.
+
+    :param path: folder to summarise
+    :param depth: number of subfolder levels that get their own row
+    :param by_ext: break down the rows by file extension
+    :param relative: give folders relative to path, path itself is '.'
+    :param workers: list this many folders concurrently with threads
+    :param as_dataframe: return a pandas DataFrame instead of a dict
+    :returns: dict of numpy arrays with the columns, or a DataFrame
+    """
+    import numpy as np
+    assert isinstance(path, str), "path needs to be a str"
+    assert os.path.isdir(path), 'Path {} does not exist'.format(path)
+
+    match = None
+    if exts is not None or patterns is not None:
+        match = compile_patterns(exts, patterns, True, case_sensitive).match
+    if isinstance(exts, str): exts = [exts]
+    # check longer exts first, e.g. tar.gz before gz
+    exts = sorted([ext.replace('*', '') for ext in exts or []], key=len, reverse=True)
+    if not case_sensitive:
+        exts = [ext.lower() for ext in exts]
+
+    def get_ext(name):
+        name = name if case_sensitive else name.lower()
+        for ext in exts:
+            if name.endswith(ext):
+                return ext.lstrip('.')
+        return os.path.splitext(name)[1][1:]
+
+    # first sum up each folder at the depth limit, then its parents
+    totals = {}  # (folder, ext) -> [files, bytes]
+    for relpath, is_dir, is_file, entry in _walk(path, None, follow_symlinks=False,
+                                                 workers=workers):
+        if is_dir:
+            # folders without matching files get a row as well
+            if relpath.count('/') < depth and not entry.is_symlink():
+                totals.setdefault((relpath, None), [0, 0])
+            continue
+        if not is_file or (match is not None and not match(relpath)):
+            continue
+        try:
+            size = entry.stat(follow_symlinks=False).st_size
+        except OSError:  # removed since the listing
+            continue
+        parts = relpath.split('/', depth)
+        folder = '/'.join(parts[:min(depth, len(parts) - 1)])
+        key = (folder, get_ext(parts[-1]) if by_ext else None)
+        total = totals.get(key)
+        if total is None:
+            totals[key] = [1, size]
+        else:
+            total[0] += 1
+            total[1] += size
+
+    rows = {}
+    for (folder, ext), (n_files, n_bytes) in totals.items():
+        parents = [folder] + [folder[:i] for i in range(len(folder)) if folder[i] == '/']
+        if folder: parents.append('')
+        for parent in parents:
+            row = rows.setdefault((parent, ext), [0, 0])
+            row[0] += n_files
+            row[1] += n_bytes
+    if by_ext:  # the empty folders only have a placeholder
+        rows = {key: row for key, row in rows.items() if key[1] is not None or row[0]}
+
+    sort_key = _get_sort_key('natural')
+    keys = sorted(rows, key=lambda key: (key[0] != '', sort_key(key[0] + '/'), key[1] or ''))
+    parent = os.path.abspath(path)
+    if relative:
+        folders = [join(folder) if folder else '.' for folder, _ in keys]
+    else:
+        folders = [join(parent, folder) if folder else join(parent) for folder, _ in keys]
+    columns = {'folder': np.array(folders, dtype=str)}
+    if by_ext:
+        columns['ext'] = np.array([ext for _, ext in keys], dtype=str)
+    columns['files'] = np.array([rows[key][0] for key in keys], dtype=np.int64)
+    columns['bytes'] = np.array([rows[key][1] for key in keys], dtype=np.int64)
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame(columns)
+    return columns
+
+
+_INDEX_MAGIC = b'OSPATHIX'
+_INDEX_VERSION = 2
+
+
+def build_index(root, out_file, workers=None):
+    """
+    Walk root once and write all files below it to a compact index file,
+    which FileIndex can query without touching the tree again. The index
+    is written to a temporary file first and replaces out_file at the end.
+
+    The file starts with a JSON header followed by flat arrays: the
+    folders and file names as utf-8 blobs with offsets, and per file the
+    id of its folder, the id of its extension (last suffix), its size and
+    mtime. The files are stored in the natural sort order of list_files.
+    Symlinked folders are indexed, unless they point to one of their own
+    parent folders. query() returns files below them in the same cases as
+    list_files does.
+
+    :param root: folder to index
+    :param out_file: file to write the index to
+    :param workers: list this many folders concurrently with threads
+    :returns: FileIndex of the new file
+    """
+    import json
+    import numpy as np
+    assert os.path.isdir(root), 'Path {} does not exist'.format(root)
+
+    links = []  # symlinked folders that were indexed
+    def follow_symlinks(relpath):
+        target = os.path.realpath(os.path.join(root, relpath))
+        parent = os.path.realpath(os.path.join(root, os.path.dirname(relpath)))
+        if parent == target or parent.startswith(target.rstrip(os.sep) + os.sep):
+            return False  # a loop
+        links.append(relpath + '/')
+        return True
+
+    dir_ids = {}
+    exts_ids = {}
+    names, file_dirs, file_exts, sizes, mtimes = [], [], [], [], []
+    for relpath, is_dir, is_file, entry in _walk(root, None, follow_symlinks=follow_symlinks,
+                                                 sort_key=_get_sort_key('natural'),
+                                                 workers=workers):
+        if not is_file:
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:  # removed since the listing
+            continue
+        i = relpath.rfind('/') + 1
+        folder, name = relpath[:i], relpath[i:]
+        dot = name.rfind('.')
+        ext = name[dot:] if dot >= 0 else ''
+        file_dirs.append(dir_ids.setdefault(folder, len(dir_ids)))
+        file_exts.append(exts_ids.setdefault(ext, len(exts_ids)))
+        names.append(name)
+        sizes.append(stat.st_size)
+        mtimes.append(stat.st_mtime)
+
+    def blob(strings):
+        encoded = [os.fsencode(s) for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    arrays = {}
+    arrays['dir_blob'], arrays['dir_offsets'] = blob(dir_ids)
+    arrays['dir_depth'] = np.array([d.count('/') for d in dir_ids], dtype=np.int32)
+    arrays['ext_blob'], arrays['ext_offsets'] = blob(exts_ids)
+    arrays['link_blob'], arrays['link_offsets'] = blob(links)
+    arrays['name_blob'], arrays['name_offsets'] = blob(names)
+    arrays['file_dir'] = np.array(file_dirs, dtype=np.int32)
+    arrays['file_ext'] = np.array(file_exts, dtype=np.int32)
+    arrays['size'] = np.array(sizes, dtype=np.int64)
+    arrays['mtime'] = np.array(mtimes, dtype=np.float64)
+
+    # the arrays are aligned to 64 bytes after the header
+    header = {'version': _INDEX_VERSION, 'root': os.path.abspath(root),
+              'created': time.time(), 'files': len(names), 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, len(array), offset]
+        offset += -(-array.nbytes // 64) * 64
+    header_bytes = json.dumps(header).encode()
+    start = -(-(len(_INDEX_MAGIC) + 8 + len(header_bytes)) // 64) * 64
+
+    tmp_file = out_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(_INDEX_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(start + header['arrays'][name][2])
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp_file, out_file)
+    return FileIndex(out_file)
+
+
+class FileIndex():
+    """
+    Index file written by build_index. The file is memory mapped, only the
+    header is read when opening it, the arrays are paged in by the OS when
+    a query needs them.
+
+    Example:
+        index = ospath.build_index(root, 'archive.idx')  # once
+        index = ospath.FileIndex('archive.idx')          # later
+        files = index.query(exts='edf', recursive=True)
+
+    :param file: index file written by build_index
+    """
+    def __init__(self, file):
+        import json, mmap
+        self.file = file
+        with open(file, 'rb') as f:
+            magic = f.read(len(_INDEX_MAGIC))
+            if magic != _INDEX_MAGIC:
+                raise ValueError(f'{file} is not an ospath index')
+            header_len = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_len))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if header['version'] != _INDEX_VERSION:
+            raise ValueError(f'{file} has index version {header["version"]}, '
+                             f'expected {_INDEX_VERSION}, build it again')
+        self._start = -(-(len(_INDEX_MAGIC) + 8 + header_len) // 64) * 64
+        self._arrays = header['arrays']
+        self._cache = {}
+        self.root = header['root']
+        self.created = header['created']
+        self.n_files = header['files']
+
+    def _array(self, name):
+        """numpy array that points into the memory mapped file"""
+        array = self._cache.get(name)
+        if array is None:
+            import numpy as np
+            dtype, count, offset = self._arrays[name]
+            if count == 0:  # can point behind the end of the file
+                array = np.empty(0, dtype=dtype)
+            else:
+                array = np.frombuffer(self._mmap, dtype=dtype, count=count,
+                                      offset=self._start + offset)
+            self._cache[name] = array
+        return array
+
+    def _strings(self, name):
+        """decode a whole blob, for the folders and extensions"""
+        strings = self._cache.get(name + '_strings')
+        if strings is None:
+            blob = self._array(name + '_blob').tobytes()
+            offsets = self._array(name + '_offsets').tolist()
+            strings = [os.fsdecode(blob[a:b]) for a, b in zip(offsets[:-1], offsets[1:])]
+            self._cache[name + '_strings'] = strings
+        return strings
+
+    def _names(self, rows):
+        """decode the file names of the given rows"""
+        offsets = self._array('name_offsets')
+        start = self._start + self._arrays['name_blob'][2]
+        starts, ends = offsets[rows].tolist(), offsets[rows + 1].tolist()
+        if not starts:
+            return []
+        # names next to each other are decoded in one go, if they are ascii
+        # the offsets of the bytes are the same as of the characters
+        lo, hi = starts[0], ends[-1]
+        if hi - lo <= 4 * sum(b - a for a, b in zip(starts, ends)) + 65536:
+            text = os.fsdecode(self._mmap[start + lo:start + hi])
+            if len(text) == hi - lo:
+                return [text[a - lo:b - lo] for a, b in zip(starts, ends)]
+        mm = self._mmap
+        return [os.fsdecode(mm[start + a:start + b]) for a, b in zip(starts, ends)]
+
+    def _relpaths(self, rows):
+        dirs = self._strings('dir')
+        return [dirs[d] + name for d, name in
+                zip(self._array('file_dir')[rows].tolist(), self._names(rows))]
+
+    def _match_suffixes(self, rows, length, suffixes, case_sensitive):
+        """
+        vectorised version of the suffix lookup of PatternMatcher for the
+        given rows, returns a boolean mask
+        """
+        import numpy as np
+        if all(s[:1] == '.' and s.count('.') == 1 for s in suffixes):
+            # the suffix can only be the extension of the file, so it is
+            # enough to look at the (few) different extensions
+            exts = self._strings('ext')
+            fold = str if case_sensitive else str.lower
+            table = np.array([len(ext) == length and fold(ext) in suffixes
+                              for ext in exts], dtype=bool)
+            return table[self._array('file_ext')[rows]]
+
+        # compare the last bytes of the names, files with non-ascii
+        # characters in these bytes are compared by python afterwards
+        offsets = self._array('name_offsets')
+        blob = self._array('name_blob')
+        ends = offsets[rows + 1]
+        long_enough = ends - offsets[rows] >= length
+        ascii_suffixes = [s.encode() for s in suffixes if s.isascii()]
+        mask = np.zeros(len(rows), dtype=bool)
+        recheck = long_enough.copy() if len(ascii_suffixes) < len(suffixes) \
+                  else np.zeros(len(rows), dtype=bool)
+        if ascii_suffixes and len(rows):
+            positions = np.maximum(ends[:, None] - length + np.arange(length), 0)
+            tails = blob[positions]
+            if not case_sensitive:
+                upper = (tails >= 65) & (tails <= 90)
+                tails = np.where(upper, tails + 32, tails)
+            expected = np.frombuffer(b''.join(ascii_suffixes), dtype=np.uint8)
+            expected = expected.reshape(len(ascii_suffixes), length)
+            for suffix in expected:
+                mask |= (tails == suffix).all(1)
+            mask &= long_enough
+            recheck |= long_enough & (tails >= 128).any(1)
+        if recheck.any():
+            fold = str if case_sensitive else str.lower
+            names = self._names(rows[recheck])
+            mask[recheck] = [len(name) >= length and fold(name[-length:]) in suffixes
+                             for name in names]
+        return mask
+
+    def query(self, exts=None, patterns=None, recursive=False, relative=False,
+              case_sensitive=False, max_results=None, min_size=None, max_size=None,
+              newer_than=None, older_than=None):
+        """
+        Files of the index that match, with the same arguments and results as
+        list_files on the indexed root (and the filters of scan_files).
+        Extensions and patterns like '*.png' are matched with numpy for all
+        files at once, other patterns with a regular expression per file.
+
+        :returns: list of file names
+        """
+        import numpy as np
+        if isinstance(patterns, PatternMatcher):
+            assert exts is None, 'exts are part of the PatternMatcher already'
+            matcher = patterns
+        else:
+            matcher = compile_patterns(exts, patterns, recursive, case_sensitive)
+
+        depth = self._array('dir_depth')[self._array('file_dir')]
+        mask = np.zeros(self.n_files, dtype=bool)
+        for length, any_depth, suffixes in matcher.suffixes:
+            rows = np.arange(self.n_files) if any_depth else np.flatnonzero(depth == 0)
+            mask[rows] |= self._match_suffixes(rows, length, suffixes, matcher.case_sensitive)
+        if matcher.regex is not None:
+            rows = np.flatnonzero(~mask)
+            if matcher.max_depth is not None:
+                rows = rows[depth[rows] <= matcher.max_depth]
+            fullmatch = matcher.regex.fullmatch
+            hits = [fullmatch(relpath) is not None for relpath in self._relpaths(rows)]
+            mask[rows[np.array(hits, dtype=bool)]] = True
+
+        links = set(self._strings('link'))
+        if links and matcher.max_depth is None:
+            # '**' doesn't descend into symlinked folders, as in list_files
+            linked = np.array([any(d[:i + 1] in links for i, c in enumerate(d) if c == '/')
+                               for d in self._strings('dir')], dtype=bool)
+            rows = np.flatnonzero(mask & linked[self._array('file_dir')])
+            hits = [matcher.match_symlinked(relpath, links) for relpath in self._relpaths(rows)]
+            mask[rows[~np.array(hits, dtype=bool)]] = False
+
+        if min_size is not None: mask &= self._array('size') >= min_size
+        if max_size is not None: mask &= self._array('size') <= max_size
+        if newer_than is not None: mask &= self._array('mtime') > _to_timestamp(newer_than)
+        if older_than is not None: mask &= self._array('mtime') < _to_timestamp(older_than)
+
+        rows = np.flatnonzero(mask)[:max_results]
+        if relative:
+            return normalize_many(self._relpaths(rows))
+        return join_many(self.root, self._relpaths(rows))
+
+    def close(self):
+        """close the memory map, e.g. to replace the file on Windows"""
+        self._cache.clear()
+        self._mmap.close()
+
+    def __len__(self):
+        return self.n_files
+
+    def __repr__(self):
+        return f'FileIndex({self.file!r}, root={self.root!r}, files={self.n_files})'
+
+
+def _list_files_glob(path, exts=None, patterns=None, relative=False, recursive=False,
+               subfolders=None, only_folders=False, max_results=None, 
+               case_sensitive=False):
+    """
+    Previous implementation of list_files based on one Path.glob traversal
+    per pattern. Kept as reference for the unittests and benchmarks.
+    """
+    from pathlib import Path
+    from natsort import natsort_key
+
     def insensitive_glob(pattern):
         f = lambda c: '[%s%s]' % (c.lower(), c.upper()) if c.isalpha() else c
         return ''.join(map(f, pattern))
@@ -213,6 +2199,8 @@ def choose_files(default_dir=None, exts='txt', title='Choose one or multiple fil
     :param exts: A string or list of strings with extensions etc: 'txt' or ['txt','csv']
     :returns: the chosen file
     """
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilenames
     root = Tk()
     root.iconify()
     root.update()
@@ -240,6 +2228,8 @@ def choose_file(default_dir=None, default_file=None, exts='txt',
     :param exts: A string or list of strings with extensions etc: 'txt' or ['txt','csv']
     :returns: the chosen file
     """
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename, asksaveasfilename
     root = Tk()
     root.iconify()
     root.update()
@@ -277,6 +2267,8 @@ def choose_folder(default_dir=None,exts='txt', title='Choose file'):
     :param exts: A string or list of strings with extensions etc: 'txt' or ['txt','csv']
     :returns: the chosen file
     """
+    from tkinter import Tk
+    from tkinter.filedialog import askdirectory
     root = Tk()
     root.iconify()
     root.update()
@@ -292,16 +2284,36 @@ def choose_folder(default_dir=None,exts='txt', title='Choose file'):
         return name
 
 
-def valid_filename(string, replacement='_'):
-    """
-    replace all non-valid filename characters with an underscore
-    """
+def _valid_filename_table(replacement):
+    """translation table for valid_filename"""
     invalid_chars = "<>:\"/\\|?*\n\r\t"
     conversion = {c:replacement for c in invalid_chars}
     conversion['"'] = "'" # replace by valid quotes
     conversion['<'] = '(' # replace by other brakets
     conversion['>'] = ')' # replace by other brakets
-    
+    return str.maketrans(conversion)
+
+
+def valid_filename(string, replacement='_'):
+    """
+    replace all non-valid filename characters with an underscore
+    """
     string = str(string)
-    valid_filename = ''.join([conversion.get(c, c) for c in string])
-    return valid_filename
+    return string.translate(_valid_filename_table(replacement))
+
+
+def valid_filename_many(strings, replacement='_'):
+    """
+    Same as valid_filename for many strings at once. All strings are
+    translated in one go as a single NULL-separated buffer.
+
+    :param strings: list of strings or numpy array
+    :returns: list of valid filenames, or a numpy array for array input
+    """
+    strings, is_array = _as_list(strings)
+    strings = [str(string) for string in strings]
+    table = _valid_filename_table(replacement)
+    valid = '\x00'.join(strings).translate(table).split('\x00')
+    if len(valid) != len(strings):  # NULL inside of the strings
+        valid = [string.translate(table) for string in strings]
+    return _as_output(valid, is_array)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio versions of the ospath functions that touch the disk, for event
+loops that can't be blocked by listings of slow network drives.
+
+    files = await ospath.aio.list_files(path, exts='edf', recursive=True)
+    async for file in ospath.aio.iter_files(path, recursive=True):
+        ...
+
+The signatures are the same as for the synchronous functions. All reads
+run on a shared, bounded thread pool. Reads from the same mount point
+are limited to `max_per_mount` at the same time, so a slow share can't
+take all threads of the pool.
+
+@author: Simon Kern (@skjerns)
+"""
+import os
+import time
+import asyncio
+import threading
+import weakref
+import ospath
+
+max_workers = 32    # threads of the shared pool
+max_per_mount = 8   # concurrent reads of the same mount point
+
+_executor = None
+_lock = threading.Lock()
+_mounts = {}  # folder -> mount point
+_semaphores = weakref.WeakKeyDictionary()  # event loop -> {mount: Semaphore}
+
+
+def _get_executor():
+    """the thread pool shared by all calls, created on first use"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _executor = ThreadPoolExecutor(max_workers, thread_name_prefix='ospath.aio')
+    return _executor
+
+
+def _mount(folder):
+    """mount point of folder, runs in the pool as ismount stats the disk"""
+    mount = _mounts.get(folder)
+    if mount is None:
+        mount = os.path.abspath(folder)
+        while not os.path.ismount(mount):
+            parent = os.path.dirname(mount)
+            if parent == mount:
+                break
+            mount = parent
+        if len(_mounts) > 10000: _mounts.clear()
+        _mounts[folder] = mount
+    return mount
+
+
+async def _get_semaphore(folder):
+    """semaphore that limits the reads of the mount point of folder"""
+    loop = asyncio.get_running_loop()
+    mount = await loop.run_in_executor(_get_executor(), _mount, folder)
+    semaphores = _semaphores.setdefault(loop, {})
+    semaphore = semaphores.get(mount)
+    if semaphore is None:
+        semaphore = semaphores[mount] = asyncio.Semaphore(max_per_mount)
+    return semaphore
+
+
+async def _run(semaphore, func, *args):
+    """run func(*args) in the pool, once the semaphore of the mount allows it"""
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+async def exists(path):
+    """asynchronous os.path.exists"""
+    semaphore = await _get_semaphore(os.path.dirname(path) or '.')
+    return await _run(semaphore, os.path.exists, path)
+
+
+async def getsize(filename):
+    """asynchronous os.path.getsize"""
+    semaphore = await _get_semaphore(os.path.dirname(filename) or '.')
+    return await _run(semaphore, os.path.getsize, filename)
+
+
+async def _walk(root, max_depth=None, follow_symlinks=True, sort_key=None,
+                workers=None, scandir=ospath._scandir, profile=None):
+    """
+    asynchronous ospath._walk, yields (relpath, is_dir, is_file, entry) in
+    the same order. The subfolders are listed ahead by tasks, at most
+    `workers` at the same time (default: max_per_mount). Folders that are
+    mounted below root share the limit of the mount point of root.
+    With a profile, time_walk is the time the walk waited for listings,
+    which includes sorting them in the pool.
+    """
+    semaphore = await _get_semaphore(root)
+    limit = asyncio.Semaphore(workers or max_per_mount)
+    max_pending = 16 * (workers or max_per_mount)
+    pending = {}  # relpath -> task that lists it
+
+    # as in ospath._walk, the keys of names that repeat in many folders are
+    # computed once. Setting dict items is atomic, so threads can share it
+    keys = {}
+    def cached_key(name):
+        key = keys.get(name)
+        if key is None:
+            if len(keys) > 100000: keys.clear()
+            key = keys[name] = sort_key(name)
+        return key
+
+    def list_sorted(path):
+        # sorting in the thread keeps the event loop free, the time is
+        # added to the profile by the loop, the threads would race
+        entries = scandir(path)
+        seconds = 0.0
+        if sort_key is not None:
+            start = time.perf_counter()
+            entries.sort(key=lambda e: cached_key(e[0] + '/' if e[1] else e[0]))
+            seconds = time.perf_counter() - start
+        return entries, seconds
+
+    async def list_folder(relpath):
+        async with limit:
+            return await _run(semaphore, list_sorted, os.path.join(root, relpath))
+
+    async def listdir(relpath, depth):
+        if profile is not None:
+            start = time.perf_counter()
+        task = pending.pop(relpath, None)
+        entries, time_sort = await (task if task is not None else list_folder(relpath))
+        if profile is not None:
+            profile.time_walk += time.perf_counter() - start
+            profile.time_sort += time_sort
+            profile.dirs += 1
+            profile.entries += len(entries)
+        if max_depth is None or depth < max_depth:
+            for name, is_dir, is_file, is_symlink, _ in entries:
+                if len(pending) >= max_pending:
+                    break
+                if is_dir and (not is_symlink or follow_symlinks is True or
+                               follow_symlinks and follow_symlinks(relpath + name)):
+                    subfolder = relpath + name + '/'
+                    pending[subfolder] = asyncio.ensure_future(list_folder(subfolder))
+        return iter(entries)
+
+    try:
+        stack = [('', 0, await listdir('', 0))]
+        while stack:
+            prefix, depth, entries = stack[-1]
+            descend = max_depth is None or depth < max_depth
+            for name, is_dir, is_file, is_symlink, entry in entries:
+                relpath = prefix + name
+                yield relpath, is_dir, is_file, entry
+                if descend and is_dir and (not is_symlink or follow_symlinks is True or
+                                           follow_symlinks and follow_symlinks(relpath)):
+                    relpath += '/'
+                    stack.append((relpath, depth + 1, await listdir(relpath, depth + 1)))
+                    break
+            else:
+                stack.pop()
+    finally:
+        for task in pending.values():
+            task.cancel()
+
+
+async def iter_files(path, exts=None, patterns=None, relative=False, recursive=False,
+                     subfolders=None, only_folders=False, max_results=None,
+                     case_sensitive=False, sorted=True, workers=None, cache=None,
+                     sort='natural', profile=False):
+    """
+    asynchronous ospath.iter_files, an async generator of file names in
+    the same order. Folders are listed concurrently by the shared pool,
+    workers limits how many folders of this call are listed at once.
+    profile=True collects the same statistics as ospath.iter_files, see
+    ospath.stats(), time_walk is the time spent waiting for the pool.
+    """
+    if subfolders is not None:
+        import warnings
+        warnings.warn("`subfolders` is deprecated, use `recursive=` instead", DeprecationWarning)
+        recursive = subfolders
+
+    assert isinstance(path, str), "path needs to be a str"
+    assert await exists(path), 'Path {} does not exist'.format(path)
+
+    if isinstance(patterns, ospath.PatternMatcher):
+        assert exts is None, 'exts are part of the PatternMatcher already'
+        matcher = patterns
+    else:
+        matcher = ospath.compile_patterns(exts, patterns, recursive, case_sensitive)
+    match, max_depth = matcher.match, matcher.max_depth
+    follow_symlinks, links = ospath._follow_symlinks(matcher)
+    match_symlinked = matcher.match_symlinked
+
+    parent = os.path.abspath(path)
+    prof = ospath._start_profile(profile, path)
+    sort_key = ospath._get_sort_key(sort if sorted else None)
+    scandir = ospath._get_scandir(cache)
+    listing_cache = getattr(scandir, '__self__', None)
+    if prof is not None and listing_cache is not None:
+        hits, misses = listing_cache.hits, listing_cache.misses
+    walk = _walk(path, max_depth, follow_symlinks, sort_key=sort_key,
+                 workers=workers, scandir=scandir, profile=prof)
+    n_files = 0
+    try:
+        async for relpath, is_dir, is_file, entry in walk:
+            if prof is None:
+                if not (is_file and match(relpath) and
+                        (not links or match_symlinked(relpath, links))):
+                    continue
+                yield ospath.join(relpath) if relative else ospath.join(parent, relpath)
+            else:
+                # same as above, but timed as in ospath._iter_matches
+                start = time.perf_counter()
+                matched = is_file and match(relpath) and \
+                          (not links or match_symlinked(relpath, links))
+                prof.time_match += time.perf_counter() - start
+                if not matched:
+                    continue
+                prof.matches += 1
+                start = time.perf_counter()
+                file = ospath.join(relpath) if relative else ospath.join(parent, relpath)
+                prof.time_normalise += time.perf_counter() - start
+                yield file
+            n_files += 1
+            if max_results is not None and n_files >= max_results:
+                return
+    finally:
+        await walk.aclose()
+        if prof is not None:
+            if listing_cache is not None:
+                prof.cache_hits += listing_cache.hits - hits
+                prof.cache_misses += listing_cache.misses - misses
+                prof.stats += prof.dirs
+            ospath._finish_profile(prof)
+
+
+async def list_files(path, exts=None, patterns=None, relative=False, recursive=False,
+                     subfolders=None, only_folders=False, max_results=None,
+                     case_sensitive=False, workers=None, cache=None, sort='natural',
+                     profile=False):
+    """asynchronous ospath.list_files, returns the same list"""
+    files = iter_files(path, exts=exts, patterns=patterns, relative=relative,
+                       recursive=recursive, subfolders=subfolders,
+                       max_results=max_results, case_sensitive=case_sensitive,
+                       workers=workers, cache=cache, sort=sort, profile=profile)
+    return list(dict.fromkeys([file async for file in files]))
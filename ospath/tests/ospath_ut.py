@@ -6,6 +6,9 @@ Created on Fri Feb 23 11:52:26 2018
 """
 
 import os
+import sys
+import tempfile
+import subprocess
 import ospath
 import unittest
 
@@ -23,6 +26,43 @@ class OsPathTest(unittest.TestCase):
         joined = ospath.join(lead_slash, lead_slash)
         self.assertEqual(joined, '/path/to/folder/is/path/to/folder/is')
         
+    def test_join_legacy_equal(self):
+        # the fast paths of join need to return the same as before
+        paths = ['path/to/////folder/is//', 'path\\to\\\\folder\\is', 'tesfile.txt',
+                 '/path/to/folder/is', '~', '~/data', './relative', '../up/../x',
+                 '', '/', '//server/share', 'a/./b', 'c:/path\\to/file//file.file.txt',
+                 'folder/', '.', '..', 'sub/file.tar.gz']
+        for path in paths:
+            self.assertEqual(ospath.join(path), ospath._join_legacy(path), path)
+            for path2 in paths:
+                self.assertEqual(ospath.join(path, path2),
+                                 ospath._join_legacy(path, path2), (path, path2))
+                self.assertEqual(ospath.join(path, path2, '/'),
+                                 ospath._join_legacy(path, path2, '/'), (path, path2))
+
+    def test_batch_functions(self):
+        paths = ['path/to/////folder/is//', 'path\\to\\\\folder\\is', 'tesfile.txt',
+                 '/path/to/folder/is', '~/data', './relative', '../up/../x', '',
+                 '/', 'a/./b', 'c:/path\\to/file//file.file.txt', '.hidden',
+                 'sub/file.tar.gz', 'in<valid>:"name"?.txt']
+        names = paths[::-1]
+        self.assertEqual(ospath.normalize_many(paths), [ospath.join(p) for p in paths])
+        self.assertEqual(ospath.join_many(paths, names),
+                         [ospath.join(p, n) for p, n in zip(paths, names)])
+        self.assertEqual(ospath.join_many('/base', names),
+                         [ospath.join('/base', n) for n in names])
+        self.assertEqual(ospath.join_many(paths, 'file.txt'),
+                         [ospath.join(p, 'file.txt') for p in paths])
+        from pathlib import Path
+        self.assertEqual(ospath.join_many(Path('/base'), [Path(n) for n in names]),
+                         [ospath.join(Path('/base'), Path(n)) for n in names])
+        self.assertEqual(ospath.join_many([Path(p) for p in paths], 'file.txt'),
+                         [ospath.join(Path(p), 'file.txt') for p in paths])
+        roots, exts = ospath.splitext_many(paths)
+        self.assertEqual(list(zip(roots, exts)), [ospath.splitext(p) for p in paths])
+        self.assertEqual(ospath.valid_filename_many(paths),
+                         [ospath.valid_filename(p) for p in paths])
+
     def test_splitext(self):
         path = 'path\\to/file//file.file.txt'
         ext  = ospath.splitext(path)
@@ -105,6 +145,423 @@ class OsPathTest(unittest.TestCase):
             self.assertTrue(ospath.exists(file))
             self.assertFalse(isinstance(file, str))
             
+    def test_list_files_glob_equal(self):
+        # the scandir engine needs to return exactly what Path.glob returned
+        path = '.'
+        options = [dict(), dict(exts='png'), dict(exts=['png', '.jpg', 'txt']),
+                   dict(patterns='*IMAGE1*'), dict(patterns=['**/*txt']),
+                   dict(patterns='*IMAGE1*', case_sensitive=True),
+                   dict(patterns='folder1/*/image[!1].png'),
+                   dict(exts=['.png', '.jpg', 'txt'], patterns='*_ut*')]
+        for kwargs in options:
+            for recursive in [False, True]:
+                for relative in [False, True]:
+                    files = ospath.list_files(path, recursive=recursive,
+                                              relative=relative, **kwargs)
+                    files_glob = ospath._list_files_glob(path, recursive=recursive,
+                                                         relative=relative, **kwargs)
+                    self.assertEqual(files, files_glob, kwargs)
+
+    @unittest.skipIf(os.name == 'nt', 'symlinks need admin rights on Windows')
+    def test_list_files_symlinks(self):
+        import asyncio
+        # glob enters symlinked folders with '*' or names, but not with '**'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root, outside = ospath.join(tmpdir, 'root'), ospath.join(tmpdir, 'outside')
+            os.makedirs(ospath.join(root, 'folder/subfolder'))
+            os.makedirs(ospath.join(outside, 'deep'))
+            for file in ['root/image.png', 'root/folder/image.png',
+                         'root/folder/subfolder/image.png', 'outside/image.png',
+                         'outside/deep/image.png']:
+                open(ospath.join(tmpdir, file), 'w').close()
+            os.symlink(outside, ospath.join(root, 'link'))
+            os.symlink(root, ospath.join(root, 'folder/loop'))
+            for patterns in ['*.png', '*/*.png', '*/*/*.png', 'link/*.png', 'link/**/*.png']:
+                for recursive in [False, True]:
+                    files = ospath.list_files(root, patterns=patterns, recursive=recursive,
+                                              relative=True)
+                    files_glob = ospath._list_files_glob(root, patterns=patterns,
+                                                         recursive=recursive, relative=True)
+                    self.assertEqual(sorted(files), sorted(files_glob), (patterns, recursive))
+                    files_aio = asyncio.run(ospath.aio.list_files(
+                        root, patterns=patterns, recursive=recursive, relative=True))
+                    self.assertEqual(files_aio, files, (patterns, recursive))
+            files = ospath.list_files(root, patterns='*/*.png', recursive=True, relative=True)
+            self.assertIn('link/image.png', files)
+            self.assertNotIn('link/image.png', ospath.list_files(root, exts='png', recursive=True,
+                                                                 relative=True))
+
+    def test_compile_patterns(self):
+        path = '.'
+        options = [dict(exts='png'), dict(exts=['png', '.jpg', 'txt']),
+                   dict(exts=['.PNG'], case_sensitive=True),
+                   dict(patterns='*IMAGE1*'), dict(exts='.png', patterns='*_ut*')]
+        for kwargs in options:
+            for recursive in [False, True]:
+                matcher = ospath.compile_patterns(recursive=recursive, **kwargs)
+                files = ospath.list_files(path, recursive=recursive, **kwargs)
+                self.assertEqual(ospath.list_files(path, patterns=matcher), files)
+                self.assertEqual(ospath.list_files(path, patterns=matcher), files)
+        matcher = ospath.compile_patterns(exts=['.png', 'jpg'], recursive=True)
+        self.assertTrue(matcher('folder/image.PNG'))
+        self.assertTrue(matcher('image.jpg'))
+        self.assertFalse(matcher('image.gif'))
+
+    def test_sort(self):
+        path = '.'
+        files = ospath.list_files(path, recursive=True, sort=None)
+        self.assertEqual(ospath.list_files(path, recursive=True),
+                         sorted(files, key=ospath.natsort_key))
+        self.assertEqual(ospath.list_files(path, recursive=True, sort='lexical'),
+                         sorted(files))
+        folders = ospath.list_folders(path, recursive=True, add_parent=True, sort=None)
+        self.assertEqual(ospath.list_folders(path, recursive=True, add_parent=True),
+                         sorted(folders, key=ospath.natsort_key))
+        with self.assertRaises(ValueError):
+            ospath.list_files(path, sort='random')
+
+    def test_iter_files(self):
+        path = '.'
+        for kwargs in [dict(), dict(exts='png'), dict(patterns='*image1*')]:
+            for relative in [False, True]:
+                files = ospath.list_files(path, recursive=True, relative=relative, **kwargs)
+                files_iter = ospath.iter_files(path, recursive=True, relative=relative, **kwargs)
+                self.assertFalse(isinstance(files_iter, list))
+                self.assertEqual(list(files_iter), files)
+                files_unsorted = ospath.iter_files(path, recursive=True, relative=relative,
+                                                   sorted=False, **kwargs)
+                self.assertEqual(sorted(files_unsorted), sorted(files))
+
+        files = list(ospath.iter_files(path, exts=['png', 'jpg'], recursive=True,
+                                       max_results=3))
+        self.assertEqual(len(files), 3)
+
+    def test_scan_files(self):
+        path = '.'
+        files = ospath.list_files(path, exts=['png', 'jpg'], recursive=True)
+        infos = ospath.scan_files(path, exts=['png', 'jpg'], recursive=True)
+        self.assertEqual([info.path for info in infos], files)
+        for file, size, mtime, is_dir in infos:
+            self.assertEqual(size, os.path.getsize(file))
+            self.assertEqual(mtime, os.path.getmtime(file))
+            self.assertFalse(is_dir)
+
+        # cached listings have no DirEntry, the stat is done afterwards
+        cache = ospath.ListingCache(min_age=0)
+        for _ in range(2):
+            infos_cached = ospath.scan_files(path, exts=['png', 'jpg'], recursive=True, cache=cache)
+            self.assertEqual(infos_cached, infos)
+
+        sizes = sorted(info.size for info in infos)
+        median = sizes[len(sizes)//2]
+        infos_large = ospath.scan_files(path, exts=['png', 'jpg'], recursive=True, min_size=median)
+        self.assertEqual(infos_large, [info for info in infos if info.size >= median])
+        infos_small = ospath.scan_files(path, exts=['png', 'jpg'], recursive=True, max_size=median)
+        self.assertEqual(infos_small, [info for info in infos if info.size <= median])
+
+        from datetime import datetime
+        future = datetime.now().timestamp() + 3600
+        self.assertEqual(ospath.scan_files(path, recursive=True, newer_than=future), [])
+        self.assertEqual(ospath.scan_files(path, exts=['png', 'jpg'], recursive=True,
+                                           older_than=datetime.fromtimestamp(future)), infos)
+        self.assertEqual(len(ospath.scan_files(path, recursive=True, max_results=2)), 2)
+
+    def test_listing_cache(self):
+        cache = ospath.ListingCache(min_age=0)
+        files = ospath.list_files('.', recursive=True, cache=cache)
+        self.assertEqual(files, ospath.list_files('.', recursive=True))
+        misses = cache.misses
+        files_cached = ospath.list_files('.', recursive=True, cache=cache)
+        self.assertEqual(files, files_cached)
+        self.assertEqual(cache.misses, misses)
+        self.assertEqual(cache.hits, misses)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            open(ospath.join(tmpdir, 'a.txt'), 'w').close()
+            os.utime(tmpdir, (1000, 1000))
+            files = ospath.list_files(tmpdir, cache=cache, relative=True)
+            self.assertEqual(files, ['a.txt'])
+            # a new file changes the mtime of the folder
+            open(ospath.join(tmpdir, 'b.txt'), 'w').close()
+            os.utime(tmpdir, (2000, 2000))
+            files = ospath.list_files(tmpdir, cache=cache, relative=True)
+            self.assertEqual(files, ['a.txt', 'b.txt'])
+
+            cache_file = ospath.join(tmpdir, 'cache.pkl')
+            cache.save(cache_file)
+            cache_loaded = ospath.ListingCache(file=cache_file)
+            self.assertEqual(len(cache_loaded), len(cache))
+
+    def test_watch(self):
+        backends = ['poll'] + (['inotify'] if sys.platform.startswith('linux') else [])
+        for backend in backends:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                os.makedirs(ospath.join(tmpdir, 'a/b'))
+                with open(ospath.join(tmpdir, 'a/x.txt'), 'w') as f:
+                    f.write('1')
+                watcher = ospath.watch(tmpdir, exts='txt', recursive=True, relative=True,
+                                       interval=0.05, timeout=10, initial=True, backend=backend)
+                self.assertEqual(next(watcher), ('added', 'a/x.txt'))
+
+                with open(ospath.join(tmpdir, 'a/b/new.txt'), 'w') as f:
+                    f.write('1')
+                open(ospath.join(tmpdir, 'ignored.png'), 'w').close()
+                self.assertEqual(next(watcher), ('added', 'a/b/new.txt'))
+
+                with open(ospath.join(tmpdir, 'a/x.txt'), 'w') as f:
+                    f.write('12')
+                self.assertEqual(next(watcher), ('modified', 'a/x.txt'))
+
+                import shutil
+                shutil.rmtree(ospath.join(tmpdir, 'a'))
+                events = sorted([next(watcher), next(watcher)])
+                self.assertEqual(events, [('removed', 'a/b/new.txt'), ('removed', 'a/x.txt')])
+                watcher.close()
+
+            # with modified=False, changed contents are not reported
+            with tempfile.TemporaryDirectory() as tmpdir:
+                with open(ospath.join(tmpdir, 'x.txt'), 'w') as f:
+                    f.write('1')
+                watcher = ospath.watch(tmpdir, exts='txt', relative=True, interval=0.05,
+                                       timeout=10, initial=True, backend=backend,
+                                       modified=False)
+                self.assertEqual(next(watcher), ('added', 'x.txt'))
+                with open(ospath.join(tmpdir, 'x.txt'), 'w') as f:
+                    f.write('12')
+                open(ospath.join(tmpdir, 'y.txt'), 'w').close()
+                self.assertEqual(next(watcher), ('added', 'y.txt'))
+                watcher.close()
+
+    def test_find_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            contents = {'a.bin': b'x' * 5000,
+                        'sub/a_copy.bin': b'x' * 5000,
+                        'b.bin': b'x' * 2000 + b'y' + b'x' * 2999,  # same blocks as a
+                        'c.bin': b'x' * 4999 + b'z',
+                        'd.bin': b'small',
+                        'sub/d_copy.bin': b'small',
+                        'sub/d_copy.txt': b'small',
+                        'e.bin': b'other'}
+            for name, content in contents.items():
+                os.makedirs(ospath.join(tmpdir, ospath.dirname(name)), exist_ok=True)
+                with open(ospath.join(tmpdir, name), 'wb') as f:
+                    f.write(content)
+
+            duplicates, stats = ospath.find_duplicates(tmpdir, exts='bin', recursive=True,
+                                                       relative=True, block_size=1000,
+                                                       return_stats=True)
+            self.assertEqual(duplicates, [['a.bin', 'sub/a_copy.bin'],
+                                          ['d.bin', 'sub/d_copy.bin']])
+            self.assertEqual(stats['files'], 7)
+            # a, a_copy, b and c have the same size, d, d_copy and e too
+            self.assertEqual(stats['partial_files'], 7)
+            self.assertEqual(stats['partial_bytes'], 4 * 2000 + 3 * 5)
+            # c differs in the last block, d and e are read completely already
+            self.assertEqual(stats['full_files'], 3)
+            self.assertEqual(stats['full_bytes'], 3 * 5000)
+
+            duplicates = ospath.find_duplicates(tmpdir, recursive=True, relative=True, workers=1)
+            self.assertEqual(duplicates, [['a.bin', 'sub/a_copy.bin'],
+                                          ['d.bin', 'sub/d_copy.bin', 'sub/d_copy.txt']])
+
+    def test_copy_move_remove_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src, dst = ospath.join(tmpdir, 'src'), ospath.join(tmpdir, 'dst')
+            for name in ['a.txt', 'b.png', 'sub/c.txt', 'sub/deeper/d.txt']:
+                os.makedirs(ospath.join(src, ospath.dirname(name)), exist_ok=True)
+                with open(ospath.join(src, name), 'w') as f:
+                    f.write(name * 100)
+            files = ospath.list_files(src, exts='txt', recursive=True, relative=True)
+
+            for workers in [1, 4]:
+                stats = ospath.copy_files(src, dst, exts='txt', recursive=True, workers=workers)
+                self.assertEqual(stats['files'], 3 if workers == 1 else 0)
+                self.assertEqual(ospath.list_files(dst, recursive=True, relative=True), files)
+                for file in files:
+                    with open(ospath.join(dst, file)) as f:
+                        self.assertEqual(f.read(), file * 100)
+                    self.assertEqual(int(os.path.getmtime(ospath.join(dst, file))),
+                                     int(os.path.getmtime(ospath.join(src, file))))
+
+            # only changed files are copied again
+            with open(ospath.join(src, 'a.txt'), 'w') as f:
+                f.write('changed')
+            stats = ospath.copy_files(src, dst, exts='txt', recursive=True)
+            self.assertEqual((stats['files'], stats['skipped'], stats['bytes']), (1, 2, 7))
+            stats = ospath.copy_files(src, dst, exts='txt', recursive=True, skip_same=False)
+            self.assertEqual(stats['files'], 3)
+
+            moved = ospath.join(tmpdir, 'moved')
+            stats = ospath.move_files(dst, moved, recursive=True)
+            self.assertEqual(stats['files'], 3)
+            self.assertEqual(ospath.list_files(dst, recursive=True), [])
+            self.assertEqual(ospath.list_files(moved, recursive=True, relative=True), files)
+
+            # files that only look the same in dst are not removed from src
+            copy = ospath.join(tmpdir, 'copy')
+            ospath.copy_files(moved, copy, recursive=True)
+            with open(ospath.join(copy, 'a.txt'), 'r+') as f:
+                f.write('C')  # same size
+            mtime = os.path.getmtime(ospath.join(moved, 'a.txt'))
+            os.utime(ospath.join(copy, 'a.txt'), (mtime, mtime))
+            stats = ospath.move_files(copy, moved, recursive=True)
+            self.assertEqual((stats['files'], stats['skipped']), (0, 3))
+            self.assertEqual(ospath.list_files(copy, recursive=True, relative=True), ['a.txt'])
+
+            stats = ospath.remove_files(moved, patterns='sub/**/*.txt', workers=2)
+            self.assertEqual(stats['files'], 2)
+            self.assertEqual(ospath.list_files(moved, recursive=True, relative=True), ['a.txt'])
+            with self.assertRaises(AssertionError):
+                ospath.copy_files(src, src + '/')
+
+    def test_du(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sizes = {'a.txt': 10, 'b.png': 20, 'x/c.txt': 30, 'x/y/d.txt': 40,
+                     'x/y/z/e.png': 50, 'w/f.tar.gz': 60}
+            os.makedirs(ospath.join(tmpdir, 'empty'))
+            for name, size in sizes.items():
+                os.makedirs(ospath.join(tmpdir, ospath.dirname(name)), exist_ok=True)
+                with open(ospath.join(tmpdir, name), 'wb') as f:
+                    f.write(b'0' * size)
+
+            usage = ospath.du(tmpdir, depth=2, relative=True)
+            self.assertEqual(list(usage), ['folder', 'files', 'bytes'])
+            self.assertEqual(list(usage['folder']), ['.', 'empty', 'w', 'x', 'x/y'])
+            self.assertEqual(list(usage['files']), [6, 0, 1, 3, 2])
+            self.assertEqual(list(usage['bytes']), [210, 0, 60, 120, 90])
+
+            usage = ospath.du(tmpdir, depth=0)
+            self.assertEqual(list(usage['folder']), [ospath.abspath(tmpdir)])
+            self.assertEqual(list(usage['bytes']), [210])
+
+            usage = ospath.du(tmpdir, depth=1, exts=['txt', 'tar.gz'], by_ext=True, relative=True)
+            rows = list(zip(*[usage[column].tolist() for column in usage]))
+            self.assertEqual(rows, [('.', 'tar.gz', 1, 60), ('.', 'txt', 3, 80),
+                                    ('w', 'tar.gz', 1, 60), ('x', 'txt', 2, 70)])
+
+            usage = ospath.du(tmpdir, depth=1, by_ext=True, relative=True, workers=4)
+            rows = list(zip(*[usage[column].tolist() for column in usage]))
+            self.assertEqual(rows[:3], [('.', 'gz', 1, 60), ('.', 'png', 2, 70), ('.', 'txt', 3, 80)])
+
+    def test_file_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_file = ospath.join(tmpdir, 'tests.idx')
+            index = ospath.build_index('.', index_file)
+            self.assertEqual(len(index), len(ospath.list_files('.', recursive=True)))
+            index = ospath.FileIndex(index_file)
+            queries = [dict(), dict(exts='png'), dict(exts=['.PNG', 'jpg']),
+                       dict(patterns='*image1*'), dict(patterns='folder1/*.png'),
+                       dict(exts='.png', patterns='**/subfolder/*')]
+            for kwargs in queries:
+                for recursive in [False, True]:
+                    for relative in [False, True]:
+                        files = ospath.list_files('.', recursive=recursive,
+                                                  relative=relative, **kwargs)
+                        files_index = index.query(recursive=recursive,
+                                                  relative=relative, **kwargs)
+                        self.assertEqual(files_index, files, kwargs)
+            files = index.query(exts='png', recursive=True, max_results=3)
+            self.assertEqual(len(files), 3)
+            index.close()
+
+            with open(ospath.join(tmpdir, 'other.idx'), 'wb') as f:
+                f.write(b'not an index')
+            with self.assertRaises(ValueError):
+                ospath.FileIndex(ospath.join(tmpdir, 'other.idx'))
+
+    @unittest.skipIf(os.name == 'nt', 'symlinks need admin rights on Windows')
+    def test_file_index_symlinks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root, outside = ospath.join(tmpdir, 'root'), ospath.join(tmpdir, 'outside')
+            os.makedirs(ospath.join(root, 'folder'))
+            os.makedirs(ospath.join(outside, 'deep'))
+            for file in ['root/image.png', 'root/folder/image.png', 'outside/image.png',
+                         'outside/deep/image.png']:
+                open(ospath.join(tmpdir, file), 'w').close()
+            os.symlink(outside, ospath.join(root, 'link'))
+            os.symlink(root, ospath.join(root, 'folder/loop'))  # not indexed
+            index = ospath.build_index(root, ospath.join(tmpdir, 'root.idx'))
+            self.assertEqual(len(index), 4)
+            for patterns in ['*.png', 'link/*.png', '*/deep/*.png', '**/deep/*']:
+                for recursive in [False, True]:
+                    files = ospath.list_files(root, patterns=patterns, recursive=recursive,
+                                              relative=True)
+                    files_index = index.query(patterns=patterns, recursive=recursive,
+                                              relative=True)
+                    self.assertEqual(files_index, files, (patterns, recursive))
+            index.close()
+
+    def test_aio(self):
+        import asyncio
+        async def check():
+            for kwargs in [dict(), dict(exts='png'), dict(patterns='*image1*', relative=True),
+                           dict(exts=['png', 'jpg'], sort=None, workers=2)]:
+                for recursive in [False, True]:
+                    files = ospath.list_files('.', recursive=recursive, **kwargs)
+                    files_aio = await ospath.aio.list_files('.', recursive=recursive, **kwargs)
+                    if kwargs.get('sort', 'natural') is None:
+                        files, files_aio = sorted(files), sorted(files_aio)
+                    self.assertEqual(files_aio, files)
+            files = [file async for file in ospath.aio.iter_files('.', recursive=True,
+                                                                  max_results=3)]
+            self.assertEqual(files, ospath.list_files('.', recursive=True)[:3])
+            self.assertTrue(await ospath.aio.exists('ospath_ut.py'))
+            self.assertFalse(await ospath.aio.exists('does_not_exist.py'))
+            self.assertEqual(await ospath.aio.getsize('ospath_ut.py'),
+                             os.path.getsize('ospath_ut.py'))
+
+            # the same statistics as the synchronous version
+            ospath.list_files('.', exts='png', recursive=True, profile=True)
+            stats = ospath.stats()
+            collected = []
+            await ospath.aio.list_files('.', exts='png', recursive=True,
+                                        profile=collected.append)
+            self.assertEqual(collected, [ospath.stats()])
+            for key in ['dirs', 'entries', 'matches', 'stats']:
+                self.assertEqual(collected[0][key], stats[key], key)
+            self.assertGreater(collected[0]['time_walk'], 0)
+        asyncio.run(check())
+
+    def test_profile(self):
+        files = ospath.list_files('.', exts='png', recursive=True, profile=True)
+        stats = ospath.stats()
+        folders = ospath.list_folders('.', recursive=True)
+        self.assertEqual(stats['path'], '.')
+        self.assertEqual(stats['dirs'], len(folders) + 1)
+        self.assertEqual(stats['matches'], len(files))
+        self.assertEqual(stats['stats'], 0)
+        for phase in ['walk', 'match', 'normalise', 'sort']:
+            self.assertGreater(stats['time_' + phase], 0)
+        self.assertGreaterEqual(stats['time_total'], stats['time_walk'] + stats['time_match'])
+
+        collected = []
+        infos = ospath.scan_files('.', exts='png', recursive=True, profile=collected.append)
+        self.assertEqual(len(collected), 1)
+        self.assertEqual(collected[0]['stats'], len(infos))
+        self.assertEqual(collected[0], ospath.stats())
+
+        # a global callback, for all listings
+        ospath.set_profile_callback(collected.append, profile_all=True)
+        try:
+            ospath.list_files('.', recursive=True, max_results=2)
+            self.assertEqual(len(collected), 2)
+            self.assertEqual(collected[1]['matches'], 2)
+        finally:
+            ospath.set_profile_callback(None)
+        ospath.list_files('.', recursive=True)
+        self.assertEqual(len(collected), 2)
+
+    def test_lazy_imports(self):
+        # importing ospath should not import tkinter or natsort
+        code = 'import sys, ospath; print(" ".join(sorted(sys.modules)))'
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(ospath.__file__)))
+        modules = subprocess.check_output([sys.executable, '-c', code], cwd=package_dir)
+        modules = modules.decode().split()
+        for module in ['tkinter', 'natsort', 'pathlib', 'concurrent.futures']:
+            self.assertNotIn(module, modules)
+        self.assertTrue(callable(ospath.natsort_key))
+        self.assertTrue(callable(ospath.askopenfilename))
+
     def test_list_folders(self):
         path = ospath.abspath('.')
         os.makedirs(path + '/subfolder/sub1', exist_ok=True)
@@ -131,6 +588,19 @@ class OsPathTest(unittest.TestCase):
         self.assertEqual(len(folders), 8)
         for f in folders[1:]:
             self.assertIn('sub', ospath.split(f)[-1])
+
+        folders_threaded = ospath.list_folders(path, recursive=True, add_parent=True,
+                                               pattern='sub*', workers=4)
+        self.assertEqual(folders, folders_threaded)
+
+    def test_workers(self):
+        path = '.'
+        for recursive in [False, True]:
+            files = ospath.list_files(path, recursive=recursive)
+            files_threaded = ospath.list_files(path, recursive=recursive, workers=4)
+            self.assertEqual(files, files_threaded)
+            files_iter = ospath.iter_files(path, recursive=recursive, workers=4)
+            self.assertEqual(files, list(files_iter))
                 
         
 
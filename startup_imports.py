@@ -21,7 +21,7 @@ import matplotlib as mlp
 import seaborn as sns
 import contextprofiler
 import stimer
-from stimer import ContextProfiler""".split('\n')
+from stimer import Profiler""".split('\n')
 
 
 for __import_statement in __imports_startup:
@@ -64,18 +64,22 @@ self = _DummyTestClass()
 cls = self
 
 #######
-# pass-through wrapper for line-profiler / kernprof
+# @profile without kernprof: the line profiler of stimer, the listing is
+# printed at exit or with stimer.line_report()
 
-try: # pass t
+try: # kernprof provides its own profile
     builtins.profile
 except AttributeError:
-    # No line profiler, provide a pass-through version
-    def profile(func):
-        import traceback
-        print(f'WARNING: @profile debugger active for {func}()')
-        print(traceback.format_stack(limit=2)[0])
-        return func
-    builtins.profile = profile
+    try:
+        builtins.profile = stimer.profile
+    except NameError:
+        # stimer could not be imported, provide a pass-through version
+        def profile(func):
+            import traceback
+            print(f'WARNING: @profile debugger active for {func}()')
+            print(traceback.format_stack(limit=2)[0])
+            return func
+        builtins.profile = profile
 
 
 #%% plt maximize figure // DISABLED ###################
@@ -1,6 +1,27 @@
 import sys
 import types
-from .stimer import start, stop, sleep, lapse, timeit, wrapper
+from .stimer import start, stop, sleep, lapse, lapse_report, timeit, wrapper
+from .memory import memory_stats
+from .events import events, export
+from .lineprofiler import LineProfiler, line_profile, line_report, profile
+from .profiler import Profiler
+from .benchmark import bench, BenchResult
+from .sampler import sample, Sampler
+
+class _Context():
+    """timer for one `with stimer('name'):` block"""
+    __slots__ = ('identifier',)
+
+    def __init__(self, identifier):
+        self.identifier = identifier
+
+    def __enter__(self):
+        start(self.identifier)
+        return None
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        stop(self.identifier)
+
 
 class CallableModule(types.ModuleType):
 
@@ -19,8 +40,8 @@ class CallableModule(types.ModuleType):
         stop(self.identifier)
 
     def __call__(self, identifier='context'):
-        self.identifier = identifier
-        return self
+        # a new object for each block, so that threads don't share it
+        return _Context(identifier)
 
 
 sys.modules[__name__] = CallableModule()
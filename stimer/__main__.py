@@ -0,0 +1,175 @@
+"""
+Benchmark runner that stores results per git commit and machine and gates
+on regressions:
+
+    python -m stimer bench [path] [-k filter] [--budget 1]
+                           [--baseline main] [--threshold 5]
+
+Runs all `bench_*` functions of the `bench_*.py` files in path (default:
+./benchmarks) with stimer.bench and writes the results to
+<path>/.stimer/<commit>_<machine>.json. Results of a tree with uncommitted
+changes don't belong to the commit, they are written to
+<commit>_<machine>-dirty.json, which each dirty run replaces and which is
+never used as baseline. With --baseline, each benchmark is
+compared to the stored result of that commit (or JSON file) on the same
+machine with a Mann-Whitney U test. The exit code is 1 if a benchmark got
+significantly slower by more than --threshold percent, or failed.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import subprocess
+import importlib.util
+from .benchmark import bench, BenchResult
+from .stimer import _print_time
+
+
+def _git(folder, *args):
+    """output of a git command in folder, None if it fails"""
+    try:
+        output = subprocess.run(['git', *args], cwd=folder, capture_output=True,
+                                text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return output.stdout.strip() if output.returncode == 0 else None
+
+
+def _machine():
+    """description of the machine and a short hash of it"""
+    machine = {'node': platform.node(), 'system': platform.system(),
+               'machine': platform.machine(), 'processor': platform.processor(),
+               'cpus': os.cpu_count(), 'python': platform.python_version()}
+    fingerprint = hashlib.sha1(json.dumps(machine, sort_keys=True).encode()).hexdigest()[:10]
+    return machine, fingerprint
+
+
+def _discover(path, pattern=None):
+    """(name, function) of all bench_* functions in the bench_*.py files of path"""
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(path, file) for file in os.listdir(path)
+                       if file.startswith('bench_') and file.endswith('.py'))
+    benchmarks = []
+    for file in files:
+        module_name = os.path.splitext(os.path.basename(file))[0]
+        sys.path.insert(0, os.path.dirname(os.path.abspath(file)))
+        spec = importlib.util.spec_from_file_location(module_name, file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        for name, func in vars(module).items():
+            if name.startswith('bench_') and callable(func) and \
+               getattr(func, '__module__', None) == module_name:
+                name = f'{module_name}.{name}'
+                if pattern is None or pattern in name:
+                    benchmarks.append((name, func))
+    return benchmarks
+
+
+def _load_baseline(baseline, folder, results, fingerprint):
+    """results of a JSON file, or of a commit on this machine"""
+    if os.path.isfile(baseline):
+        with open(baseline, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    commit = _git(folder, 'rev-parse', baseline) or baseline
+    file = os.path.join(results, f'{commit[:12]}_{fingerprint}.json')
+    if not os.path.isfile(file):
+        return None
+    with open(file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_benchmarks(path='benchmarks', pattern=None, budget=1.0, warmup=0.1,
+                   baseline=None, threshold=5, alpha=0.05, results=None, save=True):
+    """
+    run, store and compare the benchmarks, see the module docstring
+
+    :returns: the exit code, 1 for regressions or failed benchmarks
+    """
+    folder = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+    results = results or os.path.join(folder, '.stimer')
+    commit = _git(folder, 'rev-parse', 'HEAD') or 'unknown'
+    dirty = bool(_git(folder, 'status', '--porcelain', '--untracked-files=no'))
+    machine, fingerprint = _machine()
+
+    base = None
+    if baseline is not None:
+        base = _load_baseline(baseline, folder, results, fingerprint)
+        if base is None:
+            print(f'[stimer] no results of {baseline} for this machine ({fingerprint}) in {results}')
+            return 1
+        base = base['results']
+
+    benchmarks = _discover(path, pattern)
+    print(f'{len(benchmarks)} benchmarks, commit {commit[:12]}{"-dirty" if dirty else ""}, '
+          f'machine {fingerprint}')
+    stored, exit_code = {}, 0
+    for name, func in benchmarks:
+        try:
+            result = bench(func, budget=budget, warmup=warmup, name=name, verbose=False)
+        except Exception as e:
+            print(f'{name:<45} failed: {type(e).__name__}: {e}')
+            exit_code = 1
+            continue
+        stored[name] = result.to_dict()
+        q25, q75 = result.iqr
+        line = f'{name:<45} {_print_time(result.median):>14}  IQR {_print_time(q75 - q25):>14}'
+        if base is not None and name in base:
+            comparison = result.compare(base[name], threshold=threshold / 100, alpha=alpha)
+            line += f"  {comparison['change']:+7.1%}  p={comparison['p']:.3f}  {comparison['verdict']}"
+            if comparison['verdict'] == 'slower':
+                exit_code = 1
+        elif base is not None:
+            line += '  (new)'
+        print(line)
+
+    if save and stored:
+        os.makedirs(results, exist_ok=True)
+        file = os.path.join(results, f'{commit[:12]}_{fingerprint}{"-dirty" if dirty else ""}.json')
+        content = {'commit': commit, 'dirty': dirty, 'machine': machine,
+                   'fingerprint': fingerprint, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'budget': budget, 'results': stored}
+        # benchmarks of this commit that didn't run this time are kept,
+        # but not those of an earlier dirty run, that tree may have differed
+        if not dirty and os.path.isfile(file):
+            with open(file, 'r', encoding='utf-8') as f:
+                content['results'] = {**json.load(f).get('results', {}), **stored}
+        with open(file, 'w', encoding='utf-8') as f:
+            json.dump(content, f)
+        print(f'results written to {file}')
+    return exit_code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m stimer')
+    commands = parser.add_subparsers(dest='command', required=True)
+    parser_bench = commands.add_parser('bench', help='run, store and compare benchmarks')
+    parser_bench.add_argument('path', nargs='?', default='benchmarks',
+                              help='folder with bench_*.py files, or one file')
+    parser_bench.add_argument('-k', dest='pattern', default=None,
+                              help='only run benchmarks whose name contains this')
+    parser_bench.add_argument('--budget', type=float, default=1.0,
+                              help='seconds of timing per benchmark')
+    parser_bench.add_argument('--warmup', type=float, default=0.1,
+                              help='seconds of warmup per benchmark')
+    parser_bench.add_argument('--baseline', default=None,
+                              help='git commit/branch of stored results, or a JSON file')
+    parser_bench.add_argument('--threshold', type=float, default=5,
+                              help='percent a benchmark may get slower')
+    parser_bench.add_argument('--alpha', type=float, default=0.05,
+                              help='significance level of the Mann-Whitney U test')
+    parser_bench.add_argument('--results', default=None,
+                              help='folder of the stored results, default <path>/.stimer')
+    parser_bench.add_argument('--no-save', dest='save', action='store_false',
+                              help="don't store the results")
+    args = vars(parser.parse_args(argv))
+    args.pop('command')
+    return run_benchmarks(**args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+import gc
+import math
+import time as t
+import numpy as np
+from .stimer import _print_time
+
+_perf_counter = t.perf_counter
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def _batch(func, args, kwargs, loops):
+    """seconds that `loops` calls of func take together"""
+    iterations = range(loops)
+    start = _perf_counter()
+    for _ in iterations:
+        func(*args, **kwargs)
+    return _perf_counter() - start
+
+
+def mann_whitney(a, b):
+    """
+    two-sided Mann-Whitney U test, whether the values of a tend to be
+    larger or smaller than those of b. Uses the normal approximation with
+    tie correction, which is good for more than about 8 values each.
+
+    :returns: (U of a, p-value)
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    n_a, n_b = len(a), len(b)
+    values = np.concatenate([a, b])
+    # ranks starting at 1, tied values get the mean of their ranks
+    order = np.argsort(values, kind='mergesort')
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    rank_sums = np.bincount(inverse, weights=ranks)
+    ranks = (rank_sums / counts)[inverse]
+    u = float(ranks[:n_a].sum() - n_a * (n_a + 1) / 2)
+    n = n_a + n_b
+    ties = float(np.sum(counts ** 3 - counts))
+    variance = n_a * n_b / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    # continuity correction of 0.5 towards the mean
+    z = (abs(u - n_a * n_b / 2) - 0.5) / math.sqrt(variance)
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+class BenchResult():
+    """
+    Timings of one benchmark, as returned by stimer.bench.
+    The statistics use the time per call, with the overhead of the timer
+    and the loop subtracted. Results can be stored with to_dict() and
+    compared with results of other runs with compare().
+    """
+    __slots__ = ('name', 'times', 'loops', 'overhead')
+
+    def __init__(self, name, times, loops=1, overhead=0.0):
+        self.name = name
+        self.times = np.asarray(times, dtype=float)  # seconds per call
+        self.loops = loops          # calls per timed batch
+        self.overhead = overhead    # seconds per call that were subtracted
+
+    @property
+    def median(self):
+        return float(np.median(self.times))
+
+    @property
+    def mean(self):
+        return float(np.mean(self.times))
+
+    @property
+    def std(self):
+        return float(np.std(self.times))
+
+    @property
+    def min(self):
+        return float(np.min(self.times))
+
+    @property
+    def iqr(self):
+        """25th and 75th percentile"""
+        q25, q75 = np.percentile(self.times, [25, 75])
+        return float(q25), float(q75)
+
+    @property
+    def outliers(self):
+        """number of batches more than 1.5 IQR outside of the quartiles"""
+        q25, q75 = self.iqr
+        spread = 1.5 * (q75 - q25)
+        return int(np.sum((self.times < q25 - spread) | (self.times > q75 + spread)))
+
+    def ci(self, confidence=0.95, resamples=1000):
+        """bootstrap confidence interval of the median"""
+        rng = np.random.default_rng(0)  # the same interval for the same times
+        indices = rng.integers(0, len(self.times), (resamples, len(self.times)))
+        medians = np.median(self.times[indices], axis=1)
+        alpha = (1 - confidence) / 2 * 100
+        low, high = np.percentile(medians, [alpha, 100 - alpha])
+        return float(low), float(high)
+
+    def compare(self, baseline, threshold=0.05, alpha=0.05):
+        """
+        compare to the result of an earlier run
+
+        :param baseline: BenchResult or its to_dict()
+        :param threshold: relative change of the median below which both
+                          are considered the same, e.g. 0.05 for 5%
+        :param alpha: significance level of the Mann-Whitney U test of the
+                      times of both runs
+        :returns: dict with ratio (median / median of baseline), change
+                  (ratio - 1), p (of the test), significant (p < alpha and
+                  the change exceeds threshold) and verdict, one of
+                  'slower', 'faster' or 'same'
+        """
+        if isinstance(baseline, dict):
+            baseline = BenchResult.from_dict(baseline)
+        ratio = self.median / baseline.median if baseline.median > 0 else float('inf')
+        _, p = mann_whitney(self.times, baseline.times)
+        significant = p < alpha and abs(ratio - 1) > threshold
+        verdict = 'same' if not significant else 'slower' if ratio > 1 else 'faster'
+        return {'ratio': ratio, 'change': ratio - 1, 'p': p, 'significant': significant,
+                'verdict': verdict}
+
+    def to_dict(self):
+        """JSON serialisable representation, see from_dict"""
+        return {'name': self.name, 'times': self.times.tolist(),
+                'loops': self.loops, 'overhead': self.overhead}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['name'], d['times'], d.get('loops', 1), d.get('overhead', 0.0))
+
+    def __str__(self):
+        q25, q75 = self.iqr
+        low, high = self.ci()
+        outliers = f', {self.outliers} outliers' if self.outliers else ''
+        return (f'{self.name}: median {_print_time(self.median)} '
+                f'(IQR {_print_time(q25)} - {_print_time(q75)}, '
+                f'95% CI {_print_time(low)} - {_print_time(high)}), '
+                f'{len(self.times)} x {self.loops} loops{outliers}')
+
+    def __repr__(self):
+        return f'<BenchResult {self}>'
+
+
+def bench(func, *args, budget=1.0, warmup=0.1, min_samples=5, disable_gc=True,
+          name=None, verbose=True, **kwargs):
+    """
+    benchmark func(*args, **kwargs) with statistics that can be compared
+    between runs, instead of the mean of a fixed number of calls.
+
+    The function is first called for `warmup` seconds. Then the number of
+    loops per batch is chosen such that about 100 batches fit into the
+    budget, and batches are timed until the budget is spent. The time that
+    the loop and the timer take is measured with an empty function and
+    subtracted.
+
+    Example:
+        result = stimer.bench(sorted, data)
+        # sorted: median 12.1 μs (IQR 12.0 μs - 12.3 μs, 95% CI ...), 100 x 826 loops
+        result.compare(old_result)['verdict']  # 'slower', 'faster' or 'same'
+
+    :param func: function to benchmark, args and kwargs are passed to it
+    :param budget: seconds to spend on the timed batches
+    :param warmup: seconds to call the function before timing, at least once
+    :param min_samples: time at least this many batches, even if that
+                        exceeds the budget
+    :param disable_gc: switch off the garbage collector while timing
+    :param name: name of the result, default is the name of func
+    :param verbose: print the result
+    :returns: BenchResult
+    """
+    name = name or getattr(func, '__qualname__', repr(func))
+    gc_enabled = gc.isenabled()
+    if disable_gc:
+        gc.disable()
+    try:
+        # warm up caches, lazy imports and the specialising interpreter,
+        # the warmup also estimates the time of one call
+        calls = 0
+        start = _perf_counter()
+        while True:
+            func(*args, **kwargs)
+            calls += 1
+            elapsed = _perf_counter() - start
+            if elapsed >= warmup:
+                break
+        per_call = elapsed / calls
+        loops = max(1, math.ceil(max(budget / 100, 1e-4) / max(per_call, 1e-9)))
+
+        # the overhead per call: the loop, the call of an empty function
+        # with the same arguments, and the two reads of the timer
+        n_calibrate = min(loops, 1000)
+        overhead = min(_batch(_noop, args, kwargs, n_calibrate) for _ in range(5)) / n_calibrate
+
+        times = []
+        start = _perf_counter()
+        while len(times) < min_samples or _perf_counter() - start < budget:
+            times.append(_batch(func, args, kwargs, loops) / loops - overhead)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    result = BenchResult(name, np.maximum(times, 0), loops, overhead)
+    if verbose:
+        print(result)
+    return result
@@ -0,0 +1,177 @@
+import os
+import json
+import time as t
+import itertools
+import threading
+import numpy as np
+from threading import get_ident
+
+_CAPACITY = 2 ** 20  # events that are kept, the oldest are overwritten
+
+
+class _EventLog():
+    """
+    Ring buffer of timed sections as (identifier, thread, start, duration)
+    in preallocated arrays. Recording an event writes four numbers,
+    identifiers and threads are stored once in a table. The arrays are
+    allocated at the first event.
+    """
+    def __init__(self, capacity=_CAPACITY):
+        self.capacity = capacity
+        self._arrays = None
+        self._views = None
+        # perf_counter has no fixed origin, the offset turns it into unix time
+        self._epoch = t.time_ns() - t.perf_counter_ns()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """remove all events"""
+        self._counter = itertools.count()  # next() is atomic, no lock needed
+        self._names = {}    # identifier -> index in the table
+        self._threads = {}  # thread id -> index in the table
+        self._thread_names = []
+
+    def _allocate(self):
+        with self._lock:
+            if self._views is None:
+                # perf_counter seconds are kept as float, they are only
+                # converted to nanoseconds when the log is read
+                arrays = {'name': np.zeros(self.capacity, np.int32),
+                          'thread': np.zeros(self.capacity, np.int32),
+                          'start': np.zeros(self.capacity, np.float64),
+                          'duration': np.zeros(self.capacity, np.float64)}
+                self._arrays = arrays
+                # writing single items to a memoryview is much faster than
+                # to the numpy array
+                self._views = [memoryview(arrays[key]) for key in arrays]
+        return self._views
+
+    def _name_index(self, identifier):
+        with self._lock:
+            return self._names.setdefault(identifier, len(self._names))
+
+    def _thread_index(self, thread):
+        with self._lock:
+            if thread not in self._threads:
+                self._threads[thread] = len(self._threads)
+                self._thread_names.append(threading.current_thread().name)
+            return self._threads[thread]
+
+    def record(self, identifier, start, duration):
+        """add an event, start and duration in seconds of perf_counter"""
+        i = next(self._counter) % self.capacity
+        views = self._views
+        if views is None:
+            views = self._allocate()
+        name = self._names.get(identifier)
+        if name is None:
+            name = self._name_index(identifier)
+        thread = self._threads.get(get_ident())
+        if thread is None:
+            thread = self._thread_index(get_ident())
+        names, threads, starts, durations = views
+        names[i] = name
+        threads[i] = thread
+        starts[i] = start
+        durations[i] = duration
+
+    def events(self):
+        """
+        copy of the events in the order they were recorded
+
+        :returns: dict of numpy arrays with name (str), thread (name of the
+                  thread), thread_id, start_ns (unix time) and duration_ns,
+                  and the number of dropped events that were overwritten
+        """
+        # the counter can only be read by taking a number, that slot is
+        # marked as empty and skipped
+        last = next(self._counter)
+        views = self._views if self._views is not None else self._allocate()
+        views[3][last % self.capacity] = -1
+        n_events = last + 1
+        if last == 0:
+            empty = np.zeros(0, np.int64)
+            return {'name': np.zeros(0, str), 'thread': np.zeros(0, str),
+                    'thread_id': empty, 'start_ns': empty, 'duration_ns': empty,
+                    'dropped': 0}
+        order = np.arange(max(0, n_events - self.capacity), n_events) % self.capacity
+        arrays = {key: array[order] for key, array in self._arrays.items()}
+        valid = arrays['duration'] >= 0
+        arrays = {key: array[valid] for key, array in arrays.items()}
+        names = np.array([str(name) for name in list(self._names)])
+        thread_ids = np.array(list(self._threads), dtype=np.int64)
+        thread_names = np.array(self._thread_names[:len(thread_ids)])
+        return {'name': names[arrays['name']],
+                'thread': thread_names[arrays['thread']],
+                'thread_id': thread_ids[arrays['thread']],
+                'start_ns': np.round(arrays['start'] * 1e9).astype(np.int64) + self._epoch,
+                'duration_ns': np.round(arrays['duration'] * 1e9).astype(np.int64),
+                'dropped': max(0, n_events - self.capacity)}
+
+
+_log = _EventLog()
+
+
+def events(clear=False):
+    """
+    all sections that were timed by stimer.stop (and by Profilers with
+    log_events=True), see export()
+
+    :param clear: remove the events from the log
+    :returns: dict of numpy arrays with name, thread, thread_id, start_ns
+              (unix time in nanoseconds) and duration_ns of each section,
+              and dropped: the number of old events that were overwritten
+    """
+    log = _log.events()
+    if clear:
+        _log.clear()
+    return log
+
+
+def export(path, format='json', clear=False):
+    """
+    write the logged sections to a file, to track timings over time
+
+    :param path: file to write
+    :param format: 'json': {"events": [{"name", "thread", "start_ns",
+                   "duration_ns"}, ...], "dropped": n}
+                   'csv': one line per section with the same columns
+                   'chrome': Trace Event Format, loads into
+                   https://ui.perfetto.dev and chrome://tracing
+    :param clear: remove the events from the log
+    :returns: the number of exported events
+    """
+    return _write_events(events(clear=clear), path, format)
+
+
+def _write_events(log, path, format):
+    """write the events of _EventLog.events() to path, see export()"""
+    columns = ['name', 'thread', 'start_ns', 'duration_ns']
+    if format == 'json':
+        rows = zip(*[log[c].tolist() for c in columns])
+        content = {'events': [dict(zip(columns, row)) for row in rows],
+                   'dropped': log['dropped']}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(content, f)
+    elif format == 'csv':
+        import csv
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(zip(*[log[c].tolist() for c in columns]))
+    elif format == 'chrome':
+        pid = os.getpid()
+        start_us = (log['start_ns'] - (log['start_ns'].min() if len(log['start_ns']) else 0)) / 1000
+        rows = zip(log['name'].tolist(), log['thread_id'].tolist(),
+                   start_us.tolist(), (log['duration_ns'] / 1000).tolist())
+        trace = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': ts, 'dur': dur}
+                 for name, tid, ts, dur in rows]
+        threads = dict(zip(log['thread_id'].tolist(), log['thread'].tolist()))
+        trace += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}} for tid, name in threads.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ns'}, f)
+    else:
+        raise ValueError(f"format must be 'json', 'csv' or 'chrome', not {format!r}")
+    return len(log['name'])
@@ -0,0 +1,352 @@
+import sys
+import atexit
+import weakref
+import inspect
+import linecache
+import threading
+import time as t
+
+_perf_counter = t.perf_counter
+
+# sys.monitoring, Python 3.12+: only a few tool ids exist, so all
+# LineProfilers share one. The events of a code object are passed on to
+# the profilers that decorated it. The id is freed again when the last
+# profiler is disabled or garbage collected.
+_tool = None     # the tool id, while any function is monitored
+_monitored = {}  # code -> (weakref to LineProfiler, ...)
+_released = []   # (weakref, codes) of the profilers that were disabled
+_monitor_lock = threading.Lock()
+
+
+def _claim_tool():
+    """take the first free tool id, the profiler id might be in use by
+    cProfile or a debugger"""
+    monitoring = sys.monitoring
+    events = monitoring.events
+    for tool in [monitoring.PROFILER_ID, 3, 4, 5]:
+        if monitoring.get_tool(tool) is None:
+            break
+    else:
+        raise RuntimeError('no free sys.monitoring tool id for stimer.profile')
+    monitoring.use_tool_id(tool, 'stimer.profile')
+    monitoring.register_callback(tool, events.PY_START, _on_start)
+    monitoring.register_callback(tool, events.PY_RESUME, _on_start)
+    monitoring.register_callback(tool, events.LINE, _on_line)
+    monitoring.register_callback(tool, events.PY_RETURN, _on_return)
+    monitoring.register_callback(tool, events.PY_YIELD, _on_return)
+    monitoring.register_callback(tool, events.PY_UNWIND, _on_unwind)
+    # PY_UNWIND can't be set per code object, so exceptions in all
+    # functions call _on_unwind while any function is monitored
+    monitoring.set_events(tool, events.PY_UNWIND)
+    return tool
+
+
+def _free_tool():
+    """remove the events and callbacks and free the tool id"""
+    global _tool
+    monitoring = sys.monitoring
+    monitoring.set_events(_tool, 0)
+    for event in ['PY_START', 'PY_RESUME', 'LINE', 'PY_RETURN', 'PY_YIELD', 'PY_UNWIND']:
+        monitoring.register_callback(_tool, getattr(monitoring.events, event), None)
+    monitoring.free_tool_id(_tool)
+    _tool = None
+
+
+def _release_pending():
+    """stop monitoring the code of the released profilers, with _monitor_lock"""
+    while _released:
+        ref, codes = _released.pop()
+        for code in codes:
+            # the tuples are replaced, not changed, the callbacks read them
+            refs = tuple(other for other in _monitored.get(code, ()) if other is not ref)
+            if refs:
+                _monitored[code] = refs
+            elif code in _monitored:
+                del _monitored[code]
+                sys.monitoring.set_local_events(_tool, code, 0)
+    if not _monitored and _tool is not None:
+        _free_tool()
+
+
+def _release(ref, codes, blocking=False):
+    """stop monitoring the code of a profiler that is disabled or collected"""
+    _released.append((ref, codes))
+    # the garbage collector can call this while the lock is held, then
+    # the holder of the lock releases the codes
+    if _monitor_lock.acquire(blocking=blocking):
+        try:
+            _release_pending()
+        finally:
+            _monitor_lock.release()
+
+
+def _on_start(code, offset):
+    for ref in _monitored.get(code, ()):
+        profiler = ref()
+        if profiler is not None:
+            profiler._on_start(code, offset)
+
+
+def _on_line(code, line):
+    for ref in _monitored.get(code, ()):
+        profiler = ref()
+        if profiler is not None:
+            profiler._on_line(code, line)
+
+
+def _on_return(code, offset, retval):
+    for ref in _monitored.get(code, ()):
+        profiler = ref()
+        if profiler is not None:
+            profiler._on_return(code, offset, retval)
+
+
+def _on_unwind(code, offset, exception):
+    for ref in _monitored.get(code, ()):
+        profiler = ref()
+        if profiler is not None:
+            profiler._on_return(code, offset, None)
+
+
+class LineProfiler():
+    """
+    Line profiler for single functions: counts the hits and the time of
+    each line of the decorated functions, like kernprof/line_profiler.
+    Other functions run at full speed. The time of a line includes the
+    functions that it calls.
+
+    Uses sys.monitoring on Python 3.12+, where only the decorated
+    functions report line events, and sys.settrace before that, where
+    the trace function is only installed while a decorated function runs.
+    All profilers share one sys.monitoring tool id, which is freed when
+    the last of them is disabled or garbage collected.
+
+    Example:
+        @stimer.profile   # or stimer.line_profile(func)
+        def process(data):
+            ...
+        process(data)
+        stimer.line_report()
+
+    :param report_at_exit: print the listing when python exits, if any
+                           decorated function was called
+    """
+    def __init__(self, report_at_exit=False):
+        self.functions = []  # decorated functions, in order of decoration
+        self.lines = {}      # code -> {line: [hits, seconds]}
+        self._codes = set()
+        self._local = threading.local()  # running frames of each thread
+        self._ref = weakref.ref(self)
+        self._finalizer = None  # releases the monitored code when collected
+        self._lock = threading.Lock()
+        if report_at_exit:
+            atexit.register(self._report_at_exit)
+
+    def __call__(self, func):
+        """decorate func to profile its lines"""
+        code = func.__code__
+        with self._lock:
+            if code not in self.lines:
+                self.functions.append(func)
+                self.lines[code] = {}
+            self._codes.add(code)
+        if hasattr(sys, 'monitoring'):
+            self._monitor(code)
+            return func  # the events come from the code object itself
+
+        trace = self._trace
+        def traced(call, *args, **kwargs):
+            previous = sys.gettrace()
+            if previous is not trace:
+                sys.settrace(trace)
+            try:
+                return call(*args, **kwargs)
+            finally:
+                if previous is not trace:
+                    sys.settrace(previous)
+
+        if inspect.isgeneratorfunction(func):
+            # the body runs when the generator is resumed, not when it is
+            # created, so the trace is installed around each step
+            def wrapped(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                try:
+                    value = yield traced(next, generator)
+                    while True:
+                        value = yield traced(generator.send, value)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    generator.close()
+        else:
+            def wrapped(*args, **kwargs):
+                return traced(func, *args, **kwargs)
+        wrapped.__name__ = func.__name__
+        wrapped.__qualname__ = func.__qualname__
+        wrapped.__doc__ = func.__doc__
+        wrapped.__wrapped__ = func
+        return wrapped
+
+    def reset(self):
+        """remove all timings, the functions stay decorated"""
+        for code in self.lines:
+            self.lines[code] = {}
+
+    def disable(self):
+        """
+        stop recording the decorated functions until they are decorated
+        again, the timings are kept. On Python 3.12+ they run at full
+        speed again.
+        """
+        with self._lock:
+            codes, self._codes = self._codes, set()
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+            _release(self._ref, codes, blocking=True)
+
+    # sys.monitoring, Python 3.12+
+
+    def _monitor(self, code):
+        global _tool
+        events = sys.monitoring.events
+        with _monitor_lock:
+            if _tool is None:
+                _tool = _claim_tool()
+            refs = _monitored.get(code, ())
+            if self._ref not in refs:
+                _monitored[code] = refs + (self._ref,)
+            sys.monitoring.set_local_events(_tool, code, events.PY_START | events.PY_RESUME |
+                                            events.LINE | events.PY_RETURN | events.PY_YIELD)
+            _release_pending()
+        if self._finalizer is None:
+            self._finalizer = weakref.finalize(self, _release, self._ref, self._codes)
+
+    def _stack(self):
+        """[code, line, time] of the running decorated frames of this thread"""
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def _on_start(self, code, offset):
+        self._stack().append([code, None, _perf_counter()])
+
+    def _on_line(self, code, line):
+        now = _perf_counter()
+        # the stack is only created by _on_start, no call to _stack()
+        stack = getattr(self._local, 'stack', None)
+        if not stack or stack[-1][0] is not code:
+            return
+        frame = stack[-1]
+        lines = self.lines[code]
+        if frame[1] is not None:
+            lines[frame[1]][1] += now - frame[2]
+        entry = lines.get(line)
+        if entry is None:
+            entry = lines[line] = [0, 0.0]
+        entry[0] += 1
+        frame[1] = line
+        frame[2] = _perf_counter()
+
+    def _on_return(self, code, offset, retval):
+        now = _perf_counter()
+        stack = getattr(self._local, 'stack', None)
+        if stack and stack[-1][0] is code:
+            _, line, start = stack.pop()
+            if line is not None:
+                self.lines[code][line][1] += now - start
+
+    # sys.settrace, before Python 3.12
+
+    def _trace(self, frame, event, arg):
+        # a generator that is resumed is a new call
+        if event == 'call' and frame.f_code in self._codes:
+            self._stack().append([frame.f_code, None, _perf_counter()])
+            return self._trace_lines
+        return None
+
+    def _trace_lines(self, frame, event, arg):
+        if event == 'line':
+            self._on_line(frame.f_code, frame.f_lineno)
+        elif event == 'return':  # also when a generator yields
+            self._on_return(frame.f_code, None, arg)
+        return self._trace_lines
+
+    # report
+
+    def report(self, file=None):
+        """
+        print a listing of each function with hits, time, time per hit and
+        percentage of each line, as kernprof -lv does
+
+        :param file: write the listing to this file instead of printing it
+        :returns: the listing as str
+        """
+        blocks = ['Timer unit: 1e-06 s']
+        for func in self.functions:
+            code = func.__code__
+            lines = self.lines[code]
+            total = sum(seconds for hits, seconds in lines.values())
+            filename = code.co_filename
+            try:
+                source, first = inspect.getsourcelines(func)
+            except (OSError, TypeError):
+                # no source, e.g. in a console: list the lines that ran
+                first = code.co_firstlineno
+                source = [linecache.getline(filename, lineno) for lineno in
+                          range(first, max(list(lines) + [first]) + 1)]
+            block = [f'\nTotal time: {total:g} s', f'File: {filename}',
+                     f'Function: {code.co_name} at line {first}', '',
+                     f"{'Line #':>6} {'Hits':>9} {'Time':>12} {'Per Hit':>8} {'% Time':>8}  Line Contents",
+                     '=' * 62]
+            for lineno, text in enumerate(source, first):
+                text = text.rstrip('\n')
+                if lineno in lines:
+                    hits, seconds = lines[lineno]
+                    percent = 100 * seconds / total if total else 0.0
+                    block.append(f'{lineno:>6} {hits:>9} {seconds * 1e6:>12.1f} '
+                                 f'{seconds * 1e6 / hits:>8.1f} {percent:>8.1f}  {text}')
+                else:
+                    block.append(f'{lineno:>6} {"":>9} {"":>12} {"":>8} {"":>8}  {text}')
+            blocks.append('\n'.join(block))
+        report = '\n'.join(blocks)
+        if file is None:
+            print(report)
+        else:
+            with open(file, 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+        return report
+
+    def _report_at_exit(self):
+        if any(self.lines.values()):
+            self.report()
+
+
+_line_profiler = LineProfiler(report_at_exit=True)
+
+
+def line_profile(func):
+    """
+    decorator that records the hits and time of each line of func, the
+    listing is printed with stimer.line_report() and when python exits
+    """
+    return _line_profiler(func)
+
+
+def line_report(file=None, reset=False):
+    """
+    print the line listing of all functions decorated with stimer.profile
+
+    :param file: write the listing to this file instead of printing it
+    :param reset: remove the timings after the report
+    :returns: the listing as str
+    """
+    report = _line_profiler.report(file=file)
+    if reset:
+        _line_profiler.reset()
+    return report
+
+
+profile = line_profile
@@ -0,0 +1,211 @@
+import os
+import glob
+import threading
+import tracemalloc
+
+# Memory is tracked for the whole process: tracemalloc can't tell which
+# thread allocated a block. The sections are therefore kept in one dict,
+# and it is only used by timers that were started with track_memory=True.
+_sections = {}  # identifier -> memory when the section started
+_results = {}   # identifier -> memory of the last finished section
+_lock = threading.Lock()
+_started_tracing = False
+# tracemalloc only knows the blocks that are allocated now, so a thread
+# takes a snapshot whenever the traced memory reaches a new high, to see
+# the sites of memory that is freed again before the section ends
+_interval = 0.001    # seconds between two looks at the traced memory
+_watching = None     # threading.Event that stops the thread that watches
+_frames = 10     # frames that are traced per allocation
+_libraries = None  # folders of the standard library and site-packages
+_process = None    # psutil.Process, False if psutil is not installed
+# the modules of stimer one by one, a * in a Filter also matches the tests
+_filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+            # also in threading, called by the thread that takes snapshots
+            tracemalloc.Filter(False, __file__, all_frames=True),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+_filters += [tracemalloc.Filter(False, path) for path in
+             glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))]
+
+
+def _rss():
+    """resident set size of the process in bytes, or None if unknown"""
+    global _process
+    if _process is None:
+        try:
+            import psutil
+            _process = psutil.Process()
+        except ImportError:
+            _process = False
+    if _process:
+        return _process.memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _print_memory(n_bytes, sign=False):
+    """'12.3 MB', with sign=True '+12.3 MB' or '-12.3 MB'"""
+    prefix = ('+' if n_bytes >= 0 else '-') if sign else ''
+    size = abs(n_bytes)
+    for unit in ['bytes', 'kB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return f'{prefix}{size:.0f} {unit}' if unit == 'bytes' else f'{prefix}{size:.1f} {unit}'
+
+
+def _site(traceback):
+    """
+    the line that allocated: the most recent frame that is not part of a
+    library, such that np.ones() shows the line that called it
+    """
+    global _libraries
+    if _libraries is None:
+        import sysconfig
+        paths = sysconfig.get_paths()
+        _libraries = tuple({os.path.normcase(paths[key]) for key in
+                            ['stdlib', 'platstdlib', 'purelib', 'platlib'] if key in paths})
+    for frame in reversed(traceback):
+        filename = frame.filename
+        # code of notebooks and `python -c` has names like <ipython-input-1>
+        if not filename.startswith('<frozen') and \
+           not os.path.normcase(filename).startswith(_libraries):
+            break
+    else:
+        frame = traceback[-1]
+    return f'{os.path.basename(frame.filename)}:{frame.lineno}'
+
+
+def _update_peaks():
+    """
+    give the peak since the last reset_peak() to all running sections,
+    before a new section resets it
+    """
+    _, peak = tracemalloc.get_traced_memory()
+    for section in _sections.values():
+        section['peak'] = max(section['peak'], peak)
+
+
+def _watch(stop):
+    """snapshot of the traced memory at the highest point of each section"""
+    while not stop.wait(_interval):
+        current, _ = tracemalloc.get_traced_memory()
+        with _lock:
+            if stop.is_set():
+                break
+            # a margin, such that slowly growing memory doesn't take a
+            # snapshot each time
+            sections = [section for section in _sections.values()
+                        if current > section['high'] * 1.01 + 65536]
+            if sections:
+                snapshot = tracemalloc.take_snapshot()
+                # after the snapshot, which is traced memory itself
+                high, _ = tracemalloc.get_traced_memory()
+                for section in sections:
+                    section['high'] = high
+                    section['high_snapshot'] = snapshot
+
+
+def _start_memory(identifier):
+    """start to track the memory of a section, called by stimer.start"""
+    global _started_tracing, _watching
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(_frames)
+            _started_tracing = True
+        if _watching is None:
+            _watching = threading.Event()
+            threading.Thread(target=_watch, args=(_watching,), name='stimer.memory',
+                             daemon=True).start()
+        _update_peaks()
+        tracemalloc.reset_peak()
+        # first, so that their allocations are not in the snapshot
+        rss = _rss()
+        current, _ = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        _sections[identifier] = {'current': current, 'peak': current, 'rss': rss,
+                                 'snapshot': snapshot, 'high': current,
+                                 'high_snapshot': snapshot}
+
+
+def _site_sizes(diff):
+    """{file:line: bytes} of the statistics of Snapshot.compare_to"""
+    sizes = {}
+    for stat in diff:
+        if stat.size_diff:
+            site = _site(stat.traceback)
+            sizes[site] = sizes.get(site, 0) + stat.size_diff
+    return sizes
+
+
+def _stop_memory(identifier, top=10):
+    """
+    stop tracking the memory of a section, called by stimer.stop
+
+    :returns: dict with peak (most bytes that were allocated at the same
+              time during the section), net (bytes allocated but not freed
+              at the end), rss (change of the resident set size, None if
+              unknown) and top, the lines that allocated the most memory
+              as list of (file:line, bytes at the peak, net bytes).
+              None if the memory of identifier was not tracked.
+              peak and net are the traced memory of the whole process, so
+              they include the allocations of other threads. The bytes at
+              the peak come from the snapshot at the highest memory that
+              was seen, which is looked at every millisecond, so memory
+              that lives shorter than that can be missed.
+    """
+    global _started_tracing, _watching
+    with _lock:
+        section = _sections.pop(identifier, None)
+        if section is None:
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        rss = _rss()
+        if not _sections:
+            _watching.set()
+            _watching = None
+            if _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+    # NumPy reports the data of its arrays to tracemalloc, so copies of
+    # arrays appear with the line that created them
+    start = section['snapshot'].filter_traces(_filters)
+    high = section['high_snapshot']
+    if high is section['snapshot'] or section['high'] < current:
+        high = snapshot
+    at_high = _site_sizes(high.filter_traces(_filters).compare_to(start, 'traceback'))
+    net = _site_sizes(snapshot.filter_traces(_filters).compare_to(start, 'traceback'))
+    # memory that was allocated after the snapshot at the high, and kept
+    sizes = {site: max(at_high.get(site, 0), net.get(site, 0)) for site in {**at_high, **net}}
+    sites = sorted([(site, size, net.get(site, 0)) for site, size in sizes.items() if size > 0],
+                   key=lambda site: site[1], reverse=True)[:top]
+    result = {'peak': max(section['peak'], peak) - section['current'],
+              'net': current - section['current'],
+              'rss': None if rss is None or section['rss'] is None else rss - section['rss'],
+              'top': sites}
+    _results[identifier] = result
+    return result
+
+
+def memory_stats(identifier=None):
+    """
+    memory of the last finished section with this identifier, see
+    _stop_memory(), or a dict of all sections if identifier is None
+    """
+    if identifier is None:
+        return dict(_results)
+    return _results.get(identifier)
+
+
+def _format_memory(result, top=5):
+    """one line with peak, net and RSS, and one line for each top site"""
+    line = f"peak {_print_memory(result['peak'])}, net {_print_memory(result['net'], sign=True)}"
+    if result['rss'] is not None:
+        line += f", RSS {_print_memory(result['rss'], sign=True)}"
+    for site, size, net in result['top'][:top]:
+        line += (f'\n    {_print_memory(size):>10} at peak, '
+                 f'{_print_memory(net, sign=True):>10} net  {site}')
+    return line
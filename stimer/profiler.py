@@ -0,0 +1,417 @@
+import time as t
+import atexit
+import inspect
+import threading
+import contextvars
+import numpy as np
+from .events import _log
+
+_perf_counter = t.perf_counter
+_BUFFER = 1024  # durations that are collected before they are aggregated
+
+
+def _format_time(seconds):
+    """short representation with 3 digits, for the columns of the report"""
+    # self can be negative when concurrent tasks overlap in their parent
+    for unit, factor in (('s ', 1), ('ms', 1e3), ('μs', 1e6)):
+        if abs(seconds) * factor >= 1:
+            break
+    else:
+        unit, factor = 'ns', 1e9
+    value = seconds * factor
+    return f'{value:.3g} {unit}' if abs(value) < 1000 else f'{value:.0f} {unit}'
+
+
+class _Node():
+    """one section of the call tree, with the timings of all its calls"""
+    __slots__ = ('name', 'parent', 'children', 'buffer', 'count',
+                 'total', 'min', 'max', 'samples')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.buffer = []  # durations that are not aggregated yet
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.samples = np.zeros(0)
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            # atomic, if two threads add the same child both get the same
+            node = self.children.setdefault(name, _Node(name, self))
+        return node
+
+    def names(self):
+        """names from the root down to this node"""
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return names[::-1]
+
+    def snapshot(self):
+        """
+        count, total, min, max and samples including the buffered durations.
+        Doesn't change the node, so that other threads can read it while
+        threads keep adding durations. Called with the lock of the profiler.
+        """
+        buffered = np.array(self.buffer)  # copying the list is atomic
+        count, total = self.count, self.total
+        minimum, maximum, samples = self.min, self.max, self.samples
+        if len(buffered):
+            count += len(buffered)
+            total += float(buffered.sum())
+            minimum = min(minimum, float(buffered.min()))
+            maximum = max(maximum, float(buffered.max()))
+            samples = np.concatenate([samples, buffered])
+        return count, total, minimum, maximum, samples
+
+    def flush(self, max_samples):
+        """
+        aggregate the buffered durations, keep a uniform sample of them.
+        Called with the lock of the profiler. Other threads can append to
+        the buffer meanwhile, only the durations that were taken are removed.
+        """
+        n = len(self.buffer)
+        if not n:
+            return
+        durations = np.array(self.buffer[:n])
+        del self.buffer[:n]
+        n_before = self.count
+        self.count += len(durations)
+        self.total += float(durations.sum())
+        self.min = min(self.min, float(durations.min()))
+        self.max = max(self.max, float(durations.max()))
+        free = max_samples - len(self.samples)
+        if free > 0:
+            self.samples = np.concatenate([self.samples, durations[:free]])
+            durations = durations[free:]
+            n_before += free
+        if len(durations):
+            # reservoir sampling: the k-th duration replaces a random
+            # sample with a probability of max_samples/k
+            k = n_before + np.arange(1, len(durations) + 1)
+            slots = (np.random.random(len(durations)) * k).astype(np.int64)
+            keep = slots < max_samples
+            self.samples[slots[keep]] = durations[keep]
+
+
+class _Section():
+    """context manager and decorator for one named section of a Profiler"""
+    __slots__ = ('profiler', 'name', '_frame')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self._frame = profiler._frame
+
+    def __enter__(self):
+        frame = self._frame.get()
+        if frame is None:
+            # not nested: the tree of this thread
+            try:
+                parent = self.profiler._local.root
+            except AttributeError:
+                parent = self.profiler._thread_root()
+        else:
+            # nested: the tree of the parent, also if the context was
+            # copied to another thread, e.g. by asyncio.to_thread
+            parent = frame[0]
+        node = parent.children.get(self.name)
+        if node is None:
+            node = parent.child(self.name)
+        # (node, start, enclosing frame), the context of a task that is
+        # created inside the section still sees the enclosing frame
+        self._frame.set((node, _perf_counter(), frame))
+        return self
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        end = _perf_counter()
+        node, start, frame = self._frame.get()
+        buffer = node.buffer
+        buffer.append(end - start)
+        if len(buffer) >= _BUFFER:
+            self.profiler._flush(node)
+        if self.profiler.log_events:
+            _log.record(node.name, start, end - start)
+        self._frame.set(frame)
+
+    def __call__(self, func):
+        section = self
+        if inspect.iscoroutinefunction(func):
+            # the body runs when the coroutine is awaited, not when it
+            # is created
+            async def wrapped(*args, **kwargs):
+                with section:
+                    return await func(*args, **kwargs)
+        elif inspect.isgeneratorfunction(func):
+            # each step of the generator is one call of the section, the
+            # time between the steps belongs to the caller
+            def wrapped(*args, **kwargs):
+                generator = func(*args, **kwargs)
+                try:
+                    with section:
+                        value = next(generator)
+                    while True:
+                        sent = yield value
+                        with section:
+                            value = generator.send(sent)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    generator.close()
+        else:
+            def wrapped(*args, **kwargs):
+                with section:
+                    return func(*args, **kwargs)
+        wrapped.__name__ = func.__name__
+        wrapped.__qualname__ = func.__qualname__
+        wrapped.__doc__ = func.__doc__
+        wrapped.__wrapped__ = func
+        return wrapped
+
+
+class _UnscopedSection(_Section):
+    """_Section that keeps the running frame in the profiler, for scoped=False"""
+    __slots__ = ()
+
+    def __enter__(self):
+        profiler = self.profiler
+        frame = profiler._running
+        parent = profiler._root if frame is None else frame[0]
+        node = parent.children.get(self.name)
+        if node is None:
+            node = parent.child(self.name)
+        profiler._running = (node, _perf_counter(), frame)
+        return self
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        end = _perf_counter()
+        profiler = self.profiler
+        node, start, frame = profiler._running
+        buffer = node.buffer
+        buffer.append(end - start)
+        if len(buffer) >= _BUFFER:
+            profiler._flush(node)
+        if profiler.log_events:
+            _log.record(node.name, start, end - start)
+        profiler._running = frame
+
+
+class Profiler():
+    """
+    Hierarchical profiler: records a call tree of named sections and
+    aggregates count, total, mean, min, max and percentiles for each.
+    Sections that are nested in the code are nested in the tree, so the
+    same name can appear under different parents. The durations are only
+    appended to a list while running and aggregated in batches.
+
+    The profiler can be shared by threads and asyncio tasks: the running
+    sections are tracked per thread and task with contextvars. Sections
+    that are not nested in another one start a tree of the calling thread,
+    nested sections are recorded in the tree of their parent. Timing only
+    appends to lists, which is atomic, so no locks are taken on the hot
+    path, the batches are aggregated under a lock. The trees of all
+    threads are merged when the statistics are requested.
+
+    A kept section costs about 5 times an empty `with` statement: 1.0 μs
+    where the empty `with` takes 0.2 μs, 2.5 μs where it takes 0.45 μs.
+    The get and set of the ContextVar take 0.35 μs of the 1.0 μs and the
+    two perf_counter 0.17 μs, so it can't get below about 0.75 μs there.
+    With scoped=False the running section is kept in an attribute instead,
+    which takes 0.6 μs (1.8 μs on the slower machine), but the profiler
+    must then only be used by one thread and without interleaving asyncio
+    tasks. prof('name') looks the section up by its name, which adds
+    0.2 μs (0.8 μs).
+    In hot loops the section can be kept: `parse = prof('parse')` once,
+    then `with parse:`.
+
+    Example:
+        prof = stimer.Profiler()
+        with prof('load'):
+            for file in files:
+                with prof('parse'):
+                    ...
+        @prof('compute')     # or just @prof, uses the function name
+        def compute(): ...
+
+        prof.start('plot'); ...; prof.stop('plot')
+        prof.report()
+
+    :param max_samples: durations kept per section for the percentiles,
+                        more calls are sampled uniformly
+    :param report_at_exit: print the report when python exits
+    :param log_events: also add each section to the event log of stimer,
+                       to export them with stimer.export()
+    :param scoped: track the running sections per thread and asyncio task
+    """
+    def __init__(self, max_samples=10000, report_at_exit=False, log_events=False,
+                 scoped=True):
+        self.max_samples = max_samples
+        self.log_events = log_events
+        self.scoped = scoped
+        self._sections = {}
+        self._frame = contextvars.ContextVar(f'stimer_profiler_{id(self)}', default=None)
+        self._lock = threading.Lock()
+        self.reset()
+        if report_at_exit:
+            atexit.register(self.report)
+
+    def reset(self):
+        """remove all timings"""
+        with self._lock:
+            self._local = threading.local()
+            self._roots = []  # the trees of all threads
+            if not self.scoped:
+                self._root = _Node('')
+                self._roots.append(self._root)
+                self._running = None
+
+    def _flush(self, node):
+        with self._lock:
+            node.flush(self.max_samples)
+
+    def _thread_root(self):
+        """create the tree of the calling thread"""
+        root = _Node('')
+        with self._lock:
+            self._local.root = root
+            self._roots.append(root)
+        return root
+
+    def __call__(self, name):
+        """section to use with `with` or as decorator, @prof also works"""
+        section = self._sections.get(name)
+        if section is not None:
+            return section
+        if callable(name):
+            return self(name.__qualname__)(name)
+        cls = _Section if self.scoped else _UnscopedSection
+        return self._sections.setdefault(name, cls(self, name))
+
+    def start(self, name):
+        """start a section, nested in the section that is running"""
+        self(name).__enter__()
+        if self.scoped:
+            self._local.frame = self._frame.get()
+
+    def stop(self, name=None):
+        """stop the innermost section, returns the elapsed seconds"""
+        end = _perf_counter()
+        if not self.scoped:
+            frame = self._running
+        else:
+            frame = self._frame.get()
+            if frame is None:
+                # started in this thread, but in a context that is gone
+                frame = getattr(self._local, 'frame', None)
+        if frame is None or (name is not None and frame[0].name != name):
+            running = None if frame is None else frame[0].name
+            print(f'[stimer] Profiler: stop({name!r}) but {running!r} is running')
+            return None
+        node, start, parent = frame
+        elapsed = end - start
+        node.buffer.append(elapsed)
+        if len(node.buffer) >= _BUFFER:
+            self._flush(node)
+        if self.log_events:
+            _log.record(node.name, start, elapsed)
+        if not self.scoped:
+            self._running = parent
+        else:
+            self._frame.set(parent)
+            self._local.frame = parent
+        return elapsed
+
+    def _merge(self, target, source):
+        """add the timings of source and its children to target"""
+        count, total, minimum, maximum, samples = source.snapshot()
+        if count:
+            weights = np.concatenate([np.full(len(target.samples), target.count / max(len(target.samples), 1)),
+                                      np.full(len(samples), count / max(len(samples), 1))])
+            samples = np.concatenate([target.samples, samples])
+            if len(samples) > self.max_samples:
+                # keep the samples of each thread in proportion to its calls
+                keep = np.random.choice(len(samples), self.max_samples, replace=False,
+                                        p=weights / weights.sum())
+                samples = samples[np.sort(keep)]
+            target.samples = samples
+            target.count += count
+            target.total += total
+            target.min = min(target.min, minimum)
+            target.max = max(target.max, maximum)
+        for name, child in list(source.children.items()):
+            self._merge(target.child(name), child)
+
+    def _walk(self, node, depth, sort_key):
+        for child in sorted(node.children.values(), key=sort_key, reverse=True):
+            yield child, depth
+            yield from self._walk(child, depth + 1, sort_key)
+
+    def stats(self, sort='total', percentiles=(50, 90, 99)):
+        """
+        statistics of all sections in the order of the report
+
+        :param sort: order of the sections below the same parent, any of
+                     the keys below, e.g. 'total', 'count' or 'mean'
+        :param percentiles: percentiles of the durations to compute
+        :returns: list of dicts with path ('load/parse'), name, depth,
+                  count, total, self (total without the subsections), mean,
+                  min, max and p50, p90, p99
+        """
+        root = _Node('')
+        with self._lock:
+            for thread_root in self._roots:
+                self._merge(root, thread_root)
+
+        summaries = {}
+        def summarise(node):
+            if node not in summaries:
+                children = sum(child.total for child in node.children.values())
+                summaries[node] = {'count': node.count, 'total': node.total,
+                                   'self': node.total - children,
+                                   'mean': node.total / node.count if node.count else 0.0,
+                                   'min': node.min if node.count else 0.0,
+                                   'max': node.max}
+            return summaries[node]
+
+        stats = []
+        for node, depth in self._walk(root, 0, lambda node: summarise(node)[sort]):
+            row = {'path': '/'.join(node.names()), 'name': node.name, 'depth': depth}
+            row.update(summarise(node))
+            values = np.percentile(node.samples, percentiles) if len(node.samples) \
+                     else [0.0] * len(percentiles)
+            for q, value in zip(percentiles, values):
+                row[f'p{q}'] = float(value)
+            stats.append(row)
+        return stats
+
+    def report(self, sort='total', file=None):
+        """
+        print the call tree with the statistics of each section
+
+        :param sort: order of the sections below the same parent
+        :param file: write the report to this file instead of printing it
+        :returns: the report as str
+        """
+        columns = ['count', 'total', 'self', 'mean', 'min', 'max', 'p50', 'p90', 'p99']
+        stats = self.stats(sort=sort)
+        width = max([len(row['name']) + 2 * row['depth'] for row in stats] + [7])
+        lines = ['section'.ljust(width) + ''.join(c.rjust(10) for c in columns)]
+        for row in stats:
+            line = ('  ' * row['depth'] + row['name']).ljust(width)
+            line += str(row['count']).rjust(10)
+            line += ''.join(_format_time(row[c]).rjust(10) for c in columns[1:])
+            lines.append(line)
+        report = '\n'.join(lines)
+        if file is None:
+            print(report)
+        else:
+            with open(file, 'w', encoding='utf-8') as f:
+                f.write(report + '\n')
+        return report
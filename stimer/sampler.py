@@ -0,0 +1,133 @@
+import os
+import sys
+import time as t
+import threading
+
+
+class Sampler():
+    """
+    Sampling profiler for long running jobs: a background thread looks at
+    the stacks of all threads every `interval_ms` and counts how often each
+    stack was seen. Nothing is added to the profiled code, so the overhead
+    only depends on the interval and the depth of the stacks: one sample of
+    a thread with 20 frames takes about 7 μs when it is repeated
+    (bench_sample in benchmarks/bench_stimer.py) and 15-25 μs in between
+    other work, about 0.2% of the time at the default interval. The time
+    spent sampling is kept in `seconds`. While other threads compute, the
+    sampler has to wait for the GIL, so intervals below
+    sys.getswitchinterval() (5 ms) are not reached.
+
+    The counts are written in the collapsed stack format, one line per
+    stack, which flamegraph.pl, speedscope and inferno read directly:
+        MainThread;run (job.py:10);preprocess (job.py:25) 5310
+
+    Use it as context manager or with start()/stop():
+        with stimer.sample(interval_ms=10, file='job.collapsed'):
+            run()
+
+        sampler = stimer.sample(file='job.collapsed').start()
+        ...
+        sampler.stop()
+
+    :param interval_ms: milliseconds between two samples
+    :param file: write the collapsed stacks to this file on stop()
+    """
+    def __init__(self, interval_ms=10, file=None):
+        self.interval = interval_ms / 1000
+        self.file = file
+        self.counts = {}    # (thread name, code objects) -> samples
+        self.samples = 0
+        self.seconds = 0.0  # time spent taking samples
+        self._labels = {}   # code object -> label of the frame
+        self._names = {}    # thread id -> thread name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            label = self._labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+        return label
+
+    def _thread_name(self, ident):
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._names.get(ident, str(ident))
+        return name
+
+    def _sample(self):
+        own = threading.get_ident()
+        counts = self.counts
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            # the stack is collected as code objects, the labels are only
+            # created once for each code object
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            key = (self._thread_name(ident), tuple(stack))
+            counts[key] = counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        next_sample = t.perf_counter()
+        while not self._stop.is_set():
+            start = t.perf_counter()
+            self._sample()
+            self.seconds += t.perf_counter() - start
+            # keep the rate even if a sample was late
+            next_sample = max(next_sample + self.interval, t.perf_counter())
+            self._stop.wait(next_sample - t.perf_counter())
+
+    def start(self):
+        """start sampling in a background thread, returns the Sampler"""
+        assert self._thread is None, 'Sampler is already running'
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stimer.sample', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """stop sampling and write the file, returns the collapsed stacks"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        collapsed = self.collapsed()
+        if self.file is not None:
+            with open(self.file, 'w', encoding='utf-8') as f:
+                f.write(collapsed)
+        return collapsed
+
+    def stacks(self):
+        """dict of 'thread;outer;...;inner' -> number of samples"""
+        stacks = {}
+        for (thread, codes), count in list(self.counts.items()):
+            names = [thread]
+            names += [self._label(code) for code in reversed(codes)]
+            stack = ';'.join(names)
+            stacks[stack] = stacks.get(stack, 0) + count
+        return stacks
+
+    def collapsed(self):
+        """the stacks in the collapsed stack format, one per line"""
+        stacks = self.stacks()
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, traceback):
+        self.stop()
+
+
+def sample(interval_ms=10, file=None):
+    """
+    sampling profiler that writes a flame graph of all threads,
+    as context manager or with start()/stop(), see Sampler
+    """
+    return Sampler(interval_ms=interval_ms, file=file)
@@ -1,11 +1,37 @@
 import time as t
-from inspect import getframeinfo, stack
 import os
+import sys
+import weakref
+import threading
+import contextvars
 import numpy as np
+from .memory import _start_memory, _stop_memory, _format_memory, memory_stats
+from .memory import _sections as _memory_sections
+from .events import _log
 
+# The timers are scoped per thread and asyncio task: each identifier has a
+# ContextVar with its start time. A task gets a copy of the context of the
+# task that created it, so it never changes the timers of that task, and
+# setting a ContextVar copies nothing. A thread also remembers its timers,
+# for contexts that are not kept between calls (e.g. notebook cells that
+# run as separate tasks).
+_timers = {}  # identifier -> ContextVar of its start time, None if stopped
+_lapse = contextvars.ContextVar('stimer_lapse', default=None)
+_thread = threading.local()
+_perf_counter = t.perf_counter
+_labels = {}       # (code object, line) -> label of a lapse call
+# {label: [count, total, min, max]} of each thread. The stats of a thread
+# are moved to _lapse_exited when the thread object is gone, and merged
+# into _lapse_merged by the next thread that starts to use lapse() or by
+# lapse_report(), so that threads that come and go don't pile up.
+_lapse_stats = weakref.WeakKeyDictionary()  # thread -> stats
+_lapse_exited = []
+_lapse_merged = {}
+_lapse_lock = threading.Lock()
 
 
-def timeit(fn):
+
+def timeit(fn=None, memory=False):
     """
     time a function call, use it as a wrapper:
     
@@ -20,12 +46,21 @@ def timeit(fn):
         def test():
             time.sleep(1)
         # 15 seconds
+
+    Also track the memory that is allocated, see stimer.start:
+        @stimer.timeit(memory=True)
+        def test():
+            np.zeros(1000000)
+        # peak 7.6 MB, net +0 bytes
+
+    For a warmup, median and confidence intervals that can be compared
+    between runs, use stimer.bench instead.
     """
     def wrapper(func, iterations=1):
         def wrapped(*args, **kwargs):
             times = []
             for i in range(iterations):
-                start(func.__name__)
+                start(func.__name__, track_memory=memory)
                 result = func(*args, **kwargs)
                 elapsed = stop(func.__name__, verbose=False)
                 times.append(elapsed)
@@ -33,9 +68,14 @@ def timeit(fn):
             std = ' +- ' +  _print_time(np.std(times)) if iterations>1 else ''
             repeats = f', {iterations} loops' if iterations>1 else ''
             print(f'{func.__name__}: runtime {mean}{std}{repeats}')
+            if memory:
+                # of the last call
+                print('    ' + _format_memory(memory_stats(func.__name__)))
             return result
         return wrapped
-    if callable(fn):
+    if fn is None:
+        return lambda func: wrapper(func, iterations=1)
+    elif callable(fn):
         return wrapper(fn, iterations=1)
     elif isinstance(fn, int):
         def wrapped_repeated(func):
@@ -43,41 +83,148 @@ def timeit(fn):
         return wrapped_repeated
 
 
+def _lapse_label(frame):
+    """'file.py:function():line' of the frame, cached per call site"""
+    key = (frame.f_code, frame.f_lineno)
+    label = _labels.get(key)
+    if label is None:
+        code = frame.f_code
+        label = _labels[key] = '{}:{}():{}'.format(os.path.basename(code.co_filename),
+                                                   code.co_name, frame.f_lineno)
+    return label
+
+
+def _merge_lapse(merged, stats):
+    """add the lapse stats of a thread to merged"""
+    for line, (count, total, minimum, maximum) in list(stats.items()):
+        site = merged.setdefault(line, [0, 0.0, float('inf'), 0.0])
+        site[0] += count
+        site[1] += total
+        site[2] = min(site[2], minimum)
+        site[3] = max(site[3], maximum)
+
+
+def _collect_lapse():
+    """merge the stats of threads that ended, called with _lapse_lock"""
+    # the finalizers only append, taking the lock in them could deadlock
+    # if the garbage collector runs them while the lock is held
+    while _lapse_exited:
+        _merge_lapse(_lapse_merged, _lapse_exited.pop())
+
+
 def lapse(prefix='', verbose=True):
     """
     Will print the time from the previous invocation
+    in the same thread or asyncio task
+
+    The times are also summed up per line, see lapse_report(). Use
+    verbose=False to leave lapse() in loops without printing.
     """
-    identifier = '%%LAPSE%%'
-    if not identifier in starttime:
-        starttime[identifier] = t.perf_counter()
+    end = _perf_counter()
+    state = _lapse.get()
+    if state is None:
+        state = getattr(_thread, 'lapse', None)
+    if state is None:
         elapsed = 0
+        count, lines = 0, frozenset()
     else:
-        elapsed = t.perf_counter() - starttime[identifier]
-        elapsed_str = _print_time(elapsed)
-        caller = getframeinfo(stack()[1][0])
-        count = starttime['%%COUND%%']
-        line = '{}:{}():{}'.format(os.path.basename(caller.filename), caller.function,  caller.lineno)
-        if line in line_cache: 
-            line_cache.clear()
-            line_cache.add(line)
-            star='#'
+        elapsed = end - state[0]
+        count, lines = state[1], state[2]
+        line = _lapse_label(sys._getframe(1))
+        try:
+            stats = _thread.lapse_stats
+        except AttributeError:
+            stats = _thread.lapse_stats = {}
+            thread = threading.current_thread()
+            with _lapse_lock:
+                _collect_lapse()
+                _lapse_stats[thread] = stats
+            weakref.finalize(thread, _lapse_exited.append, stats)
+        site = stats.get(line)
+        if site is None:
+            stats[line] = [1, elapsed, elapsed, elapsed]
         else:
-            line_cache.add(line)
-            star = ''
-        if prefix != '': prefix = f' {prefix}'
+            site[0] += 1
+            site[1] += elapsed
+            if elapsed < site[2]: site[2] = elapsed
+            if elapsed > site[3]: site[3] = elapsed
         if verbose:
-            print(f'[{count}{prefix}] {line} - {elapsed_str}\t{star}')
-        starttime[identifier] = t.perf_counter()
-    starttime['%%COUND%%']+=1
+            if line in lines:
+                lines = frozenset([line])
+                star='#'
+            else:
+                lines = lines | {line}
+                star = ''
+            if prefix != '': prefix = f' {prefix}'
+            print(f'[{count}{prefix}] {line} - {_print_time(elapsed)}\t{star}')
+    state = (_perf_counter(), count + 1, lines)
+    _lapse.set(state)
+    _thread.lapse = state
     return elapsed
 
 
-def start(identifier = ''):
+def lapse_report(verbose=True, reset=False):
     """
-    Starts a timer with the given identifier
+    Statistics of the lapse() calls of all threads, per line of the call.
+    Each time is the time since the previous lapse() call.
+
+    :param verbose: print the statistics
+    :param reset: remove the statistics after the report
+    :returns: list of dicts with line, count, total, mean, min and max,
+              the line with the longest total first
     """
-    starttime[identifier] = t.perf_counter()
-   
+    merged = {}
+    with _lapse_lock:
+        _collect_lapse()
+        _merge_lapse(merged, _lapse_merged)
+        if reset:
+            _lapse_merged.clear()
+        for stats in list(_lapse_stats.values()):
+            _merge_lapse(merged, stats)
+            if reset:
+                stats.clear()
+    report = [{'line': line, 'count': count, 'total': total, 'mean': total / count,
+               'min': minimum, 'max': maximum}
+              for line, (count, total, minimum, maximum) in merged.items()]
+    report.sort(key=lambda row: row['total'], reverse=True)
+    if verbose:
+        width = max([len(row['line']) for row in report] + [4])
+        print('line'.ljust(width) + 'count'.rjust(10) +
+              ''.join(c.rjust(16) for c in ['total', 'mean', 'min', 'max']))
+        for row in report:
+            print(row['line'].ljust(width) + str(row['count']).rjust(10) +
+                  ''.join(_print_time(row[c]).rjust(16) for c in ['total', 'mean', 'min', 'max']))
+    return report
+
+
+def start(identifier = '', track_memory=False):
+    """
+    Starts a timer with the given identifier, timers of different
+    threads and asyncio tasks are independent of each other
+
+    With track_memory=True, stop() also reports the peak and net memory
+    that was allocated with tracemalloc, the change of the RSS of the
+    process and the lines that allocated the most. Tracing slows down
+    allocations, it is stopped when the last of these timers stops.
+    Memory can't be attributed to threads, so it includes the allocations
+    of all threads. The results are kept in stimer.memory_stats().
+    """
+    if track_memory:
+        # the event log allocates its arrays at the first event, which
+        # would count as memory of the section
+        _log._allocate()
+        _start_memory(identifier)
+    try:
+        timer = _timers[identifier]
+    except KeyError:
+        timer = _timers.setdefault(identifier, contextvars.ContextVar(
+            f'stimer_timer_{identifier}', default=None))
+    try:
+        thread_timers = _thread.timers
+    except AttributeError:
+        thread_timers = _thread.timers = {}
+    thread_timers[identifier] = begin = _perf_counter()
+    timer.set(begin)
 
 
 def _print_time(seconds):    
@@ -95,29 +242,42 @@ def _print_time(seconds):
         return "{} ms".format(int(seconds*1000))
     elif seconds > 0.001:
         return "{:.1f} ms".format(seconds*1000)
-    elif seconds > 0.0001:
-        return "{:.1f} μs".format(seconds*100000)
+    elif seconds >= 1e-6:
+        return "{:.1f} μs".format(seconds*1e6)
     else:
-        return "{} nanoseconds".format(int(seconds*1e-9))
+        return "{} nanoseconds".format(int(seconds*1e9))
    
     
 def stop(identifier = '', verbose=True):
     """
-    Stops a timer with the given identifier and prints the elapsed time
+    Stops a timer with the given identifier and prints the elapsed time.
+    The section is also logged, see stimer.events() and stimer.export()
     """
+    end = _perf_counter()
     try:
-        elapsed = t.perf_counter() - starttime[identifier]
-        if verbose: 
-            print('Elapsed {}: {}'.format(identifier, _print_time(elapsed)))
-        del starttime[identifier]
-        return elapsed
-    except KeyError:
+        begin = _thread.timers.pop(identifier, None)
+    except AttributeError:
+        begin = None
+    timer = _timers.get(identifier)
+    started = None if timer is None else timer.get()
+    if started is not None:
+        begin = started
+        timer.set(None)
+    elif begin is None:
+        # otherwise it was started in this thread, but in a context that is gone
         print('[stimer] KeyError: Identifier {} not found'.format(identifier))
-   
+        return None
+    elapsed = end - begin
+    memory = _stop_memory(identifier) if _memory_sections else None
+    _log.record(identifier, begin, elapsed)
+    if verbose:
+        print('Elapsed {}: {}'.format(identifier, _print_time(elapsed)))
+        if memory is not None:
+            print('    ' + _format_memory(memory))
+    return elapsed
+
 def sleep(seconds):
     t.sleep(seconds)
 
 
-starttime = dict({'%%COUND%%':0})
-line_cache = set()
 wrapper = timeit
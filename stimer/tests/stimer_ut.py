@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of stimer
+
+@author: Simon Kern
+"""
+
+import os
+import sys
+import csv
+import json
+import gc
+import time
+import asyncio
+import tempfile
+import subprocess
+import threading
+import unittest
+import numpy as np
+import stimer
+from stimer.benchmark import mann_whitney
+from stimer.events import _EventLog
+from stimer.profiler import _Node
+from stimer.stimer import _lapse_stats
+from stimer.lineprofiler import _monitored
+from stimer.__main__ import run_benchmarks
+
+
+class StimerTest(unittest.TestCase):
+
+    def test_start_stop(self):
+        stimer.start('test_start_stop')
+        time.sleep(0.01)
+        elapsed = stimer.stop('test_start_stop', verbose=False)
+        self.assertGreaterEqual(elapsed, 0.01)
+        self.assertIsNone(stimer.stop('never started', verbose=False))
+        with stimer('test_context'):
+            pass
+
+    def test_timers_threads_asyncio(self):
+        # the same identifier in several threads and tasks at the same time
+        elapsed = {}
+        def thread(i):
+            stimer.start('shared')
+            time.sleep(0.01 * i)
+            elapsed[i] = stimer.stop('shared', verbose=False)
+        threads = [threading.Thread(target=thread, args=(i,)) for i in range(1, 4)]
+        for th in threads: th.start()
+        for th in threads: th.join()
+        for i in range(1, 4):
+            self.assertGreaterEqual(elapsed[i], 0.01 * i)
+            self.assertLess(elapsed[i], 0.01 * i + 0.5)
+
+        async def task(i):
+            stimer.start('shared')
+            await asyncio.sleep(0.01 * i)
+            return stimer.stop('shared', verbose=False)
+        async def main():
+            return await asyncio.gather(*[task(i) for i in range(1, 4)])
+        for i, elapsed in enumerate(asyncio.run(main()), 1):
+            self.assertGreaterEqual(elapsed, 0.01 * i)
+            self.assertLess(elapsed, 0.01 * i + 0.5)
+
+        # a task can stop the timers of the task that created it, which
+        # keeps them running in its own context
+        async def child():
+            return stimer.stop('parent', verbose=False)
+        async def parent():
+            stimer.start('parent')
+            self.assertIsNotNone(await asyncio.create_task(child()))
+            await asyncio.sleep(0.01)
+            return stimer.stop('parent', verbose=False)
+        self.assertGreaterEqual(asyncio.run(parent()), 0.01)
+
+    def test_lapse(self):
+        stimer.lapse_report(verbose=False, reset=True)
+        def run():
+            stimer.lapse(verbose=False)
+            for i in range(5):
+                stimer.lapse(verbose=False)
+        run()
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for th in threads: th.start()
+        for th in threads: th.join()
+        report = stimer.lapse_report(verbose=False, reset=True)
+        counts = {row['line']: row['count'] for row in report}
+        # the first call of each thread only starts the lapse, the first
+        # call of the main thread may end one of an earlier test
+        loop = [line for line in counts if counts[line] == 20]
+        self.assertEqual(len(loop), 1)
+        self.assertTrue(loop[0].startswith('stimer_ut.py:run():'))
+        for row in report:
+            self.assertLessEqual(row['min'], row['mean'])
+            self.assertLessEqual(row['mean'], row['max'])
+        self.assertEqual(stimer.lapse_report(verbose=False), [])
+
+        # threads that ended are merged, not kept one by one
+        threads = [threading.Thread(target=run) for _ in range(50)]
+        for th in threads: th.start()
+        for th in threads: th.join()
+        del threads, th
+        report = stimer.lapse_report(verbose=False, reset=True)
+        self.assertIn(250, [row['count'] for row in report])
+        self.assertLessEqual(len(_lapse_stats), 1)
+
+    def test_memory(self):
+        stimer.start('test_memory', track_memory=True)
+        data = np.ones(1000000)
+        stimer.stop('test_memory', verbose=False)
+        memory = stimer.memory_stats('test_memory')
+        self.assertGreaterEqual(memory['peak'], data.nbytes)
+        self.assertGreaterEqual(memory['net'], data.nbytes)
+        site, size, net = memory['top'][0]
+        self.assertIn('stimer_ut.py', site)
+        self.assertGreaterEqual(size, data.nbytes)
+        self.assertGreaterEqual(net, data.nbytes)
+
+        # memory that is freed again only shows in the peak
+        stimer.start('test_memory', track_memory=True)
+        temporary = np.ones(1000000)
+        del temporary
+        stimer.stop('test_memory', verbose=False)
+        memory = stimer.memory_stats('test_memory')
+        self.assertGreaterEqual(memory['peak'], data.nbytes)
+        self.assertLess(memory['net'], data.nbytes / 2)
+
+        # copies that are freed in a loop are listed with their size at
+        # the peak, not with what is left of them at the end
+        stimer.start('test_memory', track_memory=True)
+        for i in range(20):
+            copy = data.copy()
+            copy += 1
+            del copy
+        stimer.stop('test_memory', verbose=False)
+        memory = stimer.memory_stats('test_memory')
+        site, size, net = memory['top'][0]
+        self.assertIn('stimer_ut.py', site)
+        self.assertGreaterEqual(size, data.nbytes)
+        self.assertLess(net, data.nbytes / 2)
+
+    def test_memory_event_log(self):
+        # the event log allocates 24 MB at its first event, which is not
+        # memory of the section, the log is empty only in a new process
+        code = ('import stimer\n'
+                'stimer.start("section", track_memory=True)\n'
+                'stimer.start("inner")\n'
+                'stimer.stop("inner", verbose=False)\n'
+                'stimer.stop("section", verbose=False)\n'
+                'print(stimer.memory_stats("section")["peak"])')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(
+            os.path.abspath(stimer.__file__))))
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        self.assertLess(int(output), 1000000)
+
+    def test_profiler(self):
+        prof = stimer.Profiler()
+        @prof('compute')
+        def compute():
+            with prof('inner'):
+                pass
+        for i in range(3):
+            with prof('load'):
+                with prof('parse'):
+                    pass
+                compute()
+        prof.start('plot')
+        prof.start('axis')
+        prof.stop('axis')
+        self.assertIsNone(prof.stop('axis'))
+        self.assertIsNotNone(prof.stop())
+        stats = {row['path']: row for row in prof.stats()}
+        self.assertEqual({path: row['count'] for path, row in stats.items()},
+                         {'load': 3, 'load/parse': 3, 'load/compute': 3,
+                          'load/compute/inner': 3, 'plot': 1, 'plot/axis': 1})
+        self.assertEqual(stats['load/compute/inner']['depth'], 2)
+        load = stats['load']
+        self.assertAlmostEqual(load['self'], load['total'] - stats['load/parse']['total']
+                               - stats['load/compute']['total'])
+        self.assertIn('compute', prof.report(file=os.devnull))
+        @prof
+        def plot():
+            pass
+        plot()
+        self.assertIn(plot.__qualname__, [row['path'] for row in prof.stats()])
+        prof.reset()
+        self.assertEqual(prof.stats(), [])
+
+        # coroutines are timed while they are awaited, generators at each step
+        @prof('fetch')
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 1
+        @prof('read')
+        def read():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+            return 'done'
+        self.assertEqual(asyncio.run(fetch()), 1)
+        self.assertEqual(list(read()), [0, 1, 2])
+        stats = {row['path']: row for row in prof.stats()}
+        self.assertEqual(stats['fetch']['count'], 1)
+        self.assertGreaterEqual(stats['fetch']['total'], 0.04)
+        self.assertEqual(stats['read']['count'], 4)
+        self.assertGreaterEqual(stats['read']['total'], 0.025)
+
+    def test_profiler_threads_asyncio(self):
+        for scoped in [True, False]:
+            prof = stimer.Profiler(scoped=scoped)
+            for i in range(3000):  # more than one buffer
+                with prof('outer'):
+                    with prof('inner'):
+                        pass
+            stats = {row['path']: row['count'] for row in prof.stats()}
+            self.assertEqual(stats, {'outer': 3000, 'outer/inner': 3000})
+
+        prof = stimer.Profiler()
+        def thread():
+            for i in range(2000):
+                with prof('outer'):
+                    with prof('inner'):
+                        pass
+        threads = [threading.Thread(target=thread) for _ in range(4)]
+        for th in threads: th.start()
+        for th in threads: th.join()
+        stats = {row['path']: row['count'] for row in prof.stats()}
+        self.assertEqual(stats, {'outer': 8000, 'outer/inner': 8000})
+
+        # interleaving tasks are nested under their own sections, sections
+        # in asyncio.to_thread under the section that awaits them
+        prof = stimer.Profiler()
+        def blocking():
+            with prof('blocking'):
+                time.sleep(0.001)
+        async def task(name):
+            with prof(name):
+                for i in range(3):
+                    with prof('step'):
+                        await asyncio.sleep(0.001)
+                await asyncio.to_thread(blocking)
+        async def main():
+            await asyncio.gather(task('a'), task('b'))
+        asyncio.run(main())
+        stats = {row['path']: row['count'] for row in prof.stats()}
+        self.assertEqual(stats, {'a': 1, 'a/step': 3, 'a/blocking': 1,
+                                 'b': 1, 'b/step': 3, 'b/blocking': 1})
+
+    def test_profiler_max_samples(self):
+        # reservoir sampling keeps a uniform sample of all durations
+        np.random.seed(0)
+        node = _Node('test')
+        for i in range(100):
+            node.buffer.extend(range(i * 1000, (i + 1) * 1000))
+            node.flush(max_samples=1000)
+        self.assertEqual(node.count, 100000)
+        self.assertEqual(node.total, sum(range(100000)))
+        self.assertEqual((node.min, node.max), (0, 99999))
+        self.assertEqual(len(node.samples), 1000)
+        counts, _ = np.histogram(node.samples, bins=10, range=(0, 100000))
+        self.assertTrue(all(60 < count < 140 for count in counts), counts)
+
+        prof = stimer.Profiler(max_samples=100)
+        for i in range(5000):
+            with prof('section'):
+                pass
+        row = prof.stats()[0]
+        self.assertEqual(row['count'], 5000)
+        self.assertLessEqual(row['min'], row['p50'])
+        self.assertLessEqual(row['p50'], row['p99'])
+        self.assertLessEqual(row['p99'], row['max'])
+
+    def test_events_export(self):
+        stimer.events(clear=True)
+        prof = stimer.Profiler(log_events=True)
+        for i in range(3):
+            stimer.start('event')
+            stimer.stop('event', verbose=False)
+        with prof('section'):
+            pass
+        log = stimer.events()
+        self.assertEqual(log['name'].tolist(), ['event'] * 3 + ['section'])
+        self.assertEqual(set(log['thread']), {threading.current_thread().name})
+        self.assertTrue(all(np.diff(log['start_ns']) >= 0))
+        self.assertTrue(abs(log['start_ns'][0] / 1e9 - time.time()) < 60)
+        self.assertEqual(log['dropped'], 0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, 'events.json')
+            self.assertEqual(stimer.export(file, format='json'), 4)
+            with open(file, 'r') as f:
+                content = json.load(f)
+            self.assertEqual([event['name'] for event in content['events']],
+                             log['name'].tolist())
+            self.assertEqual(content['events'][0]['duration_ns'], log['duration_ns'][0])
+
+            file = os.path.join(tmp, 'events.csv')
+            stimer.export(file, format='csv')
+            with open(file, 'r', newline='') as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ['name', 'thread', 'start_ns', 'duration_ns'])
+            self.assertEqual([row[0] for row in rows[1:]], log['name'].tolist())
+
+            file = os.path.join(tmp, 'events.trace.json')
+            stimer.export(file, format='chrome', clear=True)
+            with open(file, 'r') as f:
+                trace = json.load(f)['traceEvents']
+            complete = [event for event in trace if event['ph'] == 'X']
+            self.assertEqual([event['name'] for event in complete], log['name'].tolist())
+            self.assertEqual(complete[0]['ts'], 0)
+            self.assertEqual([event['ph'] for event in trace if event['ph'] == 'M'], ['M'])
+            with self.assertRaises(ValueError):
+                stimer.export(file, format='xml')
+        self.assertEqual(len(stimer.events()['name']), 0)
+
+        # the ring buffer keeps the newest events, reading takes one slot
+        log = _EventLog(capacity=8)
+        for i in range(20):
+            log.record(str(i), i, 1.0)
+        events = log.events()
+        self.assertEqual(events['name'].tolist(), [str(i) for i in range(13, 20)])
+        self.assertEqual(events['dropped'], 13)
+
+    def test_mann_whitney(self):
+        # U and p from scipy.stats.mannwhitneyu(a, b, method='asymptotic')
+        a = [1.83, 0.50, 1.62, 2.48, 1.68, 1.88, 1.55, 3.06, 1.30]
+        b = [0.878, 0.647, 0.598, 2.05, 1.06, 1.29, 1.06, 3.14, 1.29]
+        u, p = mann_whitney(a, b)
+        self.assertEqual(u, 58.0)
+        self.assertAlmostEqual(p, 0.1329, places=3)
+        u, p = mann_whitney([1, 2, 3], [1, 2, 3])
+        self.assertEqual((u, p), (4.5, 1.0))
+        u, p = mann_whitney([1] * 5, [1] * 5)  # all tied
+        self.assertEqual(p, 1.0)
+
+    def test_bench_compare(self):
+        rng = np.random.default_rng(0)
+        base = stimer.BenchResult('base', rng.normal(1.0, 0.01, 100))
+        same = stimer.BenchResult('same', rng.normal(1.0, 0.01, 100))
+        slower = stimer.BenchResult('slower', rng.normal(1.1, 0.01, 100))
+        faster = stimer.BenchResult('faster', rng.normal(0.9, 0.01, 100))
+        self.assertEqual(same.compare(base)['verdict'], 'same')
+        self.assertEqual(slower.compare(base)['verdict'], 'slower')
+        self.assertEqual(faster.compare(base.to_dict())['verdict'], 'faster')
+        # significant, but below the threshold
+        self.assertEqual(slower.compare(base, threshold=0.2)['verdict'], 'same')
+        self.assertAlmostEqual(slower.compare(base)['change'], 0.1, places=2)
+        restored = stimer.BenchResult.from_dict(base.to_dict())
+        np.testing.assert_array_equal(restored.times, base.times)
+
+        result = stimer.bench(sorted, list(range(100)), budget=0.05, warmup=0.01,
+                              verbose=False)
+        self.assertEqual(result.name, 'sorted')
+        self.assertGreaterEqual(len(result.times), 5)
+        self.assertGreater(result.loops, 1)
+        low, high = result.ci()
+        self.assertLessEqual(low, result.median)
+        self.assertLessEqual(result.median, high)
+        self.assertIn('sorted: median', str(result))
+
+    def test_bench_cli(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'bench_test.py'), 'w') as f:
+                f.write('def bench_sum():\n    sum(range(100))\n\n'
+                        'def bench_fails():\n    raise ValueError\n\n'
+                        'def helper():\n    pass\n')
+            results = os.path.join(tmp, 'results')
+            kwargs = dict(budget=0.02, warmup=0.01, results=results)
+            self.assertEqual(run_benchmarks(tmp, **kwargs), 1)  # one failed
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', **kwargs), 0)
+            files = os.listdir(results)
+            self.assertEqual(len(files), 1)
+            with open(os.path.join(results, files[0]), 'r') as f:
+                stored = json.load(f)
+            self.assertEqual(list(stored['results']), ['bench_test.bench_sum'])
+
+            baseline = os.path.join(tmp, 'baseline.json')
+            times = [1e-9] * 10  # the stored run was much faster
+            with open(baseline, 'w') as f:
+                json.dump({'results': {'bench_test.bench_sum':
+                                       {'name': 'bench_sum', 'times': times}}}, f)
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', baseline=baseline,
+                                            save=False, **kwargs), 1)
+            times = [1.0] * 10
+            with open(baseline, 'w') as f:
+                json.dump({'results': {'bench_test.bench_sum':
+                                       {'name': 'bench_sum', 'times': times}}}, f)
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', baseline=baseline,
+                                            save=False, **kwargs), 0)
+            self.assertEqual(run_benchmarks(tmp, baseline='no-such-commit', **kwargs), 1)
+
+    def test_bench_cli_dirty(self):
+        # results of uncommitted changes are kept apart from the commit
+        with tempfile.TemporaryDirectory() as tmp:
+            def git(*args):
+                subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test',
+                                *args], cwd=tmp, check=True, capture_output=True)
+            bench_file = os.path.join(tmp, 'bench_test.py')
+            with open(bench_file, 'w') as f:
+                f.write('def bench_sum():\n    sum(range(100))\n')
+            git('init')
+            git('add', 'bench_test.py')
+            git('commit', '-m', 'bench')
+            results = os.path.join(tmp, 'results')
+            kwargs = dict(budget=0.02, warmup=0.01, results=results)
+            self.assertEqual(run_benchmarks(tmp, **kwargs), 0)
+            clean = os.listdir(results)
+            self.assertEqual(len(clean), 1)
+            self.assertFalse(clean[0].endswith('-dirty.json'))
+
+            with open(bench_file, 'a') as f:
+                f.write('\ndef bench_slow():\n    sum(range(10000))\n')
+            self.assertEqual(run_benchmarks(tmp, **kwargs), 0)
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', **kwargs), 0)
+            dirty = [file for file in os.listdir(results) if file not in clean]
+            self.assertEqual(len(dirty), 1)
+            self.assertTrue(dirty[0].endswith('-dirty.json'))
+            with open(os.path.join(results, dirty[0]), 'r') as f:
+                stored = json.load(f)
+            # replaced by the last dirty run, not merged
+            self.assertTrue(stored['dirty'])
+            self.assertEqual(list(stored['results']), ['bench_test.bench_sum'])
+            with open(os.path.join(results, clean[0]), 'r') as f:
+                stored = json.load(f)
+            self.assertFalse(stored['dirty'])
+            self.assertEqual(list(stored['results']), ['bench_test.bench_sum'])
+            # the baseline of the commit are the clean results, only
+            # whether they are found is tested, not the timing
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', baseline='HEAD', save=False,
+                                            threshold=1000, **kwargs), 0)
+            os.remove(os.path.join(results, clean[0]))
+            self.assertEqual(run_benchmarks(tmp, pattern='sum', baseline='HEAD', save=False,
+                                            threshold=1000, **kwargs), 1)
+
+    def test_line_profile(self):
+        profiler = stimer.LineProfiler()
+        @profiler
+        def loop(n):
+            total = 0
+            for i in range(n):
+                total += i
+            return total
+        @profiler
+        def generator(n):
+            for i in range(n):
+                yield i
+        @profiler
+        def fails():
+            raise ValueError
+        self.assertEqual(loop(10), 45)
+        self.assertEqual(list(generator(4)), [0, 1, 2, 3])
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                fails()
+        code = getattr(loop, '__wrapped__', loop).__code__
+        first = code.co_firstlineno + 1  # the line of def, after the decorator
+        lines = profiler.lines[code]
+        self.assertEqual(lines[first + 1][0], 1)   # total = 0
+        self.assertEqual(lines[first + 3][0], 10)  # total += i
+        self.assertEqual(lines[first + 4][0], 1)   # return
+        hits = {code.co_name: sum(hits for hits, seconds in lines.values())
+                for code, lines in profiler.lines.items()}
+        self.assertEqual(hits['fails'], 2)
+        self.assertGreaterEqual(hits['generator'], 8)
+        report = profiler.report(file=os.devnull)
+        self.assertIn('Function: loop', report)
+        self.assertIn('total += i', report)
+        profiler.reset()
+        self.assertFalse(any(profiler.lines.values()))
+        # the exceptions didn't leave frames of fails() on the stack
+        loop(3)
+        self.assertEqual(profiler.lines[code][first + 3][0], 3)
+
+    def test_line_profile_many(self):
+        # sys.monitoring has 6 tool ids, all profilers share one of them
+        def loop():
+            total = 0
+            for i in range(10):
+                total += i
+            return total
+        first = loop.__code__.co_firstlineno
+        profilers = []
+        for i in range(8):
+            profiler = stimer.LineProfiler()
+            self.assertEqual(profiler(loop)(), 45)
+            profilers.append(profiler)
+        for profiler in profilers:
+            # with sys.monitoring, also the calls of the later profilers
+            self.assertGreaterEqual(profiler.lines[loop.__code__][first + 3][0], 10)
+        self.assertEqual(profilers[-1].lines[loop.__code__][first + 3][0], 10)
+        for profiler in profilers:
+            profiler.disable()
+        self.assertNotIn(loop.__code__, _monitored)
+        loop()
+        self.assertEqual(profilers[-1].lines[loop.__code__][first + 3][0], 10)
+
+        # profilers that are garbage collected release the functions too
+        for i in range(8):
+            profiler = stimer.LineProfiler()
+            profiler(loop)()
+        del profiler, profilers
+        gc.collect()
+        self.assertNotIn(loop.__code__, _monitored)
+        if hasattr(sys, 'monitoring') and not _monitored:
+            tools = [sys.monitoring.get_tool(tool) for tool in range(6)]
+            self.assertNotIn('stimer.profile', tools)
+
+    def test_sample(self):
+        def work():
+            end = time.perf_counter() + 0.3
+            while time.perf_counter() < end:
+                sum(range(1000))
+        # all threads are sampled, other tests may leave threads running
+        done = threading.Event()
+        waiting = threading.Thread(target=done.wait, name='test_sample_waiting')
+        waiting.start()
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, 'work.collapsed')
+            with stimer.sample(interval_ms=5, file=file) as sampler:
+                work()
+            done.set()
+            waiting.join()
+            self.assertGreater(sampler.samples, 5)
+            with open(file, 'r') as f:
+                lines = f.read().splitlines()
+        stacks = {}
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            stacks[stack] = int(count)
+        self.assertTrue(any(stack.startswith('test_sample_waiting;') for stack in stacks))
+        own = {stack: count for stack, count in stacks.items()
+               if stack.startswith(threading.current_thread().name + ';')}
+        self.assertTrue(any('work (stimer_ut.py' in stack for stack in own), stacks)
+        self.assertLessEqual(sum(own.values()), sampler.samples)
+
+
+
+if __name__ == '__main__':
+    unittest.main()